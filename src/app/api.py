@@ -1,15 +1,22 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 
 from .embeddings.cloudflare.views import router as cloudflare_embeddings_router
 from .embeddings.qdrant.views import router as qdrant_embeddings_router
 from .namespace.qdrant.views import router as qdrant_namespace_router
 from .namespace.cloudflare.views import router as cloudflare_namespace_router
+from .jobs.views import router as jobs_router
+from .deps.cloudflare import embedding_cache, embedding_batcher
+from .lib.metrics import registry
 
 
 api_router = APIRouter(
     prefix="/api/v1"
 )
 
+# served at the root, where Prometheus expects to scrape
+metrics_router = APIRouter()
+
 api_router.include_router(
     cloudflare_embeddings_router
 )
@@ -22,8 +29,26 @@ api_router.include_router(
 api_router.include_router(
     cloudflare_namespace_router
 )
+api_router.include_router(
+    jobs_router
+)
 
 
 @api_router.get("/healthcheck", include_in_schema=False)
 def healthcheck():
     return {"status": "ok"}
+
+
+@api_router.get("/cache/embeddings", include_in_schema=False)
+def embedding_cache_stats():
+    return embedding_cache.stats()
+
+
+@api_router.get("/batching/embeddings", include_in_schema=False)
+def embedding_batching_stats():
+    return embedding_batcher.stats()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.exposition(), media_type=registry.content_type)
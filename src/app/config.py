@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Literal
 
 from pydantic_settings import BaseSettings
 
@@ -14,15 +14,83 @@ class Settings(BaseSettings):
     CLOUDFLARE_API_ACCOUNT_ID: str
     CLOUDFLARE_API_TOKEN: str
     CLOUDFLARE_D1_DATABASE_IDENTIFIER: str
+    CLOUDFLARE_HTTP_POOL_SIZE: int = 100
+    CLOUDFLARE_HTTP_TIMEOUT: float = 60
+
+    # Start the D1 lookup of the next listing page whilst the current one is assembled, for sequential scans.
+    # A prefetched page is reused for up to CLOUDFLARE_LISTING_PREFETCH_TTL seconds, so its sources may be that stale
+    CLOUDFLARE_LISTING_PREFETCH: bool = False
+    CLOUDFLARE_LISTING_PREFETCH_TTL: float = 5
+
+    # Embedding cache, set the size to 0 and leave the path unset to disable
+    EMBEDDING_CACHE_SIZE: int = 10000
+    EMBEDDING_CACHE_PATH: Optional[str] = None
+
+    # Coalescing of concurrent query embeddings into shared Workers AI calls
+    EMBEDDING_BATCH_MAX_SIZE: int = 100
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5
 
     # Qdrant
     QDRANT_HOST: str
     QDRANT_HTTP_PORT: int
     QDRANT_GRPC_PORT: Optional[int] = 6334
+    QDRANT_PREFER_GRPC: bool = False
+    QDRANT_POOL_SIZE: int = 100
+    QDRANT_TIMEOUT: int = 30
+    QDRANT_UPSERT_BATCH_SIZE: int = 256
+
+    # Deepest offset reachable by page number when listing Qdrant embeddings, beyond which `cursor` is required
+    QDRANT_MAX_PAGE_OFFSET: int = 10000
+
+    # Defaults for bulk loads into Qdrant: points per upsert and upserts in flight
+    QDRANT_BULK_BATCH_SIZE: int = 1000
+    QDRANT_BULK_PARALLEL: int = 8
+
+    # Number of ingestion sub-batches (embed + upsert) in flight per request
+    INGESTION_CONCURRENCY: int = 4
+
+    # Longest line accepted in an NDJSON upload, in bytes once decompressed
+    UPLOAD_MAX_LINE_SIZE: int = 1024 * 1024
+
+    # Where the source text of Qdrant embeddings is stored: Cloudflare D1, or a local SQLite file
+    SOURCE_STORE: Literal["d1", "sqlite"] = "d1"
+    SOURCE_STORE_PATH: str = "sources.db"
+
+    # Asynchronous ingestion jobs, persisted to a local SQLite queue. A running job is held under
+    # a lease of JOB_LEASE seconds, renewed whilst it runs, after which another worker may take it over
+    JOB_QUEUE_PATH: str = "jobs.db"
+    JOB_WORKERS: int = 2
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_DELAY: float = 2
+    JOB_POLL_INTERVAL: float = 1
+    JOB_LEASE: float = 60
+
+    # Retries of transient upstream failures (Workers AI, Vectorize, D1 and Qdrant): attempts per call,
+    # backoff bounds and the overall deadline in seconds, and the circuit breaker which fails calls fast
+    # once an upstream has failed `UPSTREAM_BREAKER_THRESHOLD` times in a row
+    UPSTREAM_RETRY_ATTEMPTS: int = 4
+    UPSTREAM_RETRY_DELAY: float = 0.25
+    UPSTREAM_RETRY_MAX_DELAY: float = 4
+    UPSTREAM_RETRY_DEADLINE: float = 15
+    UPSTREAM_BREAKER_THRESHOLD: int = 5
+    UPSTREAM_BREAKER_RESET: float = 30
+
+    # Per-request stage timings, returned in a `Server-Timing` header and optionally exported as spans:
+    # `file` appends them to TRACE_FILE_PATH as OTLP/JSON lines, `otlp` sends them to an OpenTelemetry
+    # collector at TRACE_OTLP_ENDPOINT (requires the OpenTelemetry SDK and OTLP/HTTP exporter)
+    SERVER_TIMING: bool = True
+    TRACE_EXPORTER: Optional[Literal["file", "otlp"]] = None
+    TRACE_FILE_PATH: str = "traces.jsonl"
+    TRACE_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
 
     # Optional authentication
     ADMIN_SECRET_KEY: Optional[str] = None
 
+    # Seconds for which namespace existence and vector configuration are cached, and for which
+    # a missing namespace is remembered (0 to always look it up again)
+    NAMESPACE_CACHE_TTL: float = 300
+    NAMESPACE_MISS_CACHE_TTL: float = 5
+
     # Optional namespace key
     NAMESPACE: Optional[str] = "synapse"
 
@@ -3,15 +3,43 @@ from fastapi import Depends
 
 from app.config import settings
 
-from app.lib.cloudflare.api import API
+from app.lib.cloudflare.async_api import AsyncAPI, WORKERS_AI, VECTORIZE, D1, retry_policy
+from app.lib.cloudflare.cache import EmbeddingCache
+from app.lib.cloudflare.batching import EmbeddingBatcher
 
 
-def cloudflare_api_client():
-    return API(
-        api_token=settings.CLOUDFLARE_API_TOKEN,
-        account_id=settings.CLOUDFLARE_API_ACCOUNT_ID
-    )
+embedding_cache = EmbeddingCache(
+    max_size=settings.EMBEDDING_CACHE_SIZE,
+    path=settings.EMBEDDING_CACHE_PATH
+)
+
+# shared across requests so that upstream connections are pooled and kept alive
+cloudflare = AsyncAPI(
+    api_token=settings.CLOUDFLARE_API_TOKEN,
+    account_id=settings.CLOUDFLARE_API_ACCOUNT_ID,
+    cache=embedding_cache,
+    pool_size=settings.CLOUDFLARE_HTTP_POOL_SIZE,
+    timeout=settings.CLOUDFLARE_HTTP_TIMEOUT,
+    retry_policies={upstream: retry_policy(
+        upstream,
+        failure_threshold=settings.UPSTREAM_BREAKER_THRESHOLD,
+        reset_timeout=settings.UPSTREAM_BREAKER_RESET,
+        tries=settings.UPSTREAM_RETRY_ATTEMPTS,
+        delay=settings.UPSTREAM_RETRY_DELAY,
+        max_delay=settings.UPSTREAM_RETRY_MAX_DELAY,
+        deadline=settings.UPSTREAM_RETRY_DEADLINE
+    ) for upstream in (WORKERS_AI, VECTORIZE, D1)}
+)
+
+embedding_batcher = EmbeddingBatcher(
+    client=cloudflare,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait=settings.EMBEDDING_BATCH_MAX_WAIT_MS / 1000
+)
 
 
-CloudflareClient = Annotated[API, Depends(cloudflare_api_client)]
+def cloudflare_api_client():
+    return cloudflare
+
 
+CloudflareClient = Annotated[AsyncAPI, Depends(cloudflare_api_client)]
@@ -0,0 +1,27 @@
+from typing import Annotated
+from fastapi import Depends
+
+from app.config import settings
+
+from app.jobs.queue import JobQueue
+from app.jobs.workers import JobWorkers
+
+
+job_queue = JobQueue(path=settings.JOB_QUEUE_PATH)
+
+# started and stopped by the application's lifespan hook
+job_workers = JobWorkers(
+    queue=job_queue,
+    concurrency=settings.JOB_WORKERS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_delay=settings.JOB_RETRY_DELAY,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    lease=settings.JOB_LEASE
+)
+
+
+def job_queue_client():
+    return job_queue
+
+
+JobQueueClient = Annotated[JobQueue, Depends(job_queue_client)]
@@ -1,18 +1,48 @@
 from typing import Annotated
 
-from fastapi import Depends
+import httpx
+
+from fastapi import Depends, Request
 
 from qdrant_client.async_qdrant_client import AsyncQdrantClient
 
 from app.config import settings
+from app.lib.qdrant import add_retry_policy, retry_policy
 
 
-def qdrant_api_client():
-    yield AsyncQdrantClient(
+def create_qdrant_client() -> AsyncQdrantClient:
+    """
+    Build the process-wide Qdrant client. REST connections are pooled up to `QDRANT_POOL_SIZE`,
+    whereas gRPC (`QDRANT_PREFER_GRPC`) multiplexes every request over a single channel.
+    Transient REST failures are retried, behind a circuit breaker.
+    """
+    client = AsyncQdrantClient(
         host=settings.QDRANT_HOST,
         port=settings.QDRANT_HTTP_PORT,
-        grpc_port=settings.QDRANT_GRPC_PORT
+        grpc_port=settings.QDRANT_GRPC_PORT,
+        prefer_grpc=settings.QDRANT_PREFER_GRPC,
+        timeout=settings.QDRANT_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=settings.QDRANT_POOL_SIZE,
+            max_keepalive_connections=settings.QDRANT_POOL_SIZE
+        )
     )
+    add_retry_policy(client, retry_policy(
+        failure_threshold=settings.UPSTREAM_BREAKER_THRESHOLD,
+        reset_timeout=settings.UPSTREAM_BREAKER_RESET,
+        tries=settings.UPSTREAM_RETRY_ATTEMPTS,
+        delay=settings.UPSTREAM_RETRY_DELAY,
+        max_delay=settings.UPSTREAM_RETRY_MAX_DELAY,
+        deadline=settings.UPSTREAM_RETRY_DEADLINE
+    ))
+    return client
+
+
+def qdrant_api_client(request: Request) -> AsyncQdrantClient:
+    if getattr(request.app.state, "qdrant", None) is None:
+        # the lifespan hook hasn't run, e.g. when serving requests through a bare TestClient
+        request.app.state.qdrant = create_qdrant_client()
+    return request.app.state.qdrant
 
 
 QdrantClient = Annotated[AsyncQdrantClient, Depends(qdrant_api_client)]
@@ -1,19 +1,38 @@
-from typing import Annotated
+import base64
+import json
+
+from typing import Annotated, Any, Optional
 
 from fastapi import Depends
 from fastapi import Query
 
+from app.exceptions import BadRequestException
+
+
+def encode_cursor(value: Any) -> str:
+    """Wrap an upstream paging offset in an opaque, URL-safe token"""
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise BadRequestException(f"Invalid pagination cursor: '{cursor}'")
+
 
 def common_params(
     page: int = Query(default=1, gte=1, lt=2147483647),
-    limit: int = Query(default=10, gte=1, lt=2147483647)
+    limit: int = Query(default=10, gte=1, lt=2147483647),
+    cursor: Optional[str] = Query(default=None, description="Opaque `next_cursor` from a previous page")
 ):
     offset = (page - 1) * limit
     return {
         "page": page,
         "limit": limit,
-        "offset": offset
+        "offset": offset,
+        "cursor": decode_cursor(cursor) if cursor is not None else None
     }
 
 
-CommonParams = Annotated[dict[int], Depends(common_params)]
\ No newline at end of file
+CommonParams = Annotated[dict[int], Depends(common_params)]
@@ -0,0 +1,17 @@
+from app.config import settings
+
+from app.lib.sources import SourceStore, D1SourceStore, SQLiteSourceStore
+
+from .cloudflare import cloudflare
+
+
+def create_source_store() -> SourceStore:
+    if settings.SOURCE_STORE == "sqlite":
+        return SQLiteSourceStore(path=settings.SOURCE_STORE_PATH)
+    return D1SourceStore(
+        client=cloudflare,
+        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER
+    )
+
+
+source_store = create_source_store()
@@ -0,0 +1,16 @@
+from typing import Optional
+
+from app.config import settings
+
+from app.lib.timing import SpanExporter, FileSpanExporter, OpenTelemetrySpanExporter
+
+
+def create_span_exporter() -> Optional[SpanExporter]:
+    if settings.TRACE_EXPORTER == "file":
+        return FileSpanExporter(path=settings.TRACE_FILE_PATH, service_name=settings.PROJECT_NAME)
+    if settings.TRACE_EXPORTER == "otlp":
+        return OpenTelemetrySpanExporter(endpoint=settings.TRACE_OTLP_ENDPOINT, service_name=settings.PROJECT_NAME)
+    return None
+
+
+span_exporter = create_span_exporter()
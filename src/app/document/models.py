@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from pydantic import BaseModel
 
 from qdrant_client.http.models import VectorStruct
@@ -8,11 +8,16 @@ from app.models import Pagination
 
 class DocumentRead(BaseModel):
     id: str
-    source: str
+    source: Optional[str] = None
     payload: Optional[Dict[str, Any]]
     score: Optional[float]
-    vector: Optional[VectorStruct]
+    vector: Optional[Union[VectorStruct, str]]
 
 
 class DocumentPagination(Pagination):
     items: List[DocumentRead]
+
+
+class DocumentBatch(BaseModel):
+    count: int
+    items: List[DocumentPagination]
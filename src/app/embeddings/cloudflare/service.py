@@ -1,23 +1,34 @@
 import CloudFlare
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
 
-from app.lib.cloudflare.api import API
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.lib.cloudflare.constants import MAX_VECTORIZE_BATCH_SIZE
 from app.lib.cloudflare.models import VectorPayloadItem, CreateDatabaseRecord
 
-from app.embeddings.models import EmbeddingRead, EmbeddingCreateMulti
-from app.models import InsertionResult
+from app.embeddings.models import EmbeddingRead, EmbeddingCreateMulti, EmbeddingsCreateSingle, EmbeddingPagination
+from app.models import InsertionResult, BatchResult
 
-from app.embeddings.utils import merge_metadata, source_key
-from app.exceptions import UnknownThirdPartyException, NotFoundException
+from app.embeddings.utils import merge_metadata, source_key, dispatch_batches, stream_upload, embed_inputs
+from app.embeddings.utils import check_vector_dimensionality
+from app.exceptions import UnknownThirdPartyException, NotFoundException, BadRequestException
+from app.deps.request_params import CommonParams, encode_cursor
+from app.lib.prefetch import Prefetcher
+from app.lib.vectors import EncodingFormat, encode_vector
+from app.lib.timing import stage
+from app.namespace.registry import namespace_registry, cloudflare_namespace, validate_dimensionality, NamespaceInfo, CLOUDFLARE
 
 
 from app.config import settings
 
 
-def delete(client: API, namespace: str, embedding_ids: List[str]) -> Dict[str, Any]:
+# D1 listing pages fetched ahead of the request for them, keyed by namespace, last seen id and page size
+listing_prefetcher = Prefetcher(ttl=settings.CLOUDFLARE_LISTING_PREFETCH_TTL)
+
+
+async def delete(client: AsyncAPI, namespace: str, embedding_ids: List[str]) -> Dict[str, Any]:
     try:
-        return client.delete_vectors_by_ids(
+        return await client.delete_vectors_by_ids(
             vector_index_name=namespace,
             ids=embedding_ids
         )
@@ -25,65 +36,252 @@ def delete(client: API, namespace: str, embedding_ids: List[str]) -> Dict[str, A
         raise UnknownThirdPartyException(str(ex))
 
 
-def get(client: API, namespace: str, embedding_ids: List[str]) -> List[EmbeddingRead]:
-    vector_results = client.vectors_by_ids(
-        vector_index_name=namespace,
-        ids=embedding_ids
-    )
+async def get(
+    client: AsyncAPI,
+    namespace: str,
+    embedding_ids: List[str],
+    encoding_format: EncodingFormat = "float"
+) -> List[EmbeddingRead]:
+    with stage("fetch"):
+        vector_results = await client.vectors_by_ids(
+            vector_index_name=namespace,
+            ids=embedding_ids
+        )
     if len(vector_results) != len(embedding_ids):
         not_found_ids = set(embedding_ids) - set(o.get("id") for o in vector_results)
         raise NotFoundException(
             f"vectors with ids {not_found_ids} not found in the {namespace} namespace"
         )
 
-    return [EmbeddingRead(
+    return [EmbeddingRead.model_construct(
         id=o.get("id"),
-        vector=o.get('values'),
+        vector=encode_vector(o.get('values'), encoding_format),
         payload=o.get('metadata'),
         source=o.get('metadata', {}).pop(source_key(), None)
     ) for o in vector_results]
 
 
-def insert(
-    client: API,
+async def database_records_page(client: AsyncAPI, namespace: str, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """One more record than `limit` is fetched, to tell whether another page follows"""
+    try:
+        with stage("d1"):
+            return await client.list_database_table_records(
+                database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
+                table_name=namespace,
+                limit=limit + 1,
+                after_id=after_id
+            )
+    except CloudFlare.exceptions.CloudFlareAPIError as ex:
+        raise UnknownThirdPartyException(str(ex))
+
+
+async def embeddings(
+    client: AsyncAPI,
+    namespace: str,
+    common: CommonParams,
+    encoding_format: EncodingFormat = "float"
+) -> EmbeddingPagination:
+    """
+    Page through the D1 records of a namespace by `id`, hydrating each page with its Vectorize vectors.
+    The cursor holds the last `id` seen, so every page costs the same however deep it is.
+
+    With `CLOUDFLARE_LISTING_PREFETCH`, every page which has a successor also starts that page's D1 lookup,
+    whether or not the client goes on to request it.
+    """
+    limit = common.get("limit")
+    after_id = common.get("cursor")
+    if after_id is None:
+        after_id = 0
+        if common.get("offset"):
+            # without a cursor, find where the requested page starts with a single id-only lookup
+            try:
+                with stage("d1"):
+                    after_id = await client.database_table_record_id_at(
+                        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
+                        table_name=namespace,
+                        offset=common.get("offset") - 1
+                    )
+            except CloudFlare.exceptions.CloudFlareAPIError as ex:
+                raise UnknownThirdPartyException(str(ex))
+            if after_id is None:
+                return EmbeddingPagination(total=0, page=common.get("page"), items=[])
+    elif not isinstance(after_id, int):
+        raise BadRequestException("Invalid pagination cursor")
+
+    records = await listing_prefetcher.take((namespace, after_id, limit))
+    # new records are appended after the last id, so a prefetched page is complete unless it was the last one;
+    # sources updated in place since it was fetched are at most `listing_prefetcher.ttl` seconds out of date
+    if records is None or len(records) <= limit:
+        records = await database_records_page(client, namespace, after_id, limit)
+
+    next_after_id = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_after_id = records[-1].get('id')
+        if settings.CLOUDFLARE_LISTING_PREFETCH:
+            # overlap the next page's D1 lookup with this page's Vectorize lookup
+            listing_prefetcher.start(
+                (namespace, next_after_id, limit),
+                database_records_page(client, namespace, next_after_id, limit)
+            )
+
+    try:
+        with stage("fetch"):
+            vector_results = await client.vectors_by_ids(
+                vector_index_name=namespace,
+                ids=[o.get('vector_id') for o in records]
+            ) if records else []
+    except CloudFlare.exceptions.CloudFlareAPIError as ex:
+        raise UnknownThirdPartyException(str(ex))
+    vectors = {o.get('id'): o for o in vector_results}
+
+    items = []
+    for record in records:
+        vector = vectors.get(record.get('vector_id'))
+        if vector is None:
+            # deleted from the index since it was recorded
+            continue
+        payload = vector.get('metadata') or {}
+        source = payload.pop(source_key(), None)
+        items.append(EmbeddingRead.model_construct(
+            id=record.get('vector_id'),
+            source=source if source is not None else record.get('source'),
+            vector=encode_vector(vector.get('values'), encoding_format),
+            payload=payload
+        ))
+    return EmbeddingPagination.model_construct(
+        items=items,
+        itemsPerPage=limit,
+        total=len(items),
+        page=common.get("page"),
+        next_cursor=encode_cursor(next_after_id) if next_after_id is not None else None
+    )
+
+
+async def ensure_namespace(client: AsyncAPI, namespace: str, data_in: EmbeddingCreateMulti):
+    check_vector_dimensionality(data_in.inputs, data_in.embedding_model)
+    info = await cloudflare_namespace(client, namespace)
+    validate_dimensionality(namespace, info, data_in.embedding_model)
+    if not info.exists:
+        if not data_in.create_namespace:
+            raise NotFoundException(
+                f"Vector index with name '{namespace}' not found. "
+                f"Create the index via a separate call or include 'create_namespace' "
+                f"in your payload to automagically create and insert."
+            )
+
+        try:
+            res = await client.create_vector_index(
+                name=namespace,
+                preset=str(data_in.embedding_model)
+            )
+        except CloudFlare.exceptions.CloudFlareAPIError as ex:
+            # the index may have been created in the meantime, e.g. by another worker
+            namespace_registry.invalidate(CLOUDFLARE, namespace)
+            info = await cloudflare_namespace(client, namespace)
+            if not info.exists:
+                raise UnknownThirdPartyException(str(ex))
+            validate_dimensionality(namespace, info, data_in.embedding_model)
+        else:
+            namespace_registry.set(CLOUDFLARE, namespace, NamespaceInfo(
+                exists=True,
+                dimensionality=res.get('config', {}).get('dimensions'),
+                distance=res.get('config', {}).get('metric', '').lower()
+            ))
+
+
+def batch_size(data_in: EmbeddingCreateMulti) -> int:
+    return min(data_in.embedding_model.max_batch_size, MAX_VECTORIZE_BATCH_SIZE)
+
+
+async def insert(
+    client: AsyncAPI,
     namespace: str,
     data_in: EmbeddingCreateMulti,
-    vectors: List[List[float]]
+    progress: Optional[Callable[[BatchResult], Any]] = None
 ) -> InsertionResult[EmbeddingRead]:
-    vectors = [VectorPayloadItem(**{
+    await ensure_namespace(client, namespace, data_in)
+
+    return await dispatch_batches(
+        inputs=data_in.inputs,
+        batch_size=batch_size(data_in),
+        concurrency=settings.INGESTION_CONCURRENCY,
+        progress=progress,
+        process=lambda batch: insert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=batch
+        )
+    )
+
+
+async def upload(
+    client: AsyncAPI,
+    namespace: str,
+    data_in: EmbeddingCreateMulti,
+    lines: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """Insert NDJSON inputs as they are read, `data_in` providing the options shared by all of them"""
+    await ensure_namespace(client, namespace, data_in)
+    return stream_upload(
+        lines=lines,
+        batch_size=batch_size(data_in),
+        model=data_in.embedding_model,
+        concurrency=settings.INGESTION_CONCURRENCY,
+        process=lambda batch: insert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=batch
+        )
+    )
+
+
+async def insert_batch(
+    client: AsyncAPI,
+    namespace: str,
+    data_in: EmbeddingCreateMulti,
+    inputs: List[EmbeddingsCreateSingle]
+) -> List[str]:
+    with stage("embed"):
+        embeddings = await embed_inputs(client.embed, data_in.embedding_model, inputs)
+    vectors = [VectorPayloadItem.model_construct(**{
         "values": vector,
         "id": meta.id,
-        "metadata": merge_metadata(meta.payload, meta.text) if meta.persist_original else meta.payload
-    }) for vector, meta in zip(vectors, data_in.inputs)]
+        "metadata": merge_metadata(meta.payload, meta.text) if meta.persist_original else meta.payload or {}
+    }) for vector, meta in zip(embeddings, inputs)]
     try:
-        result = client.insert_vectors(
-            vector_index_name=namespace,
-            vectors=vectors,
-            create_on_not_found=data_in.create_namespace,
-            model_name=data_in.embedding_model
-        )
+        with stage("upsert"):
+            result = await client.insert_vectors(
+                vector_index_name=namespace,
+                vectors=vectors,
+                create_on_not_found=data_in.create_namespace,
+                model_name=data_in.embedding_model
+            )
 
         # writing to D1 is optional
         if settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER is not None:
             insertion_records = [CreateDatabaseRecord(
                 vector_id=vector_id,
                 source=meta.text
-            ) for vector_id, meta in zip(result.get('ids', []), data_in.inputs) if meta.persist_original]
+            ) for vector_id, meta in zip(result.get('ids', []), inputs) if meta.persist_original]
             # conditional, as the user can optionally not persist the source text from which
             # the embedding is derived
             if insertion_records:
-                insertion_result = client.upsert_database_table_records(
-                    database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
-                    table_name=namespace,
-                    records=insertion_records
-                )
+                with stage("d1"):
+                    insertion_result = await client.upsert_database_table_records(
+                        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
+                        table_name=namespace,
+                        records=insertion_records
+                    )
+    except NotFoundException:
+        # the cached namespace entry is stale, e.g. the index was deleted elsewhere
+        namespace_registry.invalidate(CLOUDFLARE, namespace)
+        raise
     except CloudFlare.exceptions.CloudFlareAPIError as ex:
         raise UnknownThirdPartyException(
             str(ex)
         )
 
-    items = [EmbeddingRead(id=o) for o in result.get('ids', [])]
-    return InsertionResult[EmbeddingRead](
-        count=len(items),
-        items=items
-    )
+    return result.get('ids', [])
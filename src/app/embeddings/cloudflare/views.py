@@ -1,30 +1,44 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Query, Request, status
 
 from ..models import EmbeddingRead
 from ..models import EmbeddingCreateMulti
 from ..models import EmbeddingPagination
 
 from app.models import InsertionResult
+from app.jobs.models import JobRead
+from app.jobs.service import enqueue
+from app.deps.jobs import JobQueueClient
+from app.namespace.registry import CLOUDFLARE
 from app.config import settings
 
-from .service import insert, get, delete
+from .service import insert, get, delete, upload, embeddings
 
 from ..models import EmbeddingDelete
 
 from app.deps.request_params import CommonParams
 from app.deps.cloudflare import CloudflareClient
-from app.embeddings.utils import source_key
+from app.embeddings.utils import ndjson_lines, is_gzipped
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.responses import DuplexStreamingResponse, ModelResponse
+from app.lib.vectors import EncodingFormat
+from app.lib.timing import TimedRoute
 
 from app.exceptions import EnvironmentVariableConfigException
 
 
-router = APIRouter(prefix="/embeddings/cloudflare")
+router = APIRouter(prefix="/embeddings/cloudflare", route_class=TimedRoute)
 
 
 @router.get("/{namespace}", response_model=EmbeddingPagination)
-async def get_embeddings(namespace: str, common: CommonParams, client: CloudflareClient):
+async def get_embeddings(
+    namespace: str,
+    common: CommonParams,
+    client: CloudflareClient,
+    encoding_format: EncodingFormat = Query(default="float")
+):
     """
     Page through embeddings.
+    Pass the `next_cursor` of a page as `cursor` to fetch the page that follows it.
     Only supported if a valid `CLOUDFLARE_D1_DATABASE_IDENTIFIER` environment variable has been set.
     """
     if settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER is None:
@@ -32,45 +46,35 @@ async def get_embeddings(namespace: str, common: CommonParams, client: Cloudflar
             "Support for listing embeddings is unavailable without integrating Cloudflare D1."
         )
 
-    response = client.list_database_table_records(
-        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
-        table_name=namespace,
-        limit=common.get("limit"),
-        offset=common.get("offset")
-    )
-    d1_results = {o.get('vector_id'): o for o in response[0].get('results', [])}
-
-    response = client.vectors_by_ids(
-        vector_index_name=namespace,
-        ids=list(d1_results.keys())
-    )
-    vectorize_results = {o.get('id'): o for o in response}
-    return EmbeddingPagination(
-        items=[EmbeddingRead(
-            id=vector_id,
-            source=vectorize_results.get(vector_id, {}).get('metadata', {}).pop(source_key(), None),
-            vector=vectorize_results.get(vector_id, {}).get('vector'),
-            payload=vectorize_results.get(vector_id, {}).get('metadata', {})
-        ) for vector_id, record in d1_results],
-        itemsPerPage=len(vectorize_results),
-        page=common.get("page")
-    )
+    return ModelResponse(await embeddings(
+        client=client,
+        namespace=namespace,
+        common=common,
+        encoding_format=encoding_format
+    ))
 
 
 @router.get("/{namespace}/{embedding_id}", response_model=EmbeddingRead)
-async def get_embedding(namespace: str, embedding_id: str, client: CloudflareClient):
+async def get_embedding(
+    namespace: str,
+    embedding_id: str,
+    client: CloudflareClient,
+    encoding_format: EncodingFormat = Query(default="float")
+):
     """Retrieve a single embedding vector by namespace and embedding `ID`"""
-    return get(
+    result = await get(
         client=client,
         namespace=namespace,
-        embedding_ids=[embedding_id]
-    )[0]
+        embedding_ids=[embedding_id],
+        encoding_format=encoding_format
+    )
+    return ModelResponse(result[0])
 
 
 @router.delete("/{namespace}/{embedding_id}", response_model=EmbeddingDelete)
 async def delete_embedding(namespace: str, embedding_id: str, client: CloudflareClient):
     """Delete an existing embedding by namespace and `ID`"""
-    result = delete(
+    result = await delete(
         client=client,
         namespace=namespace,
         embedding_ids=[embedding_id]
@@ -93,14 +97,53 @@ async def create_embedding(namespace: str, data_in: EmbeddingCreateMulti, client
     Persisting to Cloudflare D1 enables API support for paging through embeddings, i.e.,
     `/embeddings/cloudflare/{namespace}`. This is because the Cloudflare the Vectorize
     service does not natively support paging/scrolling through vectors at this time.
+
+    Large inputs are split into upstream-sized batches; the `batches` field of the
+    response reports the outcome of each, so that only failed batches need resubmitting.
     """
-    result = client.embed(
-        model=data_in.embedding_model.value,
-        texts=[o.text for o in data_in.inputs]
-    )
-    return insert(
+    return await insert(
         client=client,
-        vectors=result.get("data", []),
         namespace=namespace,
         data_in=data_in
     )
+
+
+@router.post("/{namespace}/jobs", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+async def create_embedding_job(namespace: str, data_in: EmbeddingCreateMulti, queue: JobQueueClient):
+    """
+    Queue the generation and persistence of embeddings, rather than waiting for them.
+    Poll `/jobs/{job_id}` for the job's progress and result.
+    """
+    return await enqueue(queue=queue, backend=CLOUDFLARE, namespace=namespace, data_in=data_in)
+
+
+@router.post("/{namespace}/upload", response_class=DuplexStreamingResponse)
+async def upload_embeddings(
+    namespace: str,
+    request: Request,
+    client: CloudflareClient,
+    embedding_model: CloudflareEmbeddingModels = Query(default=CloudflareEmbeddingModels.BAAIBase),
+    create_namespace: bool = Query(default=True)
+):
+    """
+    Generate and persist embeddings for a newline-delimited JSON upload, one `EmbeddingsCreateSingle`
+    object per line, which may be gzip compressed (`Content-Encoding: gzip`).
+    Inputs are processed in batches as the upload is read, with one progress line streamed back
+    per batch, one per invalid line, and a final summary line.
+    """
+    data_in = EmbeddingCreateMulti(
+        embedding_model=embedding_model,
+        create_namespace=create_namespace,
+        inputs=[]
+    )
+    stream = await upload(
+        client=client,
+        namespace=namespace,
+        data_in=data_in,
+        lines=ndjson_lines(
+            request.stream(),
+            gzipped=is_gzipped(request),
+            max_line_size=settings.UPLOAD_MAX_LINE_SIZE
+        )
+    )
+    return DuplexStreamingResponse(stream, media_type="application/x-ndjson")
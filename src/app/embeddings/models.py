@@ -1,14 +1,16 @@
 import uuid
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 from pydantic import Field
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 
 from app.models import Pagination
 
-from app.lib.cloudflare.api import CloudflareEmbeddingModels
-from app.lib.cloudflare.api import MAX_EMBEDDING_INPUT_TOKENS
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.cloudflare.constants import MAX_EMBEDDING_INPUT_TOKENS
+from app.lib.vectors import EncodingFormat, decode_vector
+from app.exceptions import BadRequestException
 
 
 class EmbeddingDelete(BaseModel):
@@ -18,7 +20,8 @@ class EmbeddingDelete(BaseModel):
 
 class EmbeddingRead(BaseModel):
     id: str
-    vector: Optional[List[float]] = None
+    # a list of floats, or a base64 string for the packed `encoding_format`s
+    vector: Optional[Union[List[float], str]] = None
     payload: Optional[Dict[str, Any]] = None
     source: Optional[str] = None
 
@@ -35,6 +38,24 @@ class EmbeddingsCreateSingle(BaseModel):
     text: str
     payload: Optional[Dict[str, Any]] = Field(default_factory=dict)
     persist_original: Optional[bool] = Field(default=False)
+    vector: Optional[Union[List[float], str]] = Field(
+        default=None,
+        description="Precomputed embedding of `text`, which is then not sent to the embedding model. "
+                    "A list of floats, or a base64 string packed as per `encoding_format`"
+    )
+    encoding_format: Optional[EncodingFormat] = Field(
+        default=None,
+        description="Packing of a base64 `vector`: `base64` (float32, the default) or `base64_float16`"
+    )
+
+    @model_validator(mode='after')
+    def decode_packed_vector(self) -> 'EmbeddingsCreateSingle':
+        if isinstance(self.vector, str):
+            try:
+                self.vector = decode_vector(self.vector, self.encoding_format or "base64")
+            except BadRequestException as ex:
+                raise ValueError(str(ex))
+        return self
 
 
 class EmbeddingCreateMulti(BaseModel):
@@ -53,3 +74,28 @@ class EmbeddingCreateMulti(BaseModel):
                     f"by the embedding model: {MAX_EMBEDDING_INPUT_TOKENS}."
                 )
         return v
+
+
+class BulkLoadOptions(BaseModel):
+    batch_size: Optional[int] = Field(default=None, gt=0, le=10000, description="Points per upsert")
+    parallel: Optional[int] = Field(default=None, gt=0, le=64, description="Upserts in flight")
+    wait: Optional[bool] = Field(
+        default=False,
+        description="Wait for each upsert to be applied, rather than only for a final consistency barrier"
+    )
+
+
+class QdrantEmbeddingCreateMulti(EmbeddingCreateMulti):
+    bulk: Optional[BulkLoadOptions] = Field(default=None)
+
+
+class EmbeddingUploadError(BaseModel):
+    line: int
+    detail: str
+
+
+class EmbeddingUploadResult(BaseModel):
+    count: int
+    failed: int
+    invalid: int
+    batches: int
@@ -1,6 +1,8 @@
 import re
+import uuid
+import asyncio
 
-from typing import List
+from typing import List, AsyncIterator, Optional, Callable, Any
 
 from fastapi import status
 from qdrant_client.async_qdrant_client import AsyncQdrantClient
@@ -10,41 +12,43 @@ from qdrant_client.http.models import UpdateStatus
 from qdrant_client.models import PointIdsList
 from qdrant_client.http.models import Distance, VectorParams
 
-from ..models import EmbeddingRead, EmbeddingPagination, EmbeddingCreateMulti, EmbeddingDelete
+from ..models import EmbeddingRead, EmbeddingPagination, EmbeddingCreateMulti, EmbeddingDelete, EmbeddingsCreateSingle
+from ..models import QdrantEmbeddingCreateMulti
 
-from app.lib.cloudflare.api import API, DIMENSIONALITY_PRESETS
+from app.lib.cloudflare.constants import DIMENSIONALITY_PRESETS
 from app.embeddings.utils import source_key
 from app.embeddings.utils import merge_metadata
+from app.embeddings.utils import dispatch_batches
+from app.embeddings.utils import embed_inputs
+from app.embeddings.utils import stream_upload
+from app.embeddings.utils import check_vector_dimensionality
 from app.exceptions import NotFoundException, UnknownThirdPartyException, EmbeddingDimensionalityException
+from app.exceptions import BadRequestException
+from app.namespace.registry import namespace_registry, qdrant_namespace, validate_dimensionality, NamespaceInfo, QDRANT
 
 from app.lib.cloudflare.models import CreateDatabaseRecord
+from app.lib.vectors import EncodingFormat, encode_vector
+from app.lib.serialization import dumps
+from app.lib.qdrant import observe_batch_size
+from app.lib.timing import stage
 
-from app.deps.request_params import CommonParams
-from app.models import InsertionResult
+from app.deps.request_params import CommonParams, encode_cursor
+from app.deps.cloudflare import cloudflare
+from app.deps.sources import source_store
+from app.models import InsertionResult, BatchResult
 
 from app.config import settings
 
 
-cloudflare = API(
-    api_token=settings.CLOUDFLARE_API_TOKEN,
-    account_id=settings.CLOUDFLARE_API_ACCOUNT_ID
-)
-
-
-async def embedding(client: AsyncQdrantClient, namespace: str, embedding_id: str):
+async def embedding(client: AsyncQdrantClient, namespace: str, embedding_id: str, encoding_format: EncodingFormat = "float"):
     try:
-        result = await client.retrieve(
-            collection_name=namespace,
-            ids=[embedding_id],
-            with_vectors=True,
-            with_payload=True
-        )
-        return EmbeddingRead(
-            id=result[0].id,
-            payload=result[0].payload,
-            vector=result[0].vector,
-            source=result[0].payload.pop(source_key(), None)
-        )
+        with stage("fetch"):
+            result = await client.retrieve(
+                collection_name=namespace,
+                ids=[embedding_id],
+                with_vectors=True,
+                with_payload=True
+            )
     except UnexpectedResponse as ex:
         if ex.status_code == status.HTTP_404_NOT_FOUND:
             raise NotFoundException(
@@ -55,80 +59,352 @@ async def embedding(client: AsyncQdrantClient, namespace: str, embedding_id: str
                 ex.content.decode('utf-8')
             )
 
+    if not result:
+        raise NotFoundException(
+            f"Embedding with id {embedding_id} not found in the '{namespace}' collection"
+        )
+
+    payload = result[0].payload or {}
+    source = payload.pop(source_key(), None)
+    if source is None:
+        with stage("sources"):
+            sources = await source_store.get_many(namespace, [str(result[0].id)])
+        source = sources.get(str(result[0].id))
+
+    return EmbeddingRead.model_construct(
+        id=str(result[0].id),
+        payload=payload,
+        vector=encode_vector(result[0].vector, encoding_format),
+        source=source
+    )
+
+
+async def scroll(client: AsyncQdrantClient, namespace: str, **kwargs):
+    try:
+        with stage("fetch"):
+            return await client.scroll(
+                collection_name=namespace,
+                **kwargs
+            )
+    except UnexpectedResponse as ex:
+        if ex.status_code == status.HTTP_404_NOT_FOUND:
+            raise NotFoundException(
+                f"Collection with name {namespace} does not exist"
+            )
+        raise UnknownThirdPartyException(
+            ex.content.decode('utf-8')
+        )
+
+
+def point_id(cursor: Any):
+    """Qdrant point id from a decoded cursor: an unsigned integer or a UUID"""
+    if isinstance(cursor, int) and not isinstance(cursor, bool) and cursor >= 0:
+        return cursor
+    if isinstance(cursor, str):
+        try:
+            uuid.UUID(cursor)
+        except ValueError:
+            pass
+        else:
+            return cursor
+    raise BadRequestException("Invalid pagination cursor")
+
 
 async def embeddings(client: AsyncQdrantClient, namespace: str, common: CommonParams):
-    points, offset = await client.scroll(
-        collection_name=namespace,
+    offset = common.get("cursor")
+    if offset is not None:
+        offset = point_id(offset)
+    elif common.get("offset"):
+        if common.get("offset") > settings.QDRANT_MAX_PAGE_OFFSET:
+            raise BadRequestException(
+                f"Pages beyond the first {settings.QDRANT_MAX_PAGE_OFFSET} embeddings can only be reached "
+                f"by passing the previous page's `next_cursor` as `cursor`"
+            )
+        # Qdrant's scroll offset is a point id rather than a position, so without a cursor
+        # skip to the requested page with a single id-only scroll
+        _, offset = await scroll(
+            client,
+            namespace,
+            limit=common.get("offset"),
+            with_payload=False,
+            with_vectors=False
+        )
+        if offset is None:
+            return EmbeddingPagination(total=0, page=common.get("page"), items=[])
+
+    points, next_page_offset = await scroll(
+        client,
+        namespace,
         limit=common.get("limit"),
-        offset=common.get("offset")
+        offset=offset
     )
     body = {
         "total": len(points),
         "page": common.get("page"),
-        "items": [{"id": o.id} for o in points]
+        "items": [{"id": o.id} for o in points],
+        "next_cursor": encode_cursor(next_page_offset) if next_page_offset is not None else None
     }
     return EmbeddingPagination(**body)
 
 
-async def collection_exists(client: AsyncQdrantClient, namespace: str) -> bool:
-    try:
-        # check if the collection exists
-        await client.get_collection(
-            collection_name=namespace
-        )
-    except UnexpectedResponse as ex:
-        return False
-    return True
+async def export(
+    client: AsyncQdrantClient,
+    namespace: str,
+    with_vectors: bool = False,
+    batch_size: int = 1000,
+    encoding_format: EncodingFormat = "float"
+) -> AsyncIterator[bytes]:
+    """
+    Stream every point of a collection as NDJSON, one scroll page at a time,
+    so memory use is bounded by `batch_size` rather than the collection size.
+    """
+    # fetch the first page eagerly, so that a missing collection surfaces
+    # as a 404 before the streaming response has started
+    points, offset = await scroll(
+        client,
+        namespace,
+        limit=batch_size,
+        with_payload=True,
+        with_vectors=with_vectors
+    )
 
+    async def stream():
+        nonlocal points, offset
+        while True:
+            payloads = [o.payload or {} for o in points]
+            sources = [payload.pop(source_key(), None) for payload in payloads]
+            # points whose payload doesn't hold the original text are looked up in the source store
+            with stage("sources"):
+                stored = await source_store.get_many(
+                    namespace,
+                    [str(o.id) for o, source in zip(points, sources) if source is None]
+                )
 
-async def create(client: AsyncQdrantClient, namespace: str, data_in: EmbeddingCreateMulti) -> InsertionResult:
-    exists = await collection_exists(client, namespace)
-    if not exists and not data_in.create_namespace:
+            lines = []
+            for o, payload, source in zip(points, payloads, sources):
+                lines.append(dumps({
+                    "id": o.id,
+                    "source": source if source is not None else stored.get(str(o.id)),
+                    "payload": payload,
+                    "vector": encode_vector(o.vector, encoding_format)
+                }))
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+
+            if offset is None:
+                break
+
+            points, offset = await scroll(
+                client,
+                namespace,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=with_vectors
+            )
+
+    return stream()
+
+
+async def ensure_namespace(client: AsyncQdrantClient, namespace: str, data_in: EmbeddingCreateMulti):
+    check_vector_dimensionality(data_in.inputs, data_in.embedding_model)
+    info = await qdrant_namespace(client, namespace)
+    if not info.exists and not data_in.create_namespace:
         raise NotFoundException(
             f"Collection with name {namespace} does not exist"
         )
 
-    if not exists:
+    validate_dimensionality(namespace, info, data_in.embedding_model)
+    if not info.exists:
         vector_size = data_in.embedding_model.dimensionality
-        await client.create_collection(
-            collection_name=namespace,
-            vectors_config=VectorParams(
-                size=vector_size,
-                distance=Distance.COSINE
-            ),
-        )
+        try:
+            await client.create_collection(
+                collection_name=namespace,
+                vectors_config=VectorParams(
+                    size=vector_size,
+                    distance=Distance.COSINE
+                ),
+            )
+        except UnexpectedResponse:
+            # a concurrent request may have created the collection in the meantime
+            namespace_registry.invalidate(QDRANT, namespace)
+            info = await qdrant_namespace(client, namespace)
+            if not info.exists:
+                raise
+        else:
+            namespace_registry.set(QDRANT, namespace, NamespaceInfo(
+                exists=True,
+                dimensionality=vector_size,
+                distance=str(Distance.COSINE)
+            ))
+
+
+async def create(
+    client: AsyncQdrantClient,
+    namespace: str,
+    data_in: QdrantEmbeddingCreateMulti,
+    progress: Optional[Callable[[BatchResult], Any]] = None
+) -> InsertionResult:
+    await ensure_namespace(client, namespace, data_in)
 
     return await insert(
         client=client,
         data_in=data_in,
         namespace=namespace,
+        progress=progress
     )
 
 
 async def insert(
     client: AsyncQdrantClient,
     namespace: str,
-    data_in: EmbeddingCreateMulti,
+    data_in: QdrantEmbeddingCreateMulti,
+    progress: Optional[Callable[[BatchResult], Any]] = None
 ) -> InsertionResult:
-    texts = [o.text for o in data_in.inputs]
-    result = cloudflare.embed(
-        model=str(data_in.embedding_model),
-        texts=texts
+    if data_in.bulk is not None:
+        return await bulk_insert(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            progress=progress
+        )
+
+    return await dispatch_batches(
+        inputs=data_in.inputs,
+        batch_size=min(data_in.embedding_model.max_batch_size, settings.QDRANT_UPSERT_BATCH_SIZE),
+        concurrency=settings.INGESTION_CONCURRENCY,
+        progress=progress,
+        process=lambda batch: insert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=batch
+        )
     )
-    try:
-        upsert_result = await client.upsert(
+
+
+async def bulk_insert(
+    client: AsyncQdrantClient,
+    namespace: str,
+    data_in: QdrantEmbeddingCreateMulti,
+    progress: Optional[Callable[[BatchResult], Any]] = None
+) -> InsertionResult:
+    """
+    Load large batches with bigger upserts and more of them in flight. Unless `wait` is set,
+    upserts only wait for Qdrant to acknowledge them, followed by a single consistency barrier.
+    """
+    bulk = data_in.bulk
+    result = await dispatch_batches(
+        inputs=data_in.inputs,
+        batch_size=bulk.batch_size or settings.QDRANT_BULK_BATCH_SIZE,
+        concurrency=bulk.parallel or settings.QDRANT_BULK_PARALLEL,
+        progress=progress,
+        process=lambda batch: insert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=batch,
+            wait=bulk.wait
+        )
+    )
+
+    if not bulk.wait and result.count:
+        # Qdrant applies updates in order, so a no-op update which waits
+        # only completes once every acknowledged upsert before it is applied
+        await client.delete(
             collection_name=namespace,
-            points=[common_types.PointStruct(**{
-                "vector": vector,
-                "id": meta.id,
-                "payload": merge_metadata(meta.payload, meta.text) if meta.persist_original else meta.payload
-            }) for vector, meta in zip(result.get('data', []), data_in.inputs)]
+            points_selector=PointIdsList(points=[]),
+            wait=True
+        )
+    return result
+
+
+async def upload(
+    client: AsyncQdrantClient,
+    namespace: str,
+    data_in: EmbeddingCreateMulti,
+    lines: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """Insert NDJSON inputs as they are read, `data_in` providing the options shared by all of them"""
+    await ensure_namespace(client, namespace, data_in)
+    return stream_upload(
+        lines=lines,
+        batch_size=min(data_in.embedding_model.max_batch_size, settings.QDRANT_UPSERT_BATCH_SIZE),
+        model=data_in.embedding_model,
+        concurrency=settings.INGESTION_CONCURRENCY,
+        process=lambda batch: insert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=batch
         )
-        if upsert_result.status != UpdateStatus.COMPLETED:
+    )
+
+
+async def insert_batch(
+    client: AsyncQdrantClient,
+    namespace: str,
+    data_in: EmbeddingCreateMulti,
+    inputs: List[EmbeddingsCreateSingle],
+    wait: bool = True
+) -> List[str]:
+    # the source text only depends on the inputs, so it is persisted whilst the embedding and upsert are in flight
+    results = await asyncio.gather(
+        upsert_batch(
+            client=client,
+            namespace=namespace,
+            data_in=data_in,
+            inputs=inputs,
+            wait=wait
+        ),
+        persist_sources(
+            namespace=namespace,
+            inputs=inputs
+        ),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return [o.id for o in inputs]
+
+
+async def upsert_batch(
+    client: AsyncQdrantClient,
+    namespace: str,
+    data_in: EmbeddingCreateMulti,
+    inputs: List[EmbeddingsCreateSingle],
+    wait: bool = True
+):
+    # bulk batches may exceed the model's batch size, in which case they are embedded in parallel chunks
+    with stage("embed"):
+        vectors = await embed_inputs(cloudflare.embed, data_in.embedding_model, inputs)
+    observe_batch_size("upsert", len(inputs))
+    try:
+        with stage("upsert"):
+            upsert_result = await client.upsert(
+                collection_name=namespace,
+                points=[common_types.PointStruct(**{
+                    "vector": vector,
+                    "id": meta.id,
+                    "payload": merge_metadata(meta.payload, meta.text) if meta.persist_original else meta.payload
+                }) for vector, meta in zip(vectors, inputs)],
+                wait=wait
+            )
+        expected_status = UpdateStatus.COMPLETED if wait else UpdateStatus.ACKNOWLEDGED
+        if upsert_result.status not in (expected_status, UpdateStatus.COMPLETED):
             raise UnknownThirdPartyException(
                 "Error occurred whilst attempting to upsert data in Qdrant"
             )
     except UnexpectedResponse as ex:
+        if ex.status_code == status.HTTP_404_NOT_FOUND:
+            # the cached namespace entry is stale, e.g. the collection was deleted elsewhere
+            namespace_registry.invalidate(QDRANT, namespace)
+            raise NotFoundException(
+                f"Collection with name {namespace} does not exist"
+            )
+
         if ex.status_code == status.HTTP_400_BAD_REQUEST:
             expected_dimension_error = re.search(r"expected dim: (\d+), got (\d+)", str(ex))
             if expected_dimension_error:
@@ -144,25 +420,16 @@ async def insert(
 
         raise ex
 
-    insertion_records = [CreateDatabaseRecord(
-        vector_id=o.id,
-        source=o.text
-    ) for o in data_in.inputs]
-    insertion_result = cloudflare.upsert_database_table_records(
-        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
-        table_name=namespace,
-        records=insertion_records
-    )
-    if not insertion_result.get('success'):
-        raise UnknownThirdPartyException(
-            "Something went wrong whilst attempting to persist the source text to Cloudflare D1"
-        )
 
-    items = [EmbeddingRead(id=o.vector_id) for o in insertion_records]
-    return InsertionResult[EmbeddingRead](
-        count=len(items),
-        items=items
-    )
+async def persist_sources(namespace: str, inputs: List[EmbeddingsCreateSingle]):
+    with stage("sources"):
+        await source_store.put_many(
+            namespace=namespace,
+            records=[CreateDatabaseRecord(
+                vector_id=o.id,
+                source=o.text
+            ) for o in inputs]
+        )
 
 
 async def delete(client: AsyncQdrantClient, namespace: str, embedding_ids: List[str]) -> EmbeddingDelete:
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Query, Request, status
+from fastapi.responses import StreamingResponse
 
-from ..models import EmbeddingRead, EmbeddingCreateMulti, EmbeddingPagination, EmbeddingDelete
+from ..models import EmbeddingRead, QdrantEmbeddingCreateMulti, EmbeddingCreateMulti, EmbeddingPagination, EmbeddingDelete
 
 from app.deps.request_params import CommonParams
 from app.deps.qdrant import QdrantClient
@@ -9,29 +10,70 @@ from .service import (
     embeddings,
     delete,
     embedding,
-    create
+    create,
+    export,
+    upload
 )
 
 from app.models import InsertionResult
+from app.jobs.models import JobRead
+from app.jobs.service import enqueue
+from app.deps.jobs import JobQueueClient
+from app.namespace.registry import QDRANT
+from app.embeddings.utils import ndjson_lines, is_gzipped
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.responses import DuplexStreamingResponse, ModelResponse
+from app.lib.vectors import EncodingFormat
+from app.lib.timing import TimedRoute
+from app.config import settings
 
 
-router = APIRouter(prefix="/embeddings/qdrant")
+router = APIRouter(prefix="/embeddings/qdrant", route_class=TimedRoute)
+
+
+@router.get("/{namespace}/export", response_class=StreamingResponse)
+async def export_embeddings(
+    namespace: str,
+    client: QdrantClient,
+    with_vectors: bool = Query(default=False),
+    batch_size: int = Query(default=1000, ge=1, le=10000),
+    encoding_format: EncodingFormat = Query(default="float")
+):
+    """
+    Export a whole namespace as newline-delimited JSON, one `{id, source, payload, vector}` object per line.
+    Points are scrolled and written in pages of `batch_size`, so memory use stays constant.
+    """
+    stream = await export(
+        client=client,
+        namespace=namespace,
+        with_vectors=with_vectors,
+        batch_size=batch_size,
+        encoding_format=encoding_format
+    )
+    return StreamingResponse(stream, media_type="application/x-ndjson")
 
 
 @router.get("/{namespace}/{embedding_id}", response_model=EmbeddingRead)
-async def get_embedding(namespace: str, embedding_id: str, client: QdrantClient):
+async def get_embedding(
+    namespace: str,
+    embedding_id: str,
+    client: QdrantClient,
+    encoding_format: EncodingFormat = Query(default="float")
+):
     """Retrieve a single embedding vector by namespace and `ID`"""
-    return await embedding(
+    return ModelResponse(await embedding(
         client=client,
         namespace=namespace,
-        embedding_id=embedding_id
-    )
+        embedding_id=embedding_id,
+        encoding_format=encoding_format
+    ))
 
 
 @router.get("/{namespace}", response_model=EmbeddingPagination)
 async def get_embeddings(namespace: str, common: CommonParams, client: QdrantClient):
     """
-    Page through embeddings
+    Page through embeddings.
+    Pass the `next_cursor` of a page as `cursor` to fetch the page that follows it.
     """
     return await embeddings(
         client=client,
@@ -41,11 +83,12 @@ async def get_embeddings(namespace: str, common: CommonParams, client: QdrantCli
 
 
 @router.post("/{namespace}", response_model=InsertionResult[EmbeddingRead], status_code=status.HTTP_201_CREATED)
-async def create_embedding(namespace: str, data_in: EmbeddingCreateMulti, client: QdrantClient):
+async def create_embedding(namespace: str, data_in: QdrantEmbeddingCreateMulti, client: QdrantClient):
     """
     Generate and persist embeddings for one or more text items.
     Cloudflare Workers AI embedding models are used to generate embeddings,
-    and Qdrant is used to store the embedding vectors, along with metadata (optional)
+    and Qdrant is used to store the embedding vectors, along with metadata (optional).
+    Set `bulk` for large loads, to upsert in bigger, parallel batches.
     """
     return await create(client=client, namespace=namespace, data_in=data_in)
 
@@ -58,3 +101,44 @@ async def delete_embedding(namespace: str, embedding_id: str, client: QdrantClie
         namespace=namespace,
         embedding_ids=[embedding_id]
     )
+
+
+@router.post("/{namespace}/jobs", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+async def create_embedding_job(namespace: str, data_in: QdrantEmbeddingCreateMulti, queue: JobQueueClient):
+    """
+    Queue the generation and persistence of embeddings, rather than waiting for them.
+    Poll `/jobs/{job_id}` for the job's progress and result.
+    """
+    return await enqueue(queue=queue, backend=QDRANT, namespace=namespace, data_in=data_in)
+
+
+@router.post("/{namespace}/upload", response_class=DuplexStreamingResponse)
+async def upload_embeddings(
+    namespace: str,
+    request: Request,
+    client: QdrantClient,
+    embedding_model: CloudflareEmbeddingModels = Query(default=CloudflareEmbeddingModels.BAAIBase),
+    create_namespace: bool = Query(default=True)
+):
+    """
+    Generate and persist embeddings for a newline-delimited JSON upload, one `EmbeddingsCreateSingle`
+    object per line, which may be gzip compressed (`Content-Encoding: gzip`).
+    Inputs are processed in batches as the upload is read, with one progress line streamed back
+    per batch, one per invalid line, and a final summary line.
+    """
+    data_in = EmbeddingCreateMulti(
+        embedding_model=embedding_model,
+        create_namespace=create_namespace,
+        inputs=[]
+    )
+    stream = await upload(
+        client=client,
+        namespace=namespace,
+        data_in=data_in,
+        lines=ndjson_lines(
+            request.stream(),
+            gzipped=is_gzipped(request),
+            max_line_size=settings.UPLOAD_MAX_LINE_SIZE
+        )
+    )
+    return DuplexStreamingResponse(stream, media_type="application/x-ndjson")
@@ -1,6 +1,27 @@
-from typing import Optional, Dict, Any
+import zlib
+import asyncio
+
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Sequence, TypeVar, AsyncIterator, Iterator
+
+from fastapi import Request
+from pydantic import ValidationError
 
 from app.config import settings
+from app.models import InsertionResult, BatchResult
+from app.embeddings.models import EmbeddingRead, EmbeddingCreateMulti, EmbeddingsCreateSingle
+from app.embeddings.models import EmbeddingUploadError, EmbeddingUploadResult
+from app.exceptions import NotFoundException, EmbeddingDimensionalityException, UnknownThirdPartyException
+from app.exceptions import PayloadTooLargeException
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+
+
+InputType = TypeVar('InputType')
+
+# bytes inflated at a time from a gzip compressed upload
+DECOMPRESSED_CHUNK_SIZE = 64 * 1024
+
+# errors caused by the request itself, which would fail every batch identically
+CLIENT_ERRORS = (NotFoundException, EmbeddingDimensionalityException)
 
 
 def source_key() -> str:
@@ -15,3 +36,286 @@ def merge_metadata(metadata: Optional[Dict[str, Any]], text: str):
         return {**metadata, **source}
     else:
         return source
+
+
+def chunked(items: Sequence[InputType], size: int) -> List[Sequence[InputType]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def check_vector_dimensionality(inputs: Sequence[EmbeddingsCreateSingle], model: CloudflareEmbeddingModels):
+    for o in inputs:
+        if o.vector is not None and len(o.vector) != model.dimensionality:
+            raise EmbeddingDimensionalityException(
+                f"Vector of input '{o.id}' has {len(o.vector)} dimensions, whereas the embedding model "
+                f"{model} has {model.dimensionality}."
+            )
+
+
+def embedding_vectors(result: Dict[str, Any], count: int, model: CloudflareEmbeddingModels) -> List[List[float]]:
+    """The vectors of a Workers AI embedding response, checked to hold one for each of the `count` texts sent"""
+    vectors = result.get('data', [])
+    if len(vectors) != count:
+        raise UnknownThirdPartyException(
+            f"Expected {count} embeddings from {model}, got {len(vectors)}"
+        )
+    return vectors
+
+
+async def embed_inputs(
+    embed: Callable[..., Awaitable[Dict[str, Any]]],
+    model: CloudflareEmbeddingModels,
+    inputs: Sequence[EmbeddingsCreateSingle]
+) -> List[List[float]]:
+    """
+    Vectors for `inputs`, in order. Inputs with a precomputed `vector` are used as they are,
+    and only the rest are embedded with `model`, in parallel chunks of the model's batch size.
+    """
+    check_vector_dimensionality(inputs, model)
+
+    texts = [o.text for o in inputs if o.vector is None]
+    results = await asyncio.gather(*[embed(
+        model=str(model),
+        texts=chunk
+    ) for chunk in chunked(texts, model.max_batch_size)])
+    embedded = [vector for result in results for vector in result.get('data', [])]
+    if len(embedded) != len(texts):
+        raise UnknownThirdPartyException(
+            f"Expected {len(texts)} embeddings from {model}, got {len(embedded)}"
+        )
+
+    vectors = iter(embedded)
+    return [o.vector if o.vector is not None else next(vectors) for o in inputs]
+
+
+async def dispatch_batches(
+    inputs: Sequence[InputType],
+    batch_size: int,
+    process: Callable[[Sequence[InputType]], Awaitable[List[str]]],
+    concurrency: int = 1,
+    progress: Optional[Callable[[BatchResult], Any]] = None
+) -> InsertionResult[EmbeddingRead]:
+    """
+    Split `inputs` into sub-batches of at most `batch_size` and run `process` over them,
+    keeping up to `concurrency` batches in flight so that the embedding of one batch
+    overlaps with the upsert of another. `process` returns the ids it persisted.
+
+    Upstream failures are reported per batch rather than failing the whole request,
+    unless every batch failed, in which case the first error is raised. Client errors
+    fail the request straight away, cancelling the batches still running.
+    `progress`, if given, is called with the result of each batch as it completes.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(index: int, batch: Sequence[InputType]):
+        async with semaphore:
+            try:
+                ids = await process(batch)
+            except CLIENT_ERRORS:
+                raise
+            except Exception as ex:
+                result = BatchResult(
+                    index=index,
+                    count=0,
+                    success=False,
+                    detail=str(ex),
+                    ids=[o.id for o in batch]
+                ), [], ex
+            else:
+                result = BatchResult(index=index, count=len(ids), success=True), ids, None
+
+            if progress is not None:
+                progress(result[0])
+            return result
+
+    batches = chunked(inputs, batch_size)
+    if not batches:
+        return InsertionResult[EmbeddingRead](count=0, items=[])
+
+    tasks = [asyncio.ensure_future(run(i, batch)) for i, batch in enumerate(batches)]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        # a client error, or the request being cancelled, leaves the other batches running otherwise
+        for task in tasks:
+            task.cancel()
+
+    errors = [ex for _, _, ex in results if ex is not None]
+    if len(errors) == len(results):
+        raise errors[0]
+
+    items = [EmbeddingRead(id=o) for _, ids, _ in results for o in ids]
+    return InsertionResult[EmbeddingRead](
+        count=len(items),
+        items=items,
+        batches=[batch_result for batch_result, _, _ in results]
+    )
+
+
+def is_gzipped(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    return "gzip" in request.headers.get("content-encoding", "") or content_type in ("application/gzip", "application/x-gzip")
+
+
+async def ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    gzipped: bool = False,
+    max_line_size: int = 1024 * 1024
+) -> AsyncIterator[bytes]:
+    """
+    Split a (optionally gzip compressed) byte stream into its non-empty lines, as the chunks arrive.
+    Compressed chunks are inflated a bounded amount at a time, and a line longer than `max_line_size`
+    bytes raises `PayloadTooLargeException`, so memory stays flat whatever the upload holds.
+    """
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else None
+    buffer = bytearray()
+
+    def split(data: bytes) -> Iterator[bytes]:
+        # only the new data is searched for line breaks, and each byte is copied into `buffer` once
+        start = 0
+        end = data.find(b"\n")
+        while end != -1:
+            buffer.extend(data[start:end])
+            check_line_size(buffer, max_line_size)
+            if buffer.strip():
+                yield bytes(buffer)
+            buffer.clear()
+            start = end + 1
+            end = data.find(b"\n", start)
+        buffer.extend(data[start:])
+        check_line_size(buffer, max_line_size)
+
+    async for chunk in chunks:
+        if decompressor is None:
+            for line in split(chunk):
+                yield line
+            continue
+
+        while True:
+            data = decompressor.decompress(chunk, DECOMPRESSED_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+            for line in split(data):
+                yield line
+            # a full chunk may leave more output pending even once all the input is consumed
+            if not chunk and len(data) < DECOMPRESSED_CHUNK_SIZE:
+                break
+
+    if decompressor:
+        for line in split(decompressor.flush()):
+            yield line
+    if buffer.strip():
+        yield bytes(buffer)
+
+
+def check_line_size(line: bytearray, max_line_size: int):
+    if len(line) > max_line_size:
+        raise PayloadTooLargeException(f"Upload contains a line longer than {max_line_size} bytes")
+
+
+async def stream_batches(
+    inputs: AsyncIterator[InputType],
+    batch_size: int,
+    process: Callable[[Sequence[InputType]], Awaitable[List[str]]],
+    concurrency: int = 1
+) -> AsyncIterator[BatchResult]:
+    """
+    Counterpart of `dispatch_batches` for inputs which arrive incrementally, yielding the result
+    of each batch as it completes. No further inputs are read whilst `concurrency` batches are
+    in flight, so at most `concurrency * batch_size` inputs are held in memory at any time.
+    Every failure, including client errors, is reported for the batch it occurred in.
+    """
+    async def run(index: int, batch: Sequence[InputType]) -> BatchResult:
+        try:
+            ids = await process(batch)
+        except Exception as ex:
+            return BatchResult(
+                index=index,
+                count=0,
+                success=False,
+                detail=str(ex),
+                ids=[o.id for o in batch]
+            )
+        return BatchResult(index=index, count=len(ids), success=True)
+
+    pending = set()
+    batch = []
+    index = 0
+    try:
+        async for item in inputs:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+
+            pending.add(asyncio.ensure_future(run(index, batch)))
+            index += 1
+            batch = []
+            while len(pending) >= max(concurrency, 1):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+        if batch:
+            pending.add(asyncio.ensure_future(run(index, batch)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # the client went away, or reading the upload failed
+        for task in pending:
+            task.cancel()
+
+
+async def stream_upload(
+    lines: AsyncIterator[bytes],
+    batch_size: int,
+    process: Callable[[Sequence[EmbeddingsCreateSingle]], Awaitable[List[str]]],
+    model: CloudflareEmbeddingModels,
+    concurrency: int = 1
+) -> AsyncIterator[bytes]:
+    """
+    Parse each NDJSON line into an `EmbeddingsCreateSingle` and process them in batches,
+    writing one NDJSON progress line per batch, one per invalid input line and a final summary.
+    Lines with a precomputed vector not matching `model`'s dimensionality are invalid.
+
+    A line over the size limit rejects the upload with `PayloadTooLargeException` if nothing has been
+    written yet. Otherwise it's reported as the last invalid line, and the rest of the upload is not read.
+    """
+    errors: List[EmbeddingUploadError] = []
+    started = False
+
+    async def records() -> AsyncIterator[EmbeddingsCreateSingle]:
+        line_number = 0
+        try:
+            async for line in lines:
+                line_number += 1
+                try:
+                    record = EmbeddingsCreateSingle.model_validate_json(line)
+                    EmbeddingCreateMulti.check_text_length([record])
+                    check_vector_dimensionality([record], model)
+                except (ValidationError, ValueError, EmbeddingDimensionalityException) as ex:
+                    errors.append(EmbeddingUploadError(line=line_number, detail=str(ex)))
+                    continue
+                yield record
+        except PayloadTooLargeException as ex:
+            if not started:
+                raise
+            errors.append(EmbeddingUploadError(
+                line=line_number + 1,
+                detail=f"{ex}, so the rest of the upload was not read"
+            ))
+
+    result = EmbeddingUploadResult(count=0, failed=0, invalid=0, batches=0)
+    async for batch_result in stream_batches(records(), batch_size, process, concurrency):
+        started = True
+        result.batches += 1
+        result.count += batch_result.count
+        result.failed += len(batch_result.ids or [])
+        yield batch_result.model_dump_json().encode("utf-8") + b"\n"
+        while errors:
+            result.invalid += 1
+            yield errors.pop(0).model_dump_json().encode("utf-8") + b"\n"
+
+    for error in errors:
+        result.invalid += 1
+        yield error.model_dump_json().encode("utf-8") + b"\n"
+    yield result.model_dump_json().encode("utf-8") + b"\n"
@@ -12,3 +12,18 @@ class EmbeddingDimensionalityException(Exception):
 
 class EnvironmentVariableConfigException(Exception):
     pass
+
+
+class BadRequestException(Exception):
+    pass
+
+
+class PayloadTooLargeException(Exception):
+    pass
+
+
+class UpstreamUnavailableException(Exception):
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -1,10 +1,32 @@
+from functools import partial
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
 from .config import settings
 
-from .api import api_router
+from .api import api_router, metrics_router
+from .deps.cloudflare import cloudflare
+from .deps.qdrant import create_qdrant_client
+from .deps.jobs import job_queue, job_workers
+from .deps.sources import source_store
+from .deps.tracing import span_exporter
+from .lib.metrics import MetricsMiddleware
+from .jobs.service import run as run_job
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.qdrant = create_qdrant_client()
+    job_workers.start(run=partial(run_job, qdrant=app.state.qdrant, cloudflare=cloudflare))
+    yield
+    await job_workers.stop()
+    await job_queue.close()
+    await app.state.qdrant.close()
+    await source_store.close()
+    await cloudflare.close()
+    if span_exporter is not None:
+        span_exporter.close()
 
 
 def create_app():
@@ -12,6 +34,9 @@ def create_app():
         title=settings.PROJECT_NAME,
         description=settings.PROJECT_DESCRIPTION,
         openapi_url=f"{settings.API_PATH}/openapi.json",
+        lifespan=lifespan
     )
     app.include_router(api_router)
+    app.include_router(metrics_router)
+    app.add_middleware(MetricsMiddleware)
     return app
@@ -0,0 +1,32 @@
+from datetime import datetime
+from typing import Optional, Literal
+
+from pydantic import BaseModel
+
+from app.models import InsertionResult
+from app.embeddings.models import EmbeddingRead
+
+# `partial`: completed, but some inputs still failed after the last attempt, as listed in the result's batches
+JobStatus = Literal["queued", "running", "completed", "partial", "failed"]
+JobBackend = Literal["qdrant", "cloudflare"]
+
+
+class JobRead(BaseModel):
+    id: str
+    backend: JobBackend
+    namespace: str
+    status: JobStatus
+    attempts: int
+    # number of inputs, and how many of them the current attempt has embedded and stored or failed on
+    total: int
+    processed: int = 0
+    failed: int = 0
+    error: Optional[str] = None
+    result: Optional[InsertionResult[EmbeddingRead]] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class Job(JobRead):
+    # the serialized ingestion request
+    payload: str
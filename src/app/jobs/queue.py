@@ -0,0 +1,205 @@
+import json
+import time
+import asyncio
+import uuid
+import sqlite3
+import threading
+
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+
+from .models import Job
+
+
+JOB_COLUMNS = (
+    "id, backend, namespace, status, attempts, total, processed, failed, "
+    "error, result, created_at, updated_at, payload"
+)
+
+
+class JobQueue:
+    """
+    Durable FIFO of ingestion jobs, stored in a local SQLite file so that
+    accepted jobs survive a restart. The file is opened on first use, and
+    queries run in a thread so that they don't block the event loop.
+
+    A job is claimed by moving it from `queued` to `running` under a lease held by one worker,
+    which renews it with `heartbeat` for as long as the job runs. Jobs whose lease has expired,
+    e.g. because their worker's process died, are claimed again. Updates made by a worker
+    which no longer holds the lease are ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    async def enqueue(self, backend: str, namespace: str, payload: str, total: int) -> Job:
+        return await asyncio.to_thread(self._enqueue, backend, namespace, payload, total)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def claim(self, worker_id: str, lease: float) -> Optional[Job]:
+        """Take the oldest job that is due, or whose lease has expired, marking it as running for `lease` seconds"""
+        return await asyncio.to_thread(self._claim, worker_id, lease)
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease: float, processed: int, failed: int) -> bool:
+        """Renew the lease on a running job and record its progress, returning whether the lease is still held"""
+        return await self._update(
+            job_id, worker_id, processed=processed, failed=failed, lease_expires_at=time.time() + lease
+        )
+
+    async def complete(
+        self,
+        job_id: str,
+        worker_id: str,
+        result: str,
+        processed: int,
+        failed: int,
+        status: str = "completed",
+        error: Optional[str] = None
+    ) -> bool:
+        return await self._update(
+            job_id, worker_id, status=status, result=result, error=error, processed=processed, failed=failed
+        )
+
+    async def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return await self._update(job_id, worker_id, status="failed", error=error)
+
+    async def retry(
+        self,
+        job_id: str,
+        worker_id: str,
+        error: str,
+        delay: float,
+        payload: Optional[str] = None,
+        result: Optional[str] = None
+    ) -> bool:
+        """
+        Put a job back in the queue after `delay` seconds. Partially failed jobs pass the `payload`
+        of the inputs still to be stored, and the `result` of those already stored.
+        """
+        values = {"status": "queued", "error": error, "available_at": time.time() + delay}
+        if payload is not None:
+            values.update(payload=payload, result=result)
+        return await self._update(job_id, worker_id, **values)
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+    def _enqueue(self, backend: str, namespace: str, payload: str, total: int) -> Job:
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT INTO jobs (id, backend, namespace, status, attempts, total, payload, "
+                "created_at, updated_at, available_at) VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?, ?);",
+                (job_id, backend, namespace, total, payload, now, now, now)
+            )
+            connection.commit()
+        return self._get(job_id)
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?;", (job_id,)
+            ).fetchone()
+        return self._job(row) if row is not None else None
+
+    def _claim(self, worker_id: str, lease: float) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                f"""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, processed = 0, failed = 0,
+                    worker_id = ?, lease_expires_at = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = 'queued' AND available_at <= ?)
+                        OR (status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?))
+                    ORDER BY created_at LIMIT 1
+                )
+                RETURNING {JOB_COLUMNS};
+                """,
+                (worker_id, now + lease, now, now, now)
+            ).fetchone()
+            connection.commit()
+        return self._job(row) if row is not None else None
+
+    async def _update(self, job_id: str, worker_id: str, **values) -> bool:
+        return await asyncio.to_thread(self._update_sync, job_id, worker_id, values)
+
+    def _update_sync(self, job_id: str, worker_id: str, values: Dict[str, Any]) -> bool:
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in values)
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND worker_id = ?;", (*values.values(), job_id, worker_id)
+            ).rowcount
+            connection.commit()
+        return count > 0
+
+    def _close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL;")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    backend TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result TEXT,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    worker_id TEXT,
+                    lease_expires_at REAL
+                );
+            """)
+            # queues created before jobs were leased
+            columns = {o[1] for o in self._connection.execute("PRAGMA table_info(jobs);")}
+            for column, column_type in (("worker_id", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type};")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status_available_at ON jobs (status, available_at);"
+            )
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def _job(row) -> Job:
+        (job_id, backend, namespace, status, attempts, total, processed, failed,
+         error, result, created_at, updated_at, payload) = row
+        return Job(
+            id=job_id,
+            backend=backend,
+            namespace=namespace,
+            status=status,
+            attempts=attempts,
+            total=total,
+            processed=processed,
+            failed=failed,
+            error=error,
+            result=json.loads(result) if result else None,
+            created_at=datetime.fromtimestamp(created_at, tz=timezone.utc),
+            updated_at=datetime.fromtimestamp(updated_at, tz=timezone.utc),
+            payload=payload
+        )
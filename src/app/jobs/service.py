@@ -0,0 +1,62 @@
+from typing import Callable, Any
+
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+
+from app.models import InsertionResult, BatchResult
+from app.exceptions import NotFoundException
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.namespace.registry import QDRANT, CLOUDFLARE
+from app.deps.jobs import job_workers
+
+from app.embeddings.models import EmbeddingCreateMulti, QdrantEmbeddingCreateMulti
+from app.embeddings.utils import check_vector_dimensionality
+from app.embeddings.qdrant import service as qdrant_service
+from app.embeddings.cloudflare import service as cloudflare_service
+
+from .models import Job
+from .queue import JobQueue
+
+
+async def enqueue(queue: JobQueue, backend: str, namespace: str, data_in: EmbeddingCreateMulti) -> Job:
+    check_vector_dimensionality(data_in.inputs, data_in.embedding_model)
+    job = await queue.enqueue(
+        backend=backend,
+        namespace=namespace,
+        payload=data_in.model_dump_json(),
+        total=len(data_in.inputs)
+    )
+    job_workers.notify()
+    return job
+
+
+async def job(queue: JobQueue, job_id: str) -> Job:
+    result = await queue.get(job_id)
+    if result is None:
+        raise NotFoundException(
+            f"Job with id '{job_id}' not found"
+        )
+    return result
+
+
+async def run(
+    job: Job,
+    progress: Callable[[BatchResult], Any],
+    qdrant: AsyncQdrantClient,
+    cloudflare: AsyncAPI
+) -> InsertionResult:
+    """Run a queued job through the same insertion pipeline as the synchronous endpoints"""
+    if job.backend == QDRANT:
+        return await qdrant_service.create(
+            client=qdrant,
+            namespace=job.namespace,
+            data_in=QdrantEmbeddingCreateMulti.model_validate_json(job.payload),
+            progress=progress
+        )
+    if job.backend == CLOUDFLARE:
+        return await cloudflare_service.insert(
+            client=cloudflare,
+            namespace=job.namespace,
+            data_in=EmbeddingCreateMulti.model_validate_json(job.payload),
+            progress=progress
+        )
+    raise ValueError(f"Unknown job backend '{job.backend}'")
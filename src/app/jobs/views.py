@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+
+from app.deps.jobs import JobQueueClient
+from app.lib.timing import TimedRoute
+
+from .models import JobRead
+from .service import job as get
+
+
+router = APIRouter(prefix="/jobs", route_class=TimedRoute)
+
+
+@router.get("/{job_id}", response_model=JobRead)
+async def get_job(job_id: str, queue: JobQueueClient):
+    """Retrieve the status and progress of an ingestion job, along with its result once completed."""
+    return await get(queue=queue, job_id=job_id)
@@ -0,0 +1,164 @@
+import os
+import json
+import uuid
+import socket
+import asyncio
+import logging
+
+from typing import Callable, Awaitable, Any, List, Optional
+
+from app.models import InsertionResult, BatchResult
+from app.embeddings.models import EmbeddingRead
+from app.embeddings.utils import CLIENT_ERRORS
+
+from .models import Job
+from .queue import JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+JobRunner = Callable[[Job, Callable[[BatchResult], Any]], Awaitable[InsertionResult]]
+
+
+class JobWorkers:
+    """
+    Pool of background tasks which take jobs from the queue and run them with `run`.
+
+    Failed attempts are retried with exponential backoff, up to `max_attempts`, except for
+    errors caused by the request itself, which fail the job straight away. When only some
+    batches fail, only their inputs are retried; any still failing after the last attempt
+    leave the job `partial`. Whilst a job runs its `lease` is renewed, along with its progress,
+    every `heartbeat_interval` seconds. Idle workers poll the queue every `poll_interval`
+    seconds, or as soon as they are notified.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int = 2,
+        max_attempts: int = 5,
+        retry_delay: float = 2,
+        poll_interval: float = 1,
+        lease: float = 60,
+        heartbeat_interval: float = 1
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.heartbeat_interval = min(heartbeat_interval, lease / 3)
+        # identifies this process's leases amongst those of other processes sharing the queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._run: Optional[JobRunner] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, run: JobRunner):
+        self._run = run
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(max(self.concurrency, 1))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers, e.g. once a job has been enqueued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def process(self, job: Job):
+        # inputs stored by earlier attempts, when only the failed batches are being retried
+        previous = job.result
+        processed = previous.count if previous is not None else 0
+        failed = 0
+
+        def progress(batch: BatchResult):
+            nonlocal processed, failed
+            if batch.success:
+                processed += batch.count
+            else:
+                batch_size = len(batch.ids or [])
+                processed += batch_size
+                failed += batch_size
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                if not await self.queue.heartbeat(job.id, self.worker_id, self.lease, processed, failed):
+                    logger.warning("Lost the lease on ingestion job %s", job.id)
+
+        heartbeat_task = asyncio.create_task(heartbeat())
+        try:
+            result = await self._run(job, progress)
+        except CLIENT_ERRORS as ex:
+            await self.queue.fail(job.id, self.worker_id, error=str(ex))
+        except Exception as ex:
+            if job.attempts >= self.max_attempts:
+                await self.queue.fail(job.id, self.worker_id, error=str(ex))
+            else:
+                await self.queue.retry(job.id, self.worker_id, error=str(ex), delay=self.backoff(job))
+        else:
+            if previous is not None:
+                result = InsertionResult[EmbeddingRead](
+                    count=previous.count + result.count,
+                    items=previous.items + result.items,
+                    batches=previous.batches + result.batches
+                )
+            failed_ids = {o for batch in result.batches if not batch.success for o in batch.ids or []}
+            if not failed_ids:
+                await self.queue.complete(job.id, self.worker_id, result.model_dump_json(), processed, failed)
+            elif job.attempts >= self.max_attempts:
+                await self.queue.complete(
+                    job.id,
+                    self.worker_id,
+                    result.model_dump_json(),
+                    processed,
+                    failed,
+                    status="partial",
+                    error=f"{len(failed_ids)} inputs could not be stored after {job.attempts} attempts"
+                )
+            else:
+                payload = json.loads(job.payload)
+                payload["inputs"] = [o for o in payload["inputs"] if o["id"] in failed_ids]
+                stored = result.model_copy(update={"batches": [o for o in result.batches if o.success]})
+                await self.queue.retry(
+                    job.id,
+                    self.worker_id,
+                    error=f"Retrying {len(failed_ids)} inputs from failed batches",
+                    delay=self.backoff(job),
+                    payload=json.dumps(payload),
+                    result=stored.model_dump_json()
+                )
+        finally:
+            heartbeat_task.cancel()
+
+    def backoff(self, job: Job) -> float:
+        return self.retry_delay * 2 ** (job.attempts - 1)
+
+    async def _work(self):
+        while True:
+            job = await self.queue.claim(self.worker_id, self.lease)
+            if job is None:
+                await self._idle()
+                continue
+
+            try:
+                await self.process(job)
+            except asyncio.CancelledError:
+                # put the job back, so that it is picked up again after a restart
+                await self.queue.retry(job.id, self.worker_id, error="Interrupted by shutdown", delay=0)
+                raise
+            except Exception:
+                logger.exception("Ingestion job %s could not be processed", job.id)
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
@@ -1,29 +1,412 @@
+import asyncio
+
 import aiohttp
+import CloudFlare
+
+from typing import Optional, List, Dict, Any, Set, Tuple, Sequence
+
+from app.exceptions import NotFoundException
+from app.lib.serialization import dumps, loads
+from app.lib.retry import RetryPolicy, CircuitBreaker, retried, parse_retry_after
+from app.lib.metrics import UPSTREAM_BATCH_SIZE
+
+from .constants import (
+    CloudflareEmbeddingModels,
+    DIMENSIONALITY_PRESETS,
+    ERROR_CODE_VECTOR_INDEX_NOT_FOUND,
+    ERROR_CODE_INSERT_VECTOR_INDEX_SIZE_MISMATCH,
+    embedding_result,
+    dimensionality_mismatch_exception
+)
+from .cache import EmbeddingCache
+from .models import VectorPayloadItem, CreateDatabaseRecord
+
+
+API_BASE_URL = "https://api.cloudflare.com/client/v4/accounts/{account_id}"
+
+# D1 rejects statements with more bound parameters than this
+D1_MAX_BOUND_PARAMETERS = 100
+
 
-from typing import List, Dict, Any
+# upstreams with their own retry policy and circuit breaker
+WORKERS_AI = "Workers AI"
+VECTORIZE = "Vectorize"
+D1 = "D1"
 
-from app.config import settings
-from app.lib.cloudflare.api import CloudflareEmbeddingModels
 
-from retry import retry
+class CloudflareRequestError(CloudFlare.exceptions.CloudFlareAPIError):
+    """`CloudFlareAPIError` which also records the HTTP status and `Retry-After` of the response"""
 
+    def __init__(self, code, message, error_chain=None, status: int = None, retry_after: Optional[float] = None):
+        super().__init__(code, message, error_chain)
+        self.status = status
+        self.retry_after = retry_after
 
-AI_WORKER_API_BASE_URL = "https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/run/{model}"
 
+def is_transient(ex: BaseException, idempotent: bool = True) -> bool:
+    """
+    Whether a failed request is worth retrying. Requests which aren't idempotent are only
+    retried if they were rejected before being acted upon, i.e. rate limited or never sent.
+    """
+    if isinstance(ex, CloudflareRequestError):
+        return ex.status == 429 or (idempotent and ex.status >= 500)
+    if isinstance(ex, aiohttp.ClientConnectorError):
+        return True
+    return idempotent and isinstance(ex, (aiohttp.ClientError, asyncio.TimeoutError))
 
-def auth_headers() -> Dict[str, Any]:
-    return {"Authorization": f"Bearer {settings.CLOUDFLARE_API_TOKEN}"}
 
+def is_rejection(ex: BaseException) -> bool:
+    """Whether Cloudflare responded to the request and rejected it, which shows that it's up"""
+    status = getattr(ex, "status", None)
+    return isinstance(ex, CloudFlare.exceptions.CloudFlareAPIError) and status is not None and 400 <= status < 500
 
-@retry(tries=5, delay=1, backoff=1, jitter=0.5)
-async def aembed(model: CloudflareEmbeddingModels, text: List[str]):
-    uri = AI_WORKER_API_BASE_URL.format(
-        account_id=settings.CLOUDFLARE_API_ACCOUNT_ID,
-        model=model
+
+def retry_after(ex: BaseException) -> Optional[float]:
+    return getattr(ex, "retry_after", None)
+
+
+def error_code(ex: BaseException) -> str:
+    """Cloudflare's error code for API errors, e.g. `3000`, otherwise the exception's type"""
+    if isinstance(ex, CloudFlare.exceptions.CloudFlareAPIError):
+        return str(int(ex))
+    return type(ex).__name__
+
+
+def retry_policy(upstream: str, failure_threshold: int = 5, reset_timeout: float = 30, **kwargs) -> RetryPolicy:
+    """Retry policy for a Cloudflare upstream, with its own circuit breaker"""
+    return RetryPolicy(
+        retryable=is_transient,
+        rejected=is_rejection,
+        retry_after=retry_after,
+        name=upstream,
+        error_code=error_code,
+        breaker=CircuitBreaker(upstream, failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+        **kwargs
     )
-    async with aiohttp.ClientSession() as session:
-        async with session.post(uri, json={
-            "text": text
-        }, headers=auth_headers()) as response:
-            result = await response.json()
-            return result
+
+
+def insert_error(vector_index_name: str, ex: CloudFlare.exceptions.CloudFlareAPIError) -> Exception:
+    """The exception to raise for a failed vector insert"""
+    if int(ex) == ERROR_CODE_INSERT_VECTOR_INDEX_SIZE_MISMATCH:
+        return dimensionality_mismatch_exception(vector_index_name, str(ex))
+    if int(ex) == ERROR_CODE_VECTOR_INDEX_NOT_FOUND:
+        return NotFoundException(
+            f"Vector index with name '{vector_index_name}' not found. "
+            f"Create the index via a separate call or include 'create_namespace' "
+            f"in your payload to automagically create and insert."
+        )
+    return ex
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def chunked(items: Sequence[Any], size: int) -> List[Sequence[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class AsyncAPI:
+    """
+    Client for the Cloudflare Workers AI, Vectorize and D1 APIs, on asyncio.
+
+    All requests share one long-lived `aiohttp.ClientSession`, created lazily on first use
+    so that it binds to the running event loop, and closed via `close` on application shutdown.
+    Results and errors mirror the `CloudFlare` SDK: the unwrapped `result` is returned and
+    failures are raised as `CloudFlare.exceptions.CloudFlareAPIError`.
+    """
+
+    def __init__(
+        self,
+        api_token: str,
+        account_id: str,
+        cache: Optional[EmbeddingCache] = None,
+        pool_size: int = 100,
+        timeout: float = 60,
+        retry_policies: Optional[Dict[str, RetryPolicy]] = None
+    ):
+        self.api_token = api_token
+        self.account_id = account_id
+        self.cache = cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.base_url = API_BASE_URL.format(account_id=account_id)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._database_tables: Set[Tuple[str, str]] = set()
+        self.retry_policies = {upstream: retry_policy(upstream) for upstream in (WORKERS_AI, VECTORIZE, D1)}
+        self.retry_policies.update(retry_policies or {})
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                json_serialize=lambda o: dumps(o).decode("utf-8"),
+                headers={"Authorization": f"Bearer {self.api_token}"}
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        data: Optional[Dict[str, Any]] = None,
+        ndjson: Optional[bytes] = None
+    ):
+        kwargs = {}
+        if ndjson is not None:
+            kwargs["data"] = ndjson
+            kwargs["headers"] = {"Content-Type": "application/x-ndjson"}
+        elif data is not None:
+            kwargs["json"] = data
+
+        async with self.session.request(method, f"{self.base_url}/{path}", **kwargs) as response:
+            content = await response.read()
+            retry_after_seconds = parse_retry_after(response.headers.get("Retry-After"))
+            try:
+                body = loads(content)
+            except ValueError:
+                raise CloudflareRequestError(
+                    response.status,
+                    f"HTTP response code {response.status}: {content[:200].decode('utf-8', 'replace')}",
+                    status=response.status,
+                    retry_after=retry_after_seconds
+                )
+
+        if not body.get("success", False):
+            errors = body.get("errors") or [{"code": response.status, "message": f"HTTP response code {response.status}"}]
+            raise CloudflareRequestError(
+                errors[0].get("code", response.status),
+                errors[0].get("message"),
+                errors[1:] or None,
+                status=response.status,
+                retry_after=retry_after_seconds
+            )
+        return body.get("result")
+
+    @retried(VECTORIZE, idempotent=False)
+    async def create_vector_index(self, name: str, preset: str, description: Optional[str] = None):
+        data = {
+            "name": name,
+            "config": {
+                "preset": preset
+            }
+        }
+        if description is not None:
+            data["description"] = description
+
+        return await self._request("POST", "vectorize/indexes", data=data)
+
+    @retried(VECTORIZE)
+    async def query_vector_index(
+        self,
+        vector_index_name: str,
+        vector: List[float],
+        top_k: Optional[int] = 5,
+        return_vectors: Optional[bool] = False,
+        return_metadata: Optional[bool] = False,
+        metadata_filter: Optional[Dict[str, Any]] = None
+    ):
+        data = {
+            "vector": vector,
+            "topK": top_k,
+            "returnMetadata": return_metadata,
+        }
+        if return_vectors:
+            data["returnValues"] = True
+
+        if metadata_filter is not None:
+            data["filter"] = metadata_filter
+
+        return await self._request("POST", f"vectorize/indexes/{vector_index_name}/query", data=data)
+
+    @retried(VECTORIZE)
+    async def list_vector_indexes(self):
+        return await self._request("GET", "vectorize/indexes")
+
+    @retried(VECTORIZE)
+    async def vectors_by_ids(self, vector_index_name: str, ids: List[str]):
+        return await self._request("POST", f"vectorize/indexes/{vector_index_name}/get-by-ids", data={
+            "ids": ids
+        })
+
+    @retried(VECTORIZE)
+    async def vector_index_by_name(self, name: str):
+        return await self._request("GET", f"vectorize/indexes/{name}")
+
+    @retried(VECTORIZE, idempotent=False)
+    async def delete_vector_index_by_name(self, name: str):
+        return await self._request("DELETE", f"vectorize/indexes/{name}")
+
+    @retried(VECTORIZE)
+    async def delete_vectors_by_ids(self, vector_index_name: str, ids: List[str]):
+        return await self._request("POST", f"vectorize/indexes/{vector_index_name}/delete-by-ids", data={
+            "ids": ids
+        })
+
+    async def insert_vectors(
+            self,
+            vector_index_name: str,
+            vectors: List[VectorPayloadItem],
+            create_on_not_found: bool = False,
+            model_name: CloudflareEmbeddingModels = None
+    ):
+        """
+        Insert `vectors`, creating the index first if it doesn't exist and `create_on_not_found` is set.
+        Not retried itself, so that each upstream call goes through its own retry policy exactly once.
+        """
+        try:
+            return await self._insert_vectors(vector_index_name, vectors)
+        except CloudFlare.exceptions.CloudFlareAPIError as ex:
+            if int(ex) != ERROR_CODE_VECTOR_INDEX_NOT_FOUND or not create_on_not_found:
+                raise insert_error(vector_index_name, ex)
+
+        # infer dimensionality from the vector at index 0
+        default_dimensionality_presets = DIMENSIONALITY_PRESETS.get(len(vectors[0].values), [])
+        if not default_dimensionality_presets:
+            allowed_dimensionality_values = ','.join([str(o) for o in DIMENSIONALITY_PRESETS.keys()])
+            raise Exception(
+                f"Unsupported vector preset dimensionality. "
+                f"Expected one of: {allowed_dimensionality_values}, got: {len(vectors[0].values)}"
+            )
+
+        preset = str(model_name) if model_name is not None else default_dimensionality_presets[0].value
+        await self.create_vector_index(
+            name=vector_index_name,
+            preset=preset
+        )
+        try:
+            return await self._insert_vectors(vector_index_name, vectors)
+        except CloudFlare.exceptions.CloudFlareAPIError as ex:
+            raise insert_error(vector_index_name, ex)
+
+    @retried(VECTORIZE)
+    async def _insert_vectors(self, vector_index_name: str, vectors: List[VectorPayloadItem]):
+        UPSTREAM_BATCH_SIZE.observe(len(vectors), upstream=VECTORIZE, operation="insert_vectors")
+        data = b"\n".join([dumps({"id": o.id, "values": o.values, "metadata": o.metadata}) for o in vectors])
+        return await self._request("POST", f"vectorize/indexes/{vector_index_name}/insert", ndjson=data)
+
+    async def embed(self, model, texts: List[str]):
+        if self.cache is None or not self.cache.enabled:
+            return await self._embed(model=model, texts=texts)
+
+        model = str(model)
+        vectors, misses = await self.cache.lookup(model, texts)
+        if misses:
+            res = await self._embed(model=model, texts=misses)
+            vectors = await self.cache.fill(model, texts, vectors, misses, res.get('data', []))
+
+        return embedding_result(vectors)
+
+    @retried(WORKERS_AI)
+    async def _embed(self, model, texts: List[str]):
+        UPSTREAM_BATCH_SIZE.observe(len(texts), upstream=WORKERS_AI, operation="embed")
+        return await self._request("POST", f"ai/run/{model}", data={
+            "text": texts
+        })
+
+    @retried(D1)
+    async def _database_query(self, database_id: str, sql: str, params: Optional[List[Any]] = None):
+        data = {"sql": sql}
+        if params:
+            data["params"] = params
+        return await self._request("POST", f"d1/database/{database_id}/query", data=data)
+
+    @retried(D1)
+    async def _database_batch(self, database_id: str, statements: List[Dict[str, Any]]):
+        """Run several statements in a single round trip, returning one result per statement"""
+        UPSTREAM_BATCH_SIZE.observe(len(statements), upstream=D1, operation="database_batch")
+        return await self._request("POST", f"d1/database/{database_id}/query", data={
+            "batch": statements
+        })
+
+    async def create_database_table(self, database_id: str, table_name: str):
+        """Create the table for a namespace, along with its `vector_id` index, once per process"""
+        if (database_id, table_name) in self._database_tables:
+            return
+
+        table = quote_identifier(table_name)
+        await self._database_batch(database_id, [
+            {"sql": f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT NOT NULL,
+                    vector_id TEXT NOT NULL UNIQUE,
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """},
+            {"sql": f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'{table_name}_vector_id')} ON {table} (vector_id);"}
+        ])
+        self._database_tables.add((database_id, table_name))
+
+    async def upsert_database_table_records(self, database_id: str, table_name: str, records: List[CreateDatabaseRecord]):
+        if not records:
+            return {"success": True, "results": []}
+
+        await self.create_database_table(database_id, table_name)
+
+        table = quote_identifier(table_name)
+        statements = []
+        # two bound parameters per record
+        for chunk in chunked(records, D1_MAX_BOUND_PARAMETERS // 2):
+            statements.append({
+                "sql": f"""
+                    INSERT INTO {table} (source, vector_id)
+                    VALUES {", ".join(["(?, ?)"] * len(chunk))}
+                    ON CONFLICT (vector_id) DO UPDATE SET source = excluded.source;
+                """,
+                "params": [value for record in chunk for value in (record.source, record.vector_id)]
+            })
+        try:
+            res = await self._database_batch(database_id, statements)
+        except CloudFlare.exceptions.CloudFlareAPIError:
+            # the table may have been dropped since it was created by this process
+            self._database_tables.discard((database_id, table_name))
+            raise
+        return next((o for o in res if not o.get('success')), res[-1])
+
+    async def database_table_records_by_vector_ids(self, database_id: str, table_name: str, vector_ids: List[str]):
+        if not vector_ids:
+            return [{"success": True, "results": []}]
+
+        table = quote_identifier(table_name)
+        res = await self._database_batch(database_id, [{
+            "sql": f"SELECT source, vector_id FROM {table} WHERE vector_id IN ({', '.join(['?'] * len(chunk))});",
+            "params": list(chunk)
+        } for chunk in chunked(vector_ids, D1_MAX_BOUND_PARAMETERS)])
+        # merged into a single result, as though the lookup were one statement
+        return [{
+            "success": all(o.get('success') for o in res),
+            "results": [row for o in res for row in o.get('results', [])]
+        }]
+
+    async def list_database_table_records(
+            self,
+            database_id: str,
+            table_name: str,
+            limit: int = 20,
+            after_id: int = 0
+    ):
+        """Page through a table in `id` order, starting after `after_id`, so each page is an index seek"""
+        res = await self._database_query(
+            database_id,
+            f"SELECT id, source, vector_id FROM {quote_identifier(table_name)} WHERE id > ? ORDER BY id LIMIT ?;",
+            [after_id, limit]
+        )
+        return res[0].get('results', [])
+
+    async def database_table_record_id_at(self, database_id: str, table_name: str, offset: int) -> Optional[int]:
+        """Return the `id` of the record at position `offset` in `id` order, if there is one"""
+        res = await self._database_query(
+            database_id,
+            f"SELECT id FROM {quote_identifier(table_name)} ORDER BY id LIMIT 1 OFFSET ?;",
+            [offset]
+        )
+        rows = res[0].get('results', [])
+        return rows[0].get('id') if rows else None
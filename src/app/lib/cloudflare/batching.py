@@ -0,0 +1,91 @@
+import asyncio
+
+from typing import List, Dict, Tuple, Set, Any
+
+from app.lib.metrics import Histogram
+
+from .async_api import AsyncAPI
+from .constants import MAX_EMBEDDING_BATCH_SIZE
+
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100)
+WAIT_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces texts from concurrent callers into a single Workers AI call per model.
+
+    Pending texts are flushed once `max_batch_size` texts are queued for a model, or
+    `max_wait` seconds after the first of them was queued, whichever happens first.
+    Each caller awaits only the vectors for its own texts.
+    """
+
+    def __init__(self, client: AsyncAPI, max_batch_size: int = MAX_EMBEDDING_BATCH_SIZE, max_wait: float = 0.005):
+        self.client = client
+        self.max_batch_size = min(max_batch_size, MAX_EMBEDDING_BATCH_SIZE)
+        self.max_wait = max_wait
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.wait_times = Histogram(WAIT_TIME_BUCKETS)
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future, float]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def embed(self, model, texts: List[str]) -> List[List[float]]:
+        model = str(model)
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.setdefault(model, []).append((text, future, loop.time()))
+            futures.append(future)
+            if len(self._pending[model]) >= self.max_batch_size:
+                self._flush(model)
+
+        if self._pending.get(model) and model not in self._timers:
+            self._timers[model] = loop.call_later(self.max_wait, self._flush, model)
+
+        return list(await asyncio.gather(*futures))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self.batch_sizes.snapshot(),
+            "wait_seconds": self.wait_times.snapshot()
+        }
+
+    def _flush(self, model: str):
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(model, [])
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(model, batch))
+            # hold a reference until the dispatch completes, otherwise the task may be garbage collected
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, model: str, batch: List[Tuple[str, asyncio.Future, float]]):
+        now = asyncio.get_running_loop().time()
+        self.batch_sizes.observe(len(batch))
+        for _, _, enqueued_at in batch:
+            self.wait_times.observe(now - enqueued_at)
+
+        try:
+            res = await self.client.embed(
+                model=model,
+                texts=[text for text, _, _ in batch]
+            )
+            vectors = res.get('data', [])
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embedding vectors, received {len(vectors)}")
+        except Exception as ex:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+
+        for (_, future, _), vector in zip(batch, vectors):
+            # callers may have been cancelled whilst the batch was in flight
+            if not future.done():
+                future.set_result(vector)
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple
+
+from app.exceptions import UnknownThirdPartyException
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and apply NFC normalization, so trivially different inputs share a key"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed on (model, hash of normalized text).
+
+    Lookups go to a bounded in-memory LRU first and fall back to an optional
+    SQLite file, promoting any disk hits back into memory. With a SQLite file,
+    lookups and writes run in a thread, off the event loop.
+    """
+
+    def __init__(self, max_size: int = 10000, path: Optional[str] = None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL;")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL);"
+            )
+            self._connection.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 or self._connection is not None
+
+    async def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector for each text, or `None` where the text has not been embedded yet"""
+        if self._connection is None:
+            return self._get_many(model, texts)
+        return await asyncio.to_thread(self._get_many, model, texts)
+
+    async def set_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        if self._connection is None:
+            self._set_many(model, texts, vectors)
+        else:
+            await asyncio.to_thread(self._set_many, model, texts, vectors)
+
+    async def lookup(self, model: str, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        """Return the cached vectors along with the distinct texts that still need embedding"""
+        vectors = await self.get_many(model, texts)
+        misses = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        return vectors, misses
+
+    async def fill(
+        self,
+        model: str,
+        texts: List[str],
+        vectors: List[Optional[List[float]]],
+        misses: List[str],
+        embedded: List[List[float]]
+    ) -> List[List[float]]:
+        """Store freshly embedded misses and stitch them back into the original input order"""
+        if len(embedded) != len(misses):
+            raise UnknownThirdPartyException(
+                f"Expected {len(misses)} embeddings from {model}, got {len(embedded)}"
+            )
+        await self.set_many(model, misses, embedded)
+        embedded = dict(zip(misses, embedded))
+        return [vector if vector is not None else embedded[text] for text, vector in zip(texts, vectors)]
+
+    def _get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [cache_key(model, text) for text in texts]
+        with self._lock:
+            results = [self._entries.get(key) for key in keys]
+            for key, result in zip(keys, results):
+                if result is not None:
+                    self._entries.move_to_end(key)
+
+            missing = [key for key, result in zip(keys, results) if result is None]
+            if missing and self._connection is not None:
+                stored = self._read(missing)
+                for i, key in enumerate(keys):
+                    if results[i] is None and key in stored:
+                        results[i] = stored[key]
+                        self._remember(key, stored[key])
+
+            hits = sum(1 for o in results if o is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def _set_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        entries = {cache_key(model, text): vector for text, vector in zip(texts, vectors)}
+        with self._lock:
+            for key, vector in entries.items():
+                self._remember(key, vector)
+            if self._connection is not None:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?);",
+                    [(key, array("f", vector).tobytes()) for key, vector in entries.items()]
+                )
+                self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "persistent": self._connection is not None
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM embeddings;")
+                self._connection.commit()
+
+    def _remember(self, key: str, vector: List[float]):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _read(self, keys: List[str]) -> Dict[str, List[float]]:
+        stored = {}
+        # stay well below SQLite's bound variable limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders});",
+                chunk
+            ).fetchall()
+            stored.update({key: array("f", blob).tolist() for key, blob in rows})
+        return stored
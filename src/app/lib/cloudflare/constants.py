@@ -0,0 +1,94 @@
+import re
+import enum
+
+from typing import List, Dict, Any
+
+from app.exceptions import EmbeddingDimensionalityException
+
+
+# Error codes
+ERROR_CODE_VECTOR_INDEX_NOT_FOUND = 3000
+ERROR_CODE_INSERT_VECTOR_INDEX_SIZE_MISMATCH = 4003
+
+
+# input dimensions
+MAX_EMBEDDING_INPUT_TOKENS = 512
+
+# maximum number of texts accepted by a single Workers AI embedding request
+MAX_EMBEDDING_BATCH_SIZE = 100
+
+# maximum number of vectors accepted by a single Vectorize insert request
+MAX_VECTORIZE_BATCH_SIZE = 1000
+
+# output dimensions
+OUTPUT_SMALL_DIMENSION = 384
+OUTPUT_BASE_DIMENSION = 768
+OUTPUT_LARGE_DIMENSION = 1024
+
+
+MODEL_NAME_BGE_SMALL = "@cf/baai/bge-small-en-v1.5"
+MODEL_NAME_BGE_BASE = "@cf/baai/bge-base-en-v1.5"
+MODEL_NAME_BGE_LARGE = "@cf/baai/bge-large-en-v1.5"
+
+
+MODEL_OUTPUT_DIMENSIONS = {
+    MODEL_NAME_BGE_SMALL: OUTPUT_SMALL_DIMENSION,
+    MODEL_NAME_BGE_BASE: OUTPUT_BASE_DIMENSION,
+    MODEL_NAME_BGE_LARGE: OUTPUT_LARGE_DIMENSION
+}
+
+
+MODEL_MAX_BATCH_SIZES = {
+    MODEL_NAME_BGE_SMALL: MAX_EMBEDDING_BATCH_SIZE,
+    MODEL_NAME_BGE_BASE: MAX_EMBEDDING_BATCH_SIZE,
+    MODEL_NAME_BGE_LARGE: MAX_EMBEDDING_BATCH_SIZE
+}
+
+
+class CloudflareEmbeddingModels(enum.Enum):
+    BAAISmall = MODEL_NAME_BGE_SMALL
+    BAAIBase = MODEL_NAME_BGE_BASE
+    BAAILarge = MODEL_NAME_BGE_LARGE
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+    @property
+    def dimensionality(self) -> int:
+        return MODEL_OUTPUT_DIMENSIONS.get(self.value)
+
+    @property
+    def max_batch_size(self) -> int:
+        return MODEL_MAX_BATCH_SIZES.get(self.value, MAX_EMBEDDING_BATCH_SIZE)
+
+
+DIMENSIONALITY_PRESETS = {
+    OUTPUT_SMALL_DIMENSION: [CloudflareEmbeddingModels.BAAISmall],
+    OUTPUT_BASE_DIMENSION: [CloudflareEmbeddingModels.BAAIBase],
+    OUTPUT_LARGE_DIMENSION: [CloudflareEmbeddingModels.BAAILarge]
+}
+
+
+def embedding_result(vectors: List[List[float]]) -> Dict[str, Any]:
+    """Mirror the shape of a Workers AI embedding response for vectors assembled locally"""
+    return {
+        "shape": [len(vectors), len(vectors[0]) if vectors else 0],
+        "data": vectors
+    }
+
+
+def dimensionality_mismatch_exception(vector_index_name: str, message: str) -> EmbeddingDimensionalityException:
+    matches = re.search(
+        r"the vector length is incorrect for this index; must be (\d+), got (\d+)",
+        message
+    )
+    expected_dimension = int(matches.group(1))
+    received_dimension = int(matches.group(2))
+    compatible_model_names = ','.join([str(o) for o in DIMENSIONALITY_PRESETS.get(expected_dimension, [])])
+    # raise a pydantic validation error?
+    return EmbeddingDimensionalityException(
+        f"The embedding model's dimensionality: {received_dimension} is "
+        f"not compatible with the dimensionality of the namespace '{vector_index_name}', "
+        f"dimensionality: {expected_dimension}. "
+        f"Please provide one of the following compatible models: {compatible_model_names}",
+    )
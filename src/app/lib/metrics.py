@@ -0,0 +1,213 @@
+import time
+
+from bisect import bisect_left
+from typing import Sequence, Dict, Any, Tuple, List, Union
+
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+
+class Histogram:
+    """Cumulative bucketed histogram, following Prometheus `le` (less than or equal) semantics"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": self.sum
+        }
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape_label_value(str(value))}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    """Monotonic counter per combination of label values. Updated from the event loop only, so without locking"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(labels[o] for o in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class HistogramMetric:
+    """`Histogram` per combination of label values"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.histograms: Dict[Tuple[str, ...], Histogram] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels[o] for o in self.labelnames)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, key + (format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(histogram.sum)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {histogram.count}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text exposition format"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics: Dict[str, Union[Counter, HistogramMetric]] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str] = ()
+    ) -> HistogramMetric:
+        return self._register(HistogramMetric(name, documentation, buckets, labelnames))
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Time taken to serve a request, until its response has been sent, by route",
+    LATENCY_BUCKETS,
+    ("method", "route", "status")
+)
+UPSTREAM_DURATION = registry.histogram(
+    "upstream_request_duration_seconds",
+    "Time taken by a call to an upstream service, including retries",
+    LATENCY_BUCKETS,
+    ("upstream", "operation")
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "upstream_requests_total",
+    "Calls to upstream services, by outcome: ok, or the error code of the last attempt",
+    ("upstream", "operation", "code")
+)
+UPSTREAM_RETRIES = registry.counter(
+    "upstream_retries_total",
+    "Attempts beyond the first made for calls to upstream services",
+    ("upstream", "operation")
+)
+UPSTREAM_REJECTED = registry.counter(
+    "upstream_rejected_total",
+    "Calls failed fast, without being attempted, whilst the upstream's circuit breaker is open",
+    ("upstream",)
+)
+UPSTREAM_BATCH_SIZE = registry.histogram(
+    "upstream_batch_size",
+    "Items per request sent to an upstream service, retries included, e.g. texts embedded or points upserted",
+    BATCH_SIZE_BUCKETS,
+    ("upstream", "operation")
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording each request's duration against the template of the route
+    which served it, e.g. `/api/v1/embeddings/qdrant/{namespace}`, so that the number of
+    series stays bounded. Requests matching no route are recorded as `unmatched`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started_at,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code)
+            )
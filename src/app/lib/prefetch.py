@@ -0,0 +1,52 @@
+import time
+import asyncio
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Hashable, Optional, Tuple
+
+
+class Prefetcher:
+    """
+    Per-process store of in-flight lookups started ahead of the request which needs them,
+    e.g. the next page of a listing whilst the current page is still being assembled.
+
+    At most `max_size` lookups are kept, each for up to `ttl` seconds; evicted ones are cancelled.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._tasks: OrderedDict[Hashable, Tuple[float, asyncio.Task]] = OrderedDict()
+
+    def start(self, key: Hashable, awaitable: Awaitable[Any]):
+        self._discard(key)
+        task = asyncio.ensure_future(awaitable)
+        # failures are only of interest to whoever takes the result
+        task.add_done_callback(lambda o: o.cancelled() or o.exception())
+        self._tasks[key] = (time.monotonic() + self.ttl, task)
+        while len(self._tasks) > self.max_size:
+            self._discard(next(iter(self._tasks)))
+
+    async def take(self, key: Hashable) -> Optional[Any]:
+        """Return the result of the lookup started for `key`, or None if there is no usable one"""
+        entry = self._tasks.pop(key, None)
+        if entry is None:
+            return None
+
+        expires_at, task = entry
+        if expires_at < time.monotonic():
+            task.cancel()
+            return None
+        try:
+            return await task
+        except Exception:
+            return None
+
+    def clear(self):
+        for key in list(self._tasks):
+            self._discard(key)
+
+    def _discard(self, key: Hashable):
+        entry = self._tasks.pop(key, None)
+        if entry is not None:
+            entry[1].cancel()
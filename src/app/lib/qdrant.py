@@ -0,0 +1,127 @@
+import re
+
+import httpx
+
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException
+
+from app.lib.retry import RetryPolicy, CircuitBreaker, parse_retry_after
+from app.lib.metrics import UPSTREAM_BATCH_SIZE
+
+
+QDRANT = "Qdrant"
+
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# creating or deleting a collection twice doesn't have the same outcome as doing it once
+NON_IDEMPOTENT_REQUEST = re.compile(r"^(PUT|DELETE) /collections/[^/]+$")
+
+COLLECTION_PATH = re.compile(r"^/collections/[^/]+")
+PATH_PARAMETER = re.compile(r"(?<=/)(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?=/|$)")
+
+# names of the client methods behind the REST requests they make, for the upstream metrics
+OPERATIONS = {
+    "PUT /collections/{name}/points": "upsert",
+    "POST /collections/{name}/points": "retrieve",
+    "POST /collections/{name}/points/search": "search",
+    "POST /collections/{name}/points/search/batch": "search_batch",
+    "POST /collections/{name}/points/scroll": "scroll",
+    "POST /collections/{name}/points/count": "count",
+    "POST /collections/{name}/points/delete": "delete",
+    "GET /collections": "get_collections",
+    "GET /collections/{name}": "get_collection",
+    "PUT /collections/{name}": "create_collection",
+    "DELETE /collections/{name}": "delete_collection",
+}
+
+
+def operation(request: httpx.Request) -> str:
+    """The operation a request performs, e.g. `search`, else its method and path with the collection and ids templated"""
+    path = PATH_PARAMETER.sub("{id}", COLLECTION_PATH.sub("/collections/{name}", request.url.path))
+    key = f"{request.method} {path}"
+    return OPERATIONS.get(key, key)
+
+
+def observe_batch_size(operation: str, size: int):
+    """Record the number of items in a request, which the middleware can't see without parsing its body"""
+    UPSTREAM_BATCH_SIZE.observe(size, upstream=QDRANT, operation=operation)
+
+
+class ErrorResponse(Exception):
+    """Raised for error responses, so that they go through the retry policy"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP response code {response.status_code}")
+        self.response = response
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+
+class TransientResponse(ErrorResponse):
+    """Raised for error responses worth retrying"""
+
+
+def is_transient(ex: BaseException, idempotent: bool = True) -> bool:
+    if isinstance(ex, TransientResponse):
+        return ex.response.status_code == 429 or idempotent
+    if isinstance(ex, ResponseHandlingException):
+        # the request never reached Qdrant if the connection couldn't be made
+        return isinstance(ex.source, httpx.ConnectError) or (idempotent and isinstance(ex.source, httpx.TransportError))
+    return False
+
+
+def is_rejection(ex: BaseException) -> bool:
+    """Whether Qdrant responded to the request and rejected it, which shows that it's up"""
+    return isinstance(ex, ErrorResponse) and 400 <= ex.response.status_code < 500
+
+
+def error_code(ex: BaseException) -> str:
+    if isinstance(ex, ErrorResponse):
+        return str(ex.response.status_code)
+    if isinstance(ex, ResponseHandlingException) and ex.source is not None:
+        return type(ex.source).__name__
+    return type(ex).__name__
+
+
+def retry_policy(failure_threshold: int = 5, reset_timeout: float = 30, **kwargs) -> RetryPolicy:
+    return RetryPolicy(
+        retryable=is_transient,
+        rejected=is_rejection,
+        retry_after=lambda ex: getattr(ex, "retry_after", None),
+        name=QDRANT,
+        error_code=error_code,
+        breaker=CircuitBreaker(QDRANT, failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+        **kwargs
+    )
+
+
+class RetryMiddleware:
+    """Qdrant REST client middleware which runs every request under a `RetryPolicy`, and so records it in the upstream metrics"""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+
+    async def __call__(self, request: httpx.Request, call_next) -> httpx.Response:
+        async def send() -> httpx.Response:
+            response = await call_next(request)
+            if response.status_code in TRANSIENT_STATUS_CODES:
+                raise TransientResponse(response)
+            if response.status_code >= 400:
+                raise ErrorResponse(response)
+            return response
+
+        try:
+            return await self.policy.call(
+                send,
+                idempotent=not NON_IDEMPOTENT_REQUEST.match(f"{request.method} {request.url.path}"),
+                operation=operation(request)
+            )
+        except ErrorResponse as ex:
+            # not worth retrying, or out of retries, so let the client handle the response as usual
+            return ex.response
+
+
+def add_retry_policy(client: AsyncQdrantClient, policy: RetryPolicy):
+    """Retry the client's REST requests under `policy`; gRPC requests and local mode clients are left as they are"""
+    http = getattr(getattr(client, "_client", None), "http", None)
+    if http is not None:
+        http.client.add_middleware(RetryMiddleware(policy))
@@ -0,0 +1,58 @@
+from pydantic import BaseModel
+from starlette.types import Scope, Receive, Send
+from starlette.responses import Response, StreamingResponse
+
+from app.lib.serialization import dumps
+from app.lib.timing import stage
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response for handlers that keep reading the request body whilst responding.
+
+    Starlette's StreamingResponse listens for a disconnect by consuming `receive`, which would
+    swallow the rest of the request body. Here a disconnect surfaces whilst the body is read instead.
+
+    The response only starts with its first chunk, so that an error raised before then, e.g. on the
+    first lines of an upload, is still answered by its exception handler.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+    async def stream_response(self, send: Send) -> None:
+        started = False
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(self.charset)
+            if not started:
+                await self.start_response(send)
+                started = True
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        if not started:
+            await self.start_response(send)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def start_response(self, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+
+
+class ModelResponse(Response):
+    """
+    JSON response for a model assembled from trusted data, e.g. with `model_construct` from upstream results.
+
+    Returning it from a route skips FastAPI's re-validation and serialization against the `response_model`,
+    which for vector-heavy models means validating every float twice.
+    """
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        with stage("serialize"):
+            return dumps(content)
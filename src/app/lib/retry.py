@@ -0,0 +1,183 @@
+import time
+import random
+import asyncio
+import functools
+
+from typing import Callable, Optional, Awaitable, Any
+
+from app.exceptions import UpstreamUnavailableException
+from app.lib.metrics import UPSTREAM_DURATION, UPSTREAM_REQUESTS, UPSTREAM_RETRIES, UPSTREAM_REJECTED
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a `Retry-After` header, if it holds a number of seconds rather than a date"""
+    try:
+        return max(float(value), 0) if value is not None else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream after `failure_threshold` consecutive transient failures,
+    failing them fast instead. Every `reset_timeout` seconds a single trial call is let through:
+    success closes the circuit again, failure keeps it open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+    def before(self):
+        """Raise `UpstreamUnavailableException` if the call shouldn't be attempted"""
+        if self._opened_at is None:
+            return
+
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0:
+            raise UpstreamUnavailableException(
+                f"{self.name} is unavailable, retry in {max(remaining, 1):.0f} seconds",
+                retry_after=max(remaining, 1)
+            )
+        # calls made whilst the trial is in flight fail fast, as though the circuit were still open
+        self._opened_at = time.monotonic()
+        self._trial = True
+
+    def success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class RetryPolicy:
+    """
+    Retry policy for one upstream service.
+
+    Only errors for which `retryable(ex, idempotent)` holds are retried; non-idempotent calls
+    should only be retried when the upstream can't have acted on the request. Attempts back off
+    exponentially with full jitter, capped at `max_delay`, unless the error carries a longer
+    `retry_after` (e.g. from a 429 response). No attempt starts later than `deadline` seconds after
+    the first. Transient failures count towards the optional circuit `breaker`, and errors for which
+    `rejected(ex)` holds, i.e. responses rejecting the request itself, reset it. Any other error,
+    e.g. one raised locally whilst handling a response, leaves the breaker as it is.
+
+    Each call's duration and outcome (`ok`, or `error_code` of the error it raised) are recorded
+    in the upstream metrics under `name` and the call's `operation`, along with its retries.
+    """
+
+    def __init__(
+        self,
+        retryable: Callable[[BaseException, bool], bool],
+        rejected: Callable[[BaseException], bool] = lambda ex: False,
+        retry_after: Callable[[BaseException], Optional[float]] = lambda ex: None,
+        name: str = "upstream",
+        error_code: Callable[[BaseException], str] = lambda ex: type(ex).__name__,
+        tries: int = 4,
+        delay: float = 0.25,
+        max_delay: float = 4,
+        deadline: float = 15,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.retryable = retryable
+        self.rejected = rejected
+        self.retry_after = retry_after
+        self.name = name
+        self.error_code = error_code
+        self.tries = tries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], idempotent: bool = True, operation: str = "call") -> Any:
+        started_at = time.perf_counter()
+        code = "ok"
+        try:
+            return await self._call(fn, idempotent, operation)
+        except UpstreamUnavailableException:
+            code = "circuit_open"
+            UPSTREAM_REJECTED.inc(upstream=self.name)
+            raise
+        except Exception as ex:
+            code = self.error_code(ex)
+            raise
+        finally:
+            UPSTREAM_DURATION.observe(time.perf_counter() - started_at, upstream=self.name, operation=operation)
+            UPSTREAM_REQUESTS.inc(upstream=self.name, operation=operation, code=code)
+
+    async def _call(self, fn: Callable[[], Awaitable[Any]], idempotent: bool, operation: str) -> Any:
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.before()
+
+            if attempt:
+                UPSTREAM_RETRIES.inc(upstream=self.name, operation=operation)
+            attempt += 1
+            try:
+                result = await fn()
+            except Exception as ex:
+                if not self.retryable(ex, True):
+                    if self.rejected(ex):
+                        # the upstream responded, it just didn't like the request
+                        self._succeeded()
+                    raise
+
+                self._failed()
+                if attempt >= self.tries or not self.retryable(ex, idempotent):
+                    raise
+
+                wait = self.backoff(attempt)
+                retry_after = self.retry_after(ex)
+                if retry_after is not None:
+                    wait = max(wait, retry_after)
+                if time.monotonic() + wait - started_at > self.deadline:
+                    raise
+                await asyncio.sleep(wait)
+            else:
+                self._succeeded()
+                return result
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.delay * 2 ** (attempt - 1)))
+
+    def _succeeded(self):
+        if self.breaker is not None:
+            self.breaker.success()
+
+    def _failed(self):
+        if self.breaker is not None:
+            self.breaker.failure()
+
+
+def retried(upstream: str, idempotent: bool = True):
+    """Run a client method under `self.retry_policies[upstream]`, recorded as an operation named after the method"""
+    def decorator(fn):
+        operation = fn.__name__.lstrip("_")
+
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            return await self.retry_policies[upstream].call(
+                functools.partial(fn, self, *args, **kwargs),
+                idempotent=idempotent,
+                operation=operation
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,30 @@
+import json
+
+from typing import Any, Union
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library and pydantic's own serializer are used without it
+    orjson = None
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, BaseModel):
+        # the fields as they are, without a round trip through `model_dump`
+        return dict(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def loads(content: Union[bytes, str]) -> Any:
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON bytes, with orjson if it is installed; pydantic models are written as objects"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    if isinstance(content, BaseModel):
+        return content.model_dump_json().encode("utf-8")
+    return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,132 @@
+import abc
+import asyncio
+import sqlite3
+import threading
+
+import CloudFlare
+
+from typing import List, Dict
+
+from app.exceptions import UnknownThirdPartyException
+from app.lib.cloudflare.models import CreateDatabaseRecord
+from app.lib.cloudflare.async_api import AsyncAPI
+
+
+# ids per `IN (...)` lookup, below the 999 bound parameters allowed by older SQLite builds
+SQLITE_CHUNK_SIZE = 500
+
+
+class SourceStore(abc.ABC):
+    """Persists the original text each vector was embedded from, keyed by namespace and vector id"""
+
+    @abc.abstractmethod
+    async def put_many(self, namespace: str, records: List[CreateDatabaseRecord]):
+        pass
+
+    @abc.abstractmethod
+    async def get_many(self, namespace: str, vector_ids: List[str]) -> Dict[str, str]:
+        """Return the source text of each of `vector_ids` that has one, by vector id"""
+        pass
+
+    async def close(self):
+        pass
+
+
+class D1SourceStore(SourceStore):
+    """Stores source text in a Cloudflare D1 table per namespace"""
+
+    def __init__(self, client: AsyncAPI, database_id: str):
+        self.client = client
+        self.database_id = database_id
+
+    async def put_many(self, namespace: str, records: List[CreateDatabaseRecord]):
+        if not records:
+            return
+
+        result = await self.client.upsert_database_table_records(
+            database_id=self.database_id,
+            table_name=namespace,
+            records=records
+        )
+        if not result.get('success'):
+            raise UnknownThirdPartyException(
+                "Something went wrong whilst attempting to persist the source text to Cloudflare D1"
+            )
+
+    async def get_many(self, namespace: str, vector_ids: List[str]) -> Dict[str, str]:
+        if not vector_ids:
+            return {}
+
+        try:
+            result = await self.client.database_table_records_by_vector_ids(
+                database_id=self.database_id,
+                table_name=namespace,
+                vector_ids=vector_ids
+            )
+        except CloudFlare.exceptions.CloudFlareAPIError as ex:
+            raise UnknownThirdPartyException(str(ex))
+        rows = result[0].get('results', []) if result else []
+        return {o.get('vector_id'): o.get('source') for o in rows}
+
+
+class SQLiteSourceStore(SourceStore):
+    """
+    Stores source text in a local SQLite file (WAL mode), so that self-hosted
+    deployments don't depend on a round trip to Cloudflare for every insert.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute("PRAGMA synchronous=NORMAL;")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                namespace TEXT NOT NULL,
+                vector_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (namespace, vector_id)
+            ) WITHOUT ROWID;
+        """)
+        self._connection.commit()
+
+    async def put_many(self, namespace: str, records: List[CreateDatabaseRecord]):
+        if not records:
+            return
+        await asyncio.to_thread(self._put_many, namespace, records)
+
+    async def get_many(self, namespace: str, vector_ids: List[str]) -> Dict[str, str]:
+        if not vector_ids:
+            return {}
+        return await asyncio.to_thread(self._get_many, namespace, vector_ids)
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+    def _put_many(self, namespace: str, records: List[CreateDatabaseRecord]):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO sources (namespace, vector_id, source) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, vector_id) DO UPDATE SET source = excluded.source;",
+                [(namespace, o.vector_id, o.source) for o in records]
+            )
+            self._connection.commit()
+
+    def _get_many(self, namespace: str, vector_ids: List[str]) -> Dict[str, str]:
+        sources = {}
+        with self._lock:
+            # stay within SQLite's limit on bound parameters
+            for i in range(0, len(vector_ids), SQLITE_CHUNK_SIZE):
+                chunk = vector_ids[i:i + SQLITE_CHUNK_SIZE]
+                placeholders = ",".join("?" for _ in chunk)
+                sources.update(self._connection.execute(
+                    f"SELECT vector_id, source FROM sources WHERE namespace = ? AND vector_id IN ({placeholders});",
+                    (namespace, *chunk)
+                ).fetchall())
+        return sources
+
+    def _close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,346 @@
+import re
+import abc
+import time
+import queue
+import asyncio
+import logging
+import secrets
+import functools
+import threading
+
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Tuple, Any, Callable
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from app.exceptions import EnvironmentVariableConfigException
+from app.lib.serialization import dumps
+
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Timings:
+    """Stages recorded whilst serving one request, each as its name, `perf_counter` start and duration"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.started_at_ns = time.time_ns()
+        self.stages: List[Tuple[str, float, float]] = []
+        self._open: Dict[str, float] = {}
+
+    def record(self, name: str, started_at: float, duration: float):
+        self.stages.append((name, started_at, duration))
+
+    def begin(self, name: str):
+        self._open[name] = time.perf_counter()
+
+    def end(self, name: str):
+        started_at = self._open.pop(name, None)
+        if started_at is not None:
+            self.record(name, started_at, time.perf_counter() - started_at)
+
+    def totals(self) -> Dict[str, float]:
+        totals = {}
+        for name, _, duration in self.stages:
+            totals[name] = totals.get(name, 0) + duration
+        return totals
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value, in milliseconds, with the time spent in each stage and in total so far"""
+        metrics = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.totals().items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def unix_nano(self, perf_counter: float) -> int:
+        return self.started_at_ns + int((perf_counter - self.started_at) * 1e9)
+
+
+_timings: ContextVar[Optional[Timings]] = ContextVar("timings", default=None)
+
+
+class stage:
+    """
+    Record the time spent in a block as a stage of the current request, e.g.
+
+        with stage("embed"):
+            vectors = await cloudflare.embed(...)
+
+    Stages recorded more than once, e.g. from concurrent tasks, are summed. Outside of a request,
+    e.g. in job workers, it does nothing.
+    """
+
+    __slots__ = ("name", "timings", "started_at")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _timings.get()
+        if self.timings is not None:
+            self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.record(self.name, self.started_at, time.perf_counter() - self.started_at)
+
+
+class TimedRoute(APIRoute):
+    """
+    Route which records the `parse` stage, from the route being matched to its endpoint being called
+    (reading, decoding and validating the body, and resolving dependencies), and the `serialize` stage,
+    from the endpoint returning to the response being rendered.
+    """
+
+    def get_route_handler(self) -> Callable:
+        # the endpoint is wrapped in the dependant only, which is rebuilt from `self.endpoint` when the route is copied
+        self.dependant.call = self._timed_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _timings.get()
+            if timings is None:
+                return await handler(request)
+
+            timings.begin("parse")
+            try:
+                return await handler(request)
+            finally:
+                timings.end("parse")
+                timings.end("serialize")
+
+        return timed_handler
+
+    @staticmethod
+    def _timed_endpoint(endpoint: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                timings = _timings.get()
+                if timings is not None:
+                    timings.end("parse")
+                result = await endpoint(*args, **kwargs)
+                if timings is not None:
+                    timings.begin("serialize")
+                return result
+        else:
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kwargs):
+                timings = _timings.get()
+                if timings is not None:
+                    timings.end("parse")
+                result = endpoint(*args, **kwargs)
+                if timings is not None:
+                    timings.begin("serialize")
+                return result
+        return timed_endpoint
+
+
+class SpanExporter(abc.ABC):
+    """Exports a request, and each of its stages, as trace spans"""
+
+    @abc.abstractmethod
+    def export(self, scope: Scope, timings: Timings, status_code: int, ended_at: float):
+        """Called from the event loop once the response has been sent, so must not block"""
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def trace_context(scope: Scope) -> Tuple[str, Optional[str]]:
+        """Trace id and parent span id from the request's W3C `traceparent` header, or a new trace id"""
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                match = TRACEPARENT.match(value.decode("latin-1"))
+                if match:
+                    return match.group(1), match.group(2)
+        return secrets.token_hex(16), None
+
+    @staticmethod
+    def span_name(scope: Scope) -> str:
+        return f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    return {"stringValue": str(value)}
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends each request's spans to a file, one OTLP/JSON `ExportTraceServiceRequest` per line,
+    as read by the OpenTelemetry Collector's `otlpjsonfile` receiver. Lines are queued and written
+    by a background thread, as many at a time as have been queued, so requests never wait on the file.
+    """
+
+    def __init__(self, path: str, service_name: str):
+        self.path = path
+        self.service_name = service_name
+        self._lines: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+
+    def export(self, scope: Scope, timings: Timings, status_code: int, ended_at: float):
+        trace_id, parent_id = self.trace_context(scope)
+        root_id = secrets.token_hex(8)
+        root = {
+            "traceId": trace_id,
+            "spanId": root_id,
+            "name": self.span_name(scope),
+            "kind": 2,
+            "startTimeUnixNano": str(timings.started_at_ns),
+            "endTimeUnixNano": str(timings.unix_nano(ended_at)),
+            "attributes": [
+                {"key": "http.request.method", "value": otlp_value(scope["method"])},
+                {"key": "url.path", "value": otlp_value(scope["path"])},
+                {"key": "http.response.status_code", "value": otlp_value(status_code)},
+            ],
+            "status": {"code": 2 if status_code >= 500 else 0}
+        }
+        if parent_id is not None:
+            root["parentSpanId"] = parent_id
+
+        spans = [root] + [{
+            "traceId": trace_id,
+            "spanId": secrets.token_hex(8),
+            "parentSpanId": root_id,
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": str(timings.unix_nano(started_at)),
+            "endTimeUnixNano": str(timings.unix_nano(started_at + duration))
+        } for name, started_at, duration in timings.stages]
+
+        self._lines.put(dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": otlp_value(self.service_name)}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}) + b"\n")
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write, name="span-exporter", daemon=True)
+            self._writer.start()
+
+    def _write(self):
+        with open(self.path, "ab") as file:
+            closed = False
+            while not closed:
+                lines = [self._lines.get()]
+                while not self._lines.empty():
+                    lines.append(self._lines.get())
+                # `None` is queued by `close`, after the last line
+                closed = lines[-1] is None
+                file.write(b"".join(o for o in lines if o is not None))
+                file.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._lines.put(None)
+            self._writer.join()
+            self._writer = None
+
+
+class OpenTelemetrySpanExporter(SpanExporter):
+    """
+    Exports spans through the OpenTelemetry SDK to a collector's OTLP/HTTP `endpoint`, in batches
+    from a background thread. Needs the `opentelemetry-sdk` and `opentelemetry-exporter-otlp-proto-http` packages.
+    """
+
+    def __init__(self, endpoint: str, service_name: str):
+        try:
+            from opentelemetry import trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            raise EnvironmentVariableConfigException(
+                "TRACE_EXPORTER=otlp requires the opentelemetry-sdk and "
+                "opentelemetry-exporter-otlp-proto-http packages to be installed"
+            )
+
+        self.trace = trace
+        self.provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        self.provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        self.tracer = self.provider.get_tracer(__name__)
+
+    def export(self, scope: Scope, timings: Timings, status_code: int, ended_at: float):
+        trace = self.trace
+        trace_id, parent_id = self.trace_context(scope)
+        context = None
+        if parent_id is not None:
+            context = trace.set_span_in_context(trace.NonRecordingSpan(trace.SpanContext(
+                trace_id=int(trace_id, 16),
+                span_id=int(parent_id, 16),
+                is_remote=True,
+                trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED)
+            )))
+
+        root = self.tracer.start_span(
+            self.span_name(scope),
+            context=context,
+            kind=trace.SpanKind.SERVER,
+            start_time=timings.started_at_ns,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+                "http.response.status_code": status_code
+            }
+        )
+        if status_code >= 500:
+            root.set_status(trace.Status(trace.StatusCode.ERROR))
+
+        root_context = trace.set_span_in_context(root)
+        for name, started_at, duration in timings.stages:
+            self.tracer.start_span(
+                name,
+                context=root_context,
+                start_time=timings.unix_nano(started_at)
+            ).end(end_time=timings.unix_nano(started_at + duration))
+        root.end(end_time=timings.unix_nano(ended_at))
+
+    def close(self):
+        self.provider.shutdown()
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware which collects the stages of each request, returns them in a `Server-Timing`
+    header (only stages finished by the time the response starts), and passes them to `exporter`
+    once the response has been sent.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True, exporter: Optional[SpanExporter] = None):
+        self.app = app
+        self.server_timing = server_timing
+        self.exporter = exporter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not (self.server_timing or self.exporter is not None):
+            return await self.app(scope, receive, send)
+
+        timings = Timings()
+        token = _timings.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            if self.exporter is not None:
+                try:
+                    self.exporter.export(scope, timings, status_code, time.perf_counter())
+                except Exception:
+                    # never replace the response, or the app's own exception, with a tracing failure
+                    logger.exception("Spans for %s %s could not be exported", scope["method"], scope["path"])
@@ -0,0 +1,59 @@
+import base64
+import struct
+import binascii
+
+from typing import Literal, List, Union, Optional, Dict, Any
+
+from app.exceptions import BadRequestException
+
+
+# `float`: a JSON list of numbers. `base64`: little-endian float32 values, base64 encoded,
+# roughly a quarter of the size. `base64_float16`: the same at half precision, half the size again
+EncodingFormat = Literal["float", "base64", "base64_float16"]
+
+STRUCT_FORMATS = {
+    "base64": "f",
+    "base64_float16": "e"
+}
+
+EncodedVector = Union[List[float], str]
+
+
+def encode_vector(
+    vector: Optional[Union[List[float], Dict[str, Any]]],
+    encoding_format: EncodingFormat = "float"
+) -> Optional[Union[EncodedVector, Dict[str, Any]]]:
+    """Encode a vector, or each of a point's named vectors, in `encoding_format`"""
+    if vector is None or encoding_format == "float":
+        return vector
+    if isinstance(vector, dict):
+        return {name: encode_vector(o, encoding_format) for name, o in vector.items()}
+
+    try:
+        packed = struct.pack(f"<{len(vector)}{STRUCT_FORMATS[encoding_format]}", *vector)
+    except OverflowError:
+        raise BadRequestException(
+            f"Vector values are out of range for '{encoding_format}', use 'base64' or 'float' instead"
+        )
+    return base64.b64encode(packed).decode("ascii")
+
+
+def decode_vector(value: EncodedVector, encoding_format: EncodingFormat = "base64") -> List[float]:
+    """
+    Decode a vector given either as a list of numbers, or as a base64 string packed
+    according to `encoding_format`, which defaults to float32.
+    """
+    if not isinstance(value, str):
+        return [float(o) for o in value]
+
+    struct_format = STRUCT_FORMATS.get(encoding_format, STRUCT_FORMATS["base64"])
+    size = struct.calcsize(struct_format)
+    try:
+        packed = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise BadRequestException("Vector is not valid base64")
+    if len(packed) % size:
+        raise BadRequestException(
+            f"Vector of {len(packed)} bytes is not a whole number of {size} byte values"
+        )
+    return list(struct.unpack(f"<{len(packed) // size}{struct_format}", packed))
@@ -1,14 +1,21 @@
+import math
+
 from fastapi import status, Request
 
 from fastapi.responses import JSONResponse
 
 from app.factory import create_app
 from app.config import settings
+from app.deps.tracing import span_exporter
+from app.lib.timing import TimingMiddleware, stage
 from app.exceptions import (
     NotFoundException,
     UnknownThirdPartyException,
     EmbeddingDimensionalityException,
-    EnvironmentVariableConfigException
+    EnvironmentVariableConfigException,
+    BadRequestException,
+    PayloadTooLargeException,
+    UpstreamUnavailableException
 )
 
 from fastapi.security.utils import get_authorization_scheme_param
@@ -36,6 +43,26 @@ async def embedding_dimensionality_exception(request: Request, exc: EmbeddingDim
     )
 
 
+@app.exception_handler(BadRequestException)
+async def bad_request_exception_handler(request: Request, exc: BadRequestException):
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={
+            "detail": str(exc)
+        }
+    )
+
+
+@app.exception_handler(PayloadTooLargeException)
+async def payload_too_large_exception_handler(request: Request, exc: PayloadTooLargeException):
+    return JSONResponse(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        content={
+            "detail": str(exc)
+        }
+    )
+
+
 @app.exception_handler(NotFoundException)
 async def not_found_exception_handler(request: Request, exc: NotFoundException):
     return JSONResponse(
@@ -46,6 +73,17 @@ async def not_found_exception_handler(request: Request, exc: NotFoundException):
     )
 
 
+@app.exception_handler(UpstreamUnavailableException)
+async def upstream_unavailable_exception_handler(request: Request, exc: UpstreamUnavailableException):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "detail": str(exc)
+        },
+        headers={"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
+    )
+
+
 @app.exception_handler(EnvironmentVariableConfigException)
 async def environment_variable_config_exception_handle(request: Request, exc: EnvironmentVariableConfigException):
     return JSONResponse(
@@ -58,32 +96,37 @@ async def environment_variable_config_exception_handle(request: Request, exc: En
 
 @app.middleware("http")
 async def authentication_middleware(request: Request, call_next):
-    if settings.ADMIN_SECRET_KEY is not None:
-        authorization = request.headers.get('Authorization')
-        scheme, param = get_authorization_scheme_param(authorization)
-        if not authorization:
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Missing basic authorization token"}
-            )
-
-        if scheme.lower() != "basic":
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Authorization header value does not match the expected 'Basic' auth scheme"}
-            )
-
-        api_key = authorization.split(' ')[-1]
-        if api_key != settings.ADMIN_SECRET_KEY:
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Invalid authorization token provided"}
-            )
+    with stage("auth"):
+        if settings.ADMIN_SECRET_KEY is not None:
+            authorization = request.headers.get('Authorization')
+            scheme, param = get_authorization_scheme_param(authorization)
+            if not authorization:
+                return JSONResponse(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    content={"detail": "Missing basic authorization token"}
+                )
+
+            if scheme.lower() != "basic":
+                return JSONResponse(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    content={"detail": "Authorization header value does not match the expected 'Basic' auth scheme"}
+                )
+
+            api_key = authorization.split(' ')[-1]
+            if api_key != settings.ADMIN_SECRET_KEY:
+                return JSONResponse(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    content={"detail": "Invalid authorization token provided"}
+                )
 
     response = await call_next(request)
     return response
 
 
+# added last, so that it wraps authentication too
+app.add_middleware(TimingMiddleware, server_timing=settings.SERVER_TIMING, exporter=span_exporter)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -9,8 +9,19 @@ class Pagination(BaseModel):
     itemsPerPage: Optional[int] = None
     total: int
     page: int
+    next_cursor: Optional[str] = None
+
+
+class BatchResult(BaseModel):
+    index: int
+    count: int
+    success: bool
+    detail: Optional[str] = None
+    # populated for failed batches, so that only those inputs need to be resubmitted
+    ids: Optional[List[str]] = None
 
 
 class InsertionResult(BaseModel, Generic[ItemType]):
     count: int
     items: List[ItemType]
+    batches: List[BatchResult] = []
@@ -4,7 +4,7 @@ from pydantic import Field
 
 from app.lib.cloudflare.models import ModelPreset
 
-from app.lib.cloudflare.api import CloudflareEmbeddingModels
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
 
 from ..models import NamespaceBaseModel
 
@@ -1,27 +1,38 @@
+import asyncio
+
 import CloudFlare
 
 from typing import List, Dict, Any
 
 from .models import NamespaceCreate, NamespaceRead, NamespaceDelete
-from ..models import NamespaceQuery, NamespacePagination, NamespaceBaseModel
+from ..models import NamespaceQuery, NamespaceBatchQuery, NamespacePagination, NamespaceBaseModel
 
-from app.lib.cloudflare.api import API
-from app.embeddings.utils import source_key
-from app.document.models import DocumentRead, DocumentPagination
-from app.lib.cloudflare.api import CloudflareEmbeddingModels, ERROR_CODE_VECTOR_INDEX_NOT_FOUND
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.embeddings.utils import source_key, embedding_vectors
+from app.document.models import DocumentRead, DocumentPagination, DocumentBatch
+from app.lib.cloudflare.constants import ERROR_CODE_VECTOR_INDEX_NOT_FOUND
 
 from app.config import settings
+from app.deps.cloudflare import embedding_batcher
 
 from app.deps.request_params import CommonParams
 from app.exceptions import NotFoundException, UnknownThirdPartyException
+from app.namespace.registry import namespace_registry, cloudflare_namespace, validate_dimensionality, NamespaceInfo, CLOUDFLARE
+from app.lib.vectors import EncodingFormat, encode_vector
+from app.lib.timing import stage
 
 
-def create(client: API, data_in: NamespaceCreate) -> NamespaceRead:
-    res = client.create_vector_index(
+async def create(client: AsyncAPI, data_in: NamespaceCreate) -> NamespaceRead:
+    res = await client.create_vector_index(
         name=data_in.name,
         preset=data_in.preset
     )
     config = res.get('config', {})
+    namespace_registry.set(CLOUDFLARE, data_in.name, NamespaceInfo(
+        exists=True,
+        dimensionality=config.get('dimensions'),
+        distance=config.get("metric").lower()
+    ))
     return NamespaceRead(
         name=res.get('name'),
         dimensionality=config.get('dimensions'),
@@ -29,30 +40,68 @@ def create(client: API, data_in: NamespaceCreate) -> NamespaceRead:
     )
 
 
-def embedding_matches(client: API, namespace: str, data_in: NamespaceQuery):
-    res = client.embed(
-        model=CloudflareEmbeddingModels.BAAIBase.value,
-        texts=[data_in.inputs]
-    )
-    query_vectors = res.get('data', [])
+async def validated_namespace(client: AsyncAPI, namespace: str, data_in: NamespaceQuery):
+    info = await cloudflare_namespace(client, namespace)
+    if not info.exists:
+        raise NotFoundException(
+            f"Vector index with name '{namespace}' not found."
+        )
+    validate_dimensionality(namespace, info, data_in.embedding_model)
+
+
+async def embedding_matches(client: AsyncAPI, namespace: str, data_in: NamespaceQuery):
+    await validated_namespace(client, namespace, data_in)
+
+    # concurrent queries share Workers AI round trips via the batcher
+    with stage("embed"):
+        query_vectors = await embedding_batcher.embed(
+            model=data_in.embedding_model.value,
+            texts=[data_in.inputs]
+        )
     query_vector = query_vectors[0]
-    query_search_result = client.query_vector_index(
-        vector_index_name=namespace,
-        vector=query_vector,
-        return_vectors=data_in.return_vectors,
-        return_metadata=data_in.return_metadata,
-        top_k=data_in.limit,
-        metadata_filter=data_in.filter
-    )
+    with stage("search"):
+        query_search_result = await client.query_vector_index(
+            vector_index_name=namespace,
+            vector=query_vector,
+            return_vectors=data_in.return_vectors,
+            return_metadata=data_in.return_metadata,
+            top_k=data_in.limit,
+            metadata_filter=data_in.filter
+        )
     return query_search_result.get('matches', [])
 
 
-def vectors_by_ids(client: API, namespace: str, ids: List[str]) -> List[Dict[str, Any]]:
-    query_result = client.database_table_records_by_vector_ids(
-        database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
-        table_name=namespace,
-        vector_ids=ids
-    )
+async def embedding_matches_batch(client: AsyncAPI, namespace: str, data_in: NamespaceBatchQuery) -> List[List]:
+    await validated_namespace(client, namespace, data_in)
+
+    # one embedding call for every query, then the index queries run concurrently
+    with stage("embed"):
+        res = await client.embed(
+            model=data_in.embedding_model.value,
+            texts=data_in.inputs
+        )
+    vectors = embedding_vectors(res, len(data_in.inputs), data_in.embedding_model)
+    with stage("search"):
+        query_search_results = await asyncio.gather(*[
+            client.query_vector_index(
+                vector_index_name=namespace,
+                vector=vector,
+                return_vectors=data_in.return_vectors,
+                return_metadata=data_in.return_metadata,
+                top_k=data_in.limit,
+                metadata_filter=data_in.filter
+            ) for vector in vectors
+        ])
+    return [o.get('matches', []) for o in query_search_results]
+
+
+async def vectors_by_ids(client: AsyncAPI, namespace: str, ids: List[str]) -> List[Dict[str, Any]]:
+    with stage("d1"):
+        query_result = await client.database_table_records_by_vector_ids(
+            database_id=settings.CLOUDFLARE_D1_DATABASE_IDENTIFIER,
+            table_name=namespace,
+            vector_ids=ids
+        )
     if not query_result:
         raise NotFoundException(
             f"Cloudflare vectors with ids {ids} not found in the '{namespace}' vectorize index."
@@ -68,27 +117,39 @@ def vectors_by_ids(client: API, namespace: str, ids: List[str]) -> List[Dict[str
     return results
 
 
-def paginated_query_results(matches: List, common: CommonParams) -> DocumentPagination:
+def paginated_batch_query_results(
+    matches: List[List],
+    common: CommonParams,
+    encoding_format: EncodingFormat = "float"
+) -> DocumentBatch:
+    return DocumentBatch.model_construct(
+        count=len(matches),
+        items=[paginated_query_results(o, common, encoding_format) for o in matches]
+    )
+
+
+def paginated_query_results(matches: List, common: CommonParams, encoding_format: EncodingFormat = "float") -> DocumentPagination:
     data = {
         "items": [
-            DocumentRead(
+            DocumentRead.model_construct(
                 id=vector.get('id'),
                 payload=vector.get('metadata'),
                 score=vector.get('score'),
-                vector=vector.get('values'),
-                source=vector.get('metadata').pop(source_key(), None)
+                vector=encode_vector(vector.get('values'), encoding_format),
+                source=(vector.get('metadata') or {}).pop(source_key(), None)
             ) for vector in matches
         ],
         "total": len(matches),
         "page": common.get("page"),
         "itemsPerPage": common.get("limit")
     }
-    return DocumentPagination(**data)
+    # upstream results are trusted, so the models are assembled without validating every vector value
+    return DocumentPagination.model_construct(**data)
 
 
-def vector_indexes(client: API) -> NamespacePagination:
+async def vector_indexes(client: AsyncAPI) -> NamespacePagination:
     try:
-        res = client.list_vector_indexes()
+        res = await client.list_vector_indexes()
         return NamespacePagination(
             items=[
                 NamespaceBaseModel(
@@ -103,9 +164,9 @@ def vector_indexes(client: API) -> NamespacePagination:
         raise UnknownThirdPartyException(str(ex))
 
 
-def vector_index_by_name(client: API, namespace: str, ) -> NamespaceRead:
+async def vector_index_by_name(client: AsyncAPI, namespace: str, ) -> NamespaceRead:
     try:
-        res = client.vector_index_by_name(
+        res = await client.vector_index_by_name(
             namespace
         )
     except CloudFlare.exceptions.CloudFlareAPIError as ex:
@@ -123,9 +184,10 @@ def vector_index_by_name(client: API, namespace: str, ) -> NamespaceRead:
     )
 
 
-def delete_vector_index_by_name(client: API, namespace: str) -> NamespaceDelete:
+async def delete_vector_index_by_name(client: AsyncAPI, namespace: str) -> NamespaceDelete:
+    namespace_registry.invalidate(CLOUDFLARE, namespace)
     try:
-        deletion_res = client.delete_vector_index_by_name(
+        deletion_res = await client.delete_vector_index_by_name(
             name=namespace
         )
         # also need to check whether there's a corresponding table in d1
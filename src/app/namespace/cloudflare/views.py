@@ -7,46 +7,67 @@ from .models import (
     NamespaceDelete,
 )
 
-from ..models import NamespaceQuery, NamespacePagination
+from ..models import NamespaceQuery, NamespaceBatchQuery, NamespacePagination
 
 from app.permissions.auth import PermissionDependency, DefaultPermission
-from app.document.models import DocumentPagination
+from app.document.models import DocumentPagination, DocumentBatch
 from app.deps.request_params import CommonParams
 from app.deps.cloudflare import CloudflareClient
+from app.lib.responses import ModelResponse
+from app.lib.timing import TimedRoute
 
 from .service import (
     create,
     embedding_matches,
+    embedding_matches_batch,
     paginated_query_results,
+    paginated_batch_query_results,
     vector_index_by_name,
     delete_vector_index_by_name,
     vector_indexes
 )
 
 
-router = APIRouter(prefix="/namespace/cloudflare")
+router = APIRouter(prefix="/namespace/cloudflare", route_class=TimedRoute)
 
 
 @router.post("", response_model=NamespaceRead, status_code=status.HTTP_201_CREATED)
 async def create_namespace(data_in: NamespaceCreate, client: CloudflareClient):
     """Create a Cloudflare vector index"""
-    return create(client=client, data_in=data_in)
+    return await create(client=client, data_in=data_in)
 
 
 @router.get("", response_model=NamespacePagination)
 async def get_namespaces(client: CloudflareClient):
     """Retrieve all Cloudflare vector indexes."""
-    return vector_indexes(client=client)
+    return await vector_indexes(client=client)
 
 
 @router.post("/{namespace}/query", response_model=DocumentPagination)
 async def query_namespace(namespace: str, data_in: NamespaceQuery, common: CommonParams, client: CloudflareClient):
     """Run a vector query against a named vector index."""
-    matches = embedding_matches(client=client, namespace=namespace, data_in=data_in)
-    return paginated_query_results(
+    matches = await embedding_matches(client=client, namespace=namespace, data_in=data_in)
+    return ModelResponse(paginated_query_results(
         matches=matches,
-        common=common
-    )
+        common=common,
+        encoding_format=data_in.encoding_format
+    ))
+
+
+@router.post("/{namespace}/query/batch", response_model=DocumentBatch)
+async def query_namespace_batch(
+    namespace: str,
+    data_in: NamespaceBatchQuery,
+    common: CommonParams,
+    client: CloudflareClient
+):
+    """Run several vector queries against a named vector index, with a single embedding call."""
+    matches = await embedding_matches_batch(client=client, namespace=namespace, data_in=data_in)
+    return ModelResponse(paginated_batch_query_results(
+        matches=matches,
+        common=common,
+        encoding_format=data_in.encoding_format
+    ))
 
 
 @router.get(
@@ -56,10 +77,10 @@ async def query_namespace(namespace: str, data_in: NamespaceQuery, common: Commo
 )
 async def get_namespace(namespace: str, client: CloudflareClient):
     """Retrieve a vector index by name."""
-    return vector_index_by_name(client=client, namespace=namespace)
+    return await vector_index_by_name(client=client, namespace=namespace)
 
 
 @router.delete("/{namespace}", response_model=NamespaceDelete)
 async def delete_namespace(namespace: str, client: CloudflareClient):
     """Delete a vector index by name."""
-    return delete_vector_index_by_name(client=client, namespace=namespace)
+    return await delete_vector_index_by_name(client=client, namespace=namespace)
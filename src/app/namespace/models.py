@@ -7,6 +7,8 @@ from qdrant_client.http.models import Distance
 from qdrant_client.http.models import CollectionStatus
 
 from app.models import Pagination
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels, MAX_EMBEDDING_BATCH_SIZE
+from app.lib.vectors import EncodingFormat
 
 
 class NamespaceBaseModel(BaseModel):
@@ -30,10 +32,19 @@ class NamespaceRead(NamespaceBaseModel):
 
 class NamespaceQuery(BaseModel):
     inputs: str
+    embedding_model: Optional[CloudflareEmbeddingModels] = Field(default=CloudflareEmbeddingModels.BAAIBase)
     return_vectors: Optional[bool] = False
+    encoding_format: EncodingFormat = Field(default="float")
     return_metadata: Optional[bool] = False
     limit: Optional[int] = Field(default=5, gt=0)
     filter: Optional[Dict[str, Any]] = Field(default=None)
+    # Qdrant quantized collections only: re-score the top candidates with the original vectors
+    rescore: Optional[bool] = Field(default=None)
+    oversampling: Optional[float] = Field(default=None, ge=1)
+
+
+class NamespaceBatchQuery(NamespaceQuery):
+    inputs: List[str] = Field(min_length=1, max_length=MAX_EMBEDDING_BATCH_SIZE)
 
 
 class NamespacePagination(Pagination):
@@ -0,0 +1,92 @@
+from typing import Optional, Dict, Any, List
+
+from qdrant_client.http.models import Filter, Condition, FieldCondition, IsNullCondition, PayloadField
+from qdrant_client.http.models import MatchValue, MatchAny, Range
+
+from app.exceptions import BadRequestException
+
+
+RANGE_OPERATORS = {
+    "$lt": "lt",
+    "$lte": "lte",
+    "$gt": "gt",
+    "$gte": "gte"
+}
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def match_condition(key: str, value: Any) -> Condition:
+    if value is None:
+        return IsNullCondition(is_null=PayloadField(key=key))
+    if isinstance(value, float):
+        # Qdrant only matches exact keywords, integers and booleans, so floats are matched as a closed range
+        return FieldCondition(key=key, range=Range(gte=value, lte=value))
+    if isinstance(value, (str, int, bool)):
+        return FieldCondition(key=key, match=MatchValue(value=value))
+
+    raise BadRequestException(
+        f"Unsupported filter value for '{key}': {value!r}"
+    )
+
+
+def any_condition(key: str, operator: str, values: Any) -> Condition:
+    if not isinstance(values, list) or not values:
+        raise BadRequestException(
+            f"The '{operator}' filter for '{key}' requires a non-empty list"
+        )
+    if not all(isinstance(o, (str, int)) and not isinstance(o, bool) for o in values):
+        raise BadRequestException(
+            f"The '{operator}' filter for '{key}' only supports strings and integers"
+        )
+    return FieldCondition(key=key, match=MatchAny(any=values))
+
+
+def qdrant_filter(metadata_filter: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    """
+    Translate a Vectorize style metadata filter into a Qdrant Filter, so the same query
+    body filters identically on both backends. Every field condition must hold.
+
+    Supports implicit equality ({"field": value}) and the $eq, $ne, $in, $nin,
+    $lt, $lte, $gt and $gte operators.
+    """
+    if not metadata_filter:
+        return None
+
+    must: List[Condition] = []
+    must_not: List[Condition] = []
+    for key, value in metadata_filter.items():
+        if not isinstance(value, dict):
+            must.append(match_condition(key, value))
+            continue
+
+        bounds = {}
+        for operator, operand in value.items():
+            if operator == "$eq":
+                must.append(match_condition(key, operand))
+            elif operator == "$ne":
+                must_not.append(match_condition(key, operand))
+            elif operator == "$in":
+                must.append(any_condition(key, operator, operand))
+            elif operator == "$nin":
+                must_not.append(any_condition(key, operator, operand))
+            elif operator in RANGE_OPERATORS:
+                if not is_number(operand):
+                    raise BadRequestException(
+                        f"The '{operator}' filter for '{key}' requires a number"
+                    )
+                bounds[RANGE_OPERATORS[operator]] = operand
+            else:
+                raise BadRequestException(
+                    f"Unsupported filter operator '{operator}' for '{key}'"
+                )
+
+        if bounds:
+            must.append(FieldCondition(key=key, range=Range(**bounds)))
+
+    return Filter(
+        must=must or None,
+        must_not=must_not or None
+    )
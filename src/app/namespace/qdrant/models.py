@@ -1,15 +1,64 @@
+from typing import Optional, Literal, List, Dict
+
 from pydantic import BaseModel
 from pydantic import Field
 
 from qdrant_client.http.models import Distance
 from qdrant_client.http.models import CollectionStatus
+from qdrant_client.http.models import CompressionRatio
 
 from ..models import NamespaceBaseModel
 
+QuantizationType = Literal["scalar", "product", "binary"]
+PayloadIndexType = Literal["keyword", "integer", "float", "text"]
+
+
+class NamespaceQuantization(BaseModel):
+    type: QuantizationType = Field(default="scalar")
+    always_ram: Optional[bool] = Field(default=True)
+    # scalar (int8) only: the quantile used to clip outliers when computing the bounds
+    quantile: Optional[float] = Field(default=None, ge=0.5, le=1)
+    # product only
+    compression: Optional[CompressionRatio] = Field(default=CompressionRatio.X16)
+
+
+class NamespaceHnsw(BaseModel):
+    m: Optional[int] = Field(default=None, ge=0)
+    ef_construct: Optional[int] = Field(default=None, ge=4)
+    full_scan_threshold: Optional[int] = Field(default=None, ge=0)
+    on_disk: Optional[bool] = Field(default=None)
+
+
+class NamespaceOptimizers(BaseModel):
+    default_segment_number: Optional[int] = Field(default=None, ge=0)
+    max_segment_size: Optional[int] = Field(default=None, ge=0)
+    memmap_threshold: Optional[int] = Field(default=None, ge=0)
+    indexing_threshold: Optional[int] = Field(default=None, ge=0)
+
+
+class PayloadIndexCreate(BaseModel):
+    field_name: str = Field(min_length=1)
+    field_type: PayloadIndexType = Field(default="keyword")
+
+
+class PayloadIndexRead(PayloadIndexCreate):
+    pass
+
+
+class PayloadIndexDelete(BaseModel):
+    success: bool
+
 
 class NamespaceCreate(NamespaceBaseModel):
     dimensionality: int = Field(default=1024)
     distance: Distance = Field(default=Distance.DOT)
+    quantization: Optional[NamespaceQuantization] = Field(default=None)
+    # keep the original vectors on disk, e.g. when only the quantized vectors are held in RAM
+    on_disk: Optional[bool] = Field(default=None)
+    on_disk_payload: Optional[bool] = Field(default=None)
+    hnsw: Optional[NamespaceHnsw] = Field(default=None)
+    optimizers: Optional[NamespaceOptimizers] = Field(default=None)
+    payload_indexes: List[PayloadIndexCreate] = Field(default=[])
 
 
 class NamespaceDelete(BaseModel):
@@ -25,3 +74,4 @@ class NamespaceRead(NamespaceBaseModel):
     write_consistency_factor: int
     vectors_count: int
     points_count: int
+    payload_indexes: Dict[str, str] = {}
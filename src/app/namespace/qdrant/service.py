@@ -1,24 +1,48 @@
-from fastapi import status
+import asyncio
+import logging
+
+from typing import List, Optional
 
-from app.lib.cloudflare.api import API, CloudflareEmbeddingModels
+from fastapi import status
 
 from qdrant_client.async_qdrant_client import AsyncQdrantClient
 from qdrant_client.http.exceptions import UnexpectedResponse
 
-from qdrant_client.http.models import VectorParams
+from qdrant_client.http.models import VectorParams, SearchRequest, ScoredPoint, SearchParams
+from qdrant_client.http.models import QuantizationConfig, QuantizationSearchParams
+from qdrant_client.http.models import ScalarQuantization, ScalarQuantizationConfig, ScalarType
+from qdrant_client.http.models import ProductQuantization, ProductQuantizationConfig
+from qdrant_client.http.models import BinaryQuantization, BinaryQuantizationConfig
+from qdrant_client.http.models import HnswConfigDiff, OptimizersConfigDiff, PayloadSchemaType
 
-from app.config import settings
 from app.deps.request_params import CommonParams
+from app.deps.cloudflare import cloudflare, embedding_batcher
+from app.embeddings.utils import source_key, embedding_vectors
 
 from app.exceptions import NotFoundException, UnknownThirdPartyException
+from app.exceptions import UpstreamUnavailableException, BadRequestException
+from app.namespace.registry import namespace_registry, qdrant_namespace, validate_dimensionality, NamespaceInfo, QDRANT
 
-from app.document.models import DocumentRead, DocumentPagination
+from app.document.models import DocumentRead, DocumentPagination, DocumentBatch
+from app.lib.vectors import EncodingFormat, encode_vector
+from app.lib.qdrant import observe_batch_size
+from app.lib.timing import stage
 
+from .filters import qdrant_filter
 from .models import NamespaceRead
 from .models import NamespaceCreate
 from .models import NamespaceBaseModel
 from .models import NamespaceDelete
-from ..models import NamespaceQuery, NamespacePagination
+from .models import NamespaceQuantization
+from .models import PayloadIndexCreate, PayloadIndexRead, PayloadIndexDelete
+from ..models import NamespaceQuery, NamespaceBatchQuery, NamespacePagination
+
+
+logger = logging.getLogger(__name__)
+
+# errors which keep their own status codes rather than becoming a 500: a bad request (400),
+# or Qdrant being unavailable according to the retry policy (503)
+PASSED_THROUGH = (UpstreamUnavailableException, BadRequestException)
 
 
 async def namespaces(client: AsyncQdrantClient) -> NamespacePagination:
@@ -54,6 +78,11 @@ async def namespace(name: str, client: AsyncQdrantClient) -> NamespaceRead:
             ex.content.decode('utf-8')
         )
 
+    namespace_registry.set(QDRANT, name, NamespaceInfo(
+        exists=True,
+        dimensionality=result.config.params.vectors.size,
+        distance=str(result.config.params.vectors.distance)
+    ))
     data = {
         "name": name,
         "dimensionality": result.config.params.vectors.size,
@@ -63,27 +92,100 @@ async def namespace(name: str, client: AsyncQdrantClient) -> NamespaceRead:
         "replication_factor": result.config.params.replication_factor,
         "write_consistency_factor": result.config.params.write_consistency_factor,
         "vectors_count": result.vectors_count,
-        "points_count": result.points_count
+        "points_count": result.points_count,
+        "payload_indexes": {
+            k: str(v.data_type.value) for k, v in (result.payload_schema or {}).items()
+        }
     }
     return NamespaceRead(
         **data
     )
 
 
+def quantization_config(quantization: Optional[NamespaceQuantization]) -> Optional[QuantizationConfig]:
+    if quantization is None:
+        return None
+
+    if quantization.type == "product":
+        return ProductQuantization(
+            product=ProductQuantizationConfig(
+                compression=quantization.compression,
+                always_ram=quantization.always_ram
+            )
+        )
+    if quantization.type == "binary":
+        return BinaryQuantization(
+            binary=BinaryQuantizationConfig(
+                always_ram=quantization.always_ram
+            )
+        )
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=quantization.quantile,
+            always_ram=quantization.always_ram
+        )
+    )
+
+
+def search_params(data_in: NamespaceQuery) -> Optional[SearchParams]:
+    if data_in.rescore is None and data_in.oversampling is None:
+        return None
+
+    return SearchParams(
+        quantization=QuantizationSearchParams(
+            rescore=data_in.rescore,
+            oversampling=data_in.oversampling
+        )
+    )
+
+
 async def create(data_in: NamespaceCreate, client: AsyncQdrantClient) -> NamespaceRead:
+    namespace_registry.invalidate(QDRANT, data_in.name)
     try:
-        result = await client.create_collection(
+        await client.create_collection(
             collection_name=data_in.name,
-            vectors_config=VectorParams(size=data_in.dimensionality, distance=data_in.distance),
+            vectors_config=VectorParams(
+                size=data_in.dimensionality,
+                distance=data_in.distance,
+                on_disk=data_in.on_disk
+            ),
+            quantization_config=quantization_config(data_in.quantization),
+            on_disk_payload=data_in.on_disk_payload,
+            hnsw_config=HnswConfigDiff(**data_in.hnsw.model_dump()) if data_in.hnsw else None,
+            optimizers_config=OptimizersConfigDiff(**data_in.optimizers.model_dump()) if data_in.optimizers else None
         )
+        results = await asyncio.gather(*[
+            client.create_payload_index(
+                collection_name=data_in.name,
+                field_name=o.field_name,
+                field_schema=PayloadSchemaType(o.field_type)
+            ) for o in data_in.payload_indexes
+        ], return_exceptions=True)
+        errors = [o for o in results if isinstance(o, BaseException)]
+        if errors:
+            # don't leave the collection behind without the indexes it was requested with
+            await delete_incomplete_collection(data_in.name, client)
+            raise errors[0]
         return await namespace(name=data_in.name, client=client)
+    except PASSED_THROUGH:
+        raise
     except Exception as ex:
         raise UnknownThirdPartyException(
             str(ex)
         )
 
 
+async def delete_incomplete_collection(name: str, client: AsyncQdrantClient):
+    try:
+        await client.delete_collection(collection_name=name)
+    except Exception:
+        logger.exception("Collection %s could not be deleted after failing to create its payload indexes", name)
+    namespace_registry.invalidate(QDRANT, name)
+
+
 async def delete(name: str, client: AsyncQdrantClient) -> NamespaceDelete:
+    namespace_registry.invalidate(QDRANT, name)
     try:
         deletion_res = await client.delete_collection(
             collection_name=name
@@ -103,33 +205,147 @@ async def delete(name: str, client: AsyncQdrantClient) -> NamespaceDelete:
     )
 
 
-async def query(namespace: str, data_in: NamespaceQuery, common: CommonParams):
-    client = API(
-        api_token=settings.CLOUDFLARE_API_TOKEN,
-        account_id=settings.CLOUDFLARE_API_ACCOUNT_ID
-    )
-    res = client.embed(
-        model=CloudflareEmbeddingModels.BAAIBase.value,
-        texts=[data_in.inputs]
-    )
-    query_vectors = res.get('data', [])
-    query_vector = query_vectors[0]
+async def validated_namespace(client: AsyncQdrantClient, namespace: str, data_in: NamespaceQuery):
+    info = await qdrant_namespace(client, namespace)
+    if not info.exists:
+        raise NotFoundException(
+            f"Collection with name {namespace} does not exist"
+        )
+    validate_dimensionality(namespace, info, data_in.embedding_model)
 
-    client = AsyncQdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_HTTP_PORT)
-    query_search_result = await client.search(
-        collection_name=namespace,
-        query_vector=query_vector,
-        offset=common.get("offset"),
-        limit=common.get("limit")
-    )
+
+def paginated_query_results(
+    points: List[ScoredPoint],
+    common: CommonParams,
+    encoding_format: EncodingFormat = "float"
+) -> DocumentPagination:
+    key = source_key()
     data = {
-        "items": [DocumentRead(
-            id=o.id,
-            payload=o.payload,
+        "items": [DocumentRead.model_construct(
+            id=str(o.id),
+            payload={k: v for k, v in o.payload.items() if k != key} if o.payload is not None else None,
             score=o.score,
-            vector=o.vector
-        ) for o in query_search_result],
-        "total": len(query_search_result),
+            vector=encode_vector(o.vector, encoding_format),
+            source=o.payload.get(key) if o.payload else None
+        ) for o in points],
+        "total": len(points),
         "page": common.get("page"),
     }
-    return DocumentPagination(**data)
+    # upstream results are trusted, so the models are assembled without validating every vector value
+    return DocumentPagination.model_construct(**data)
+
+
+async def query(namespace: str, data_in: NamespaceQuery, common: CommonParams, client: AsyncQdrantClient):
+    await validated_namespace(client, namespace, data_in)
+    # translated up front, so that an invalid filter fails before the embedding call
+    query_filter = qdrant_filter(data_in.filter)
+
+    with stage("embed"):
+        query_vectors = await embedding_batcher.embed(
+            model=data_in.embedding_model.value,
+            texts=[data_in.inputs]
+        )
+    query_vector = query_vectors[0]
+
+    with stage("search"):
+        query_search_result = await client.search(
+            collection_name=namespace,
+            query_vector=query_vector,
+            offset=common.get("offset"),
+            limit=common.get("limit"),
+            with_vectors=data_in.return_vectors,
+            search_params=search_params(data_in),
+            query_filter=query_filter
+        )
+    return paginated_query_results(query_search_result, common, data_in.encoding_format)
+
+
+async def query_batch(
+    namespace: str,
+    data_in: NamespaceBatchQuery,
+    common: CommonParams,
+    client: AsyncQdrantClient
+) -> DocumentBatch:
+    await validated_namespace(client, namespace, data_in)
+    query_filter = qdrant_filter(data_in.filter)
+
+    # a single embedding call and a single search round trip for every query
+    with stage("embed"):
+        res = await cloudflare.embed(
+            model=data_in.embedding_model.value,
+            texts=data_in.inputs
+        )
+    vectors = embedding_vectors(res, len(data_in.inputs), data_in.embedding_model)
+    observe_batch_size("search_batch", len(data_in.inputs))
+    try:
+        with stage("search"):
+            search_results = await client.search_batch(
+                collection_name=namespace,
+                requests=[SearchRequest(
+                    vector=vector,
+                    offset=common.get("offset"),
+                    limit=common.get("limit"),
+                    with_payload=True,
+                    with_vector=data_in.return_vectors,
+                    params=search_params(data_in),
+                    filter=query_filter
+                ) for vector in vectors]
+            )
+    except UnexpectedResponse as ex:
+        if ex.status_code == status.HTTP_404_NOT_FOUND:
+            raise NotFoundException(
+                f"Collection with name {namespace} not found"
+            )
+
+        raise UnknownThirdPartyException(
+            ex.content.decode('utf-8')
+        )
+    items = [paginated_query_results(o, common, data_in.encoding_format) for o in search_results]
+    return DocumentBatch.model_construct(
+        count=len(items),
+        items=items
+    )
+
+
+async def create_payload_index(namespace: str, data_in: PayloadIndexCreate, client: AsyncQdrantClient) -> PayloadIndexRead:
+    try:
+        await client.create_payload_index(
+            collection_name=namespace,
+            field_name=data_in.field_name,
+            field_schema=PayloadSchemaType(data_in.field_type)
+        )
+    except UnexpectedResponse as ex:
+        if ex.status_code == status.HTTP_404_NOT_FOUND:
+            raise NotFoundException(
+                f"Collection with name {namespace} not found"
+            )
+
+        raise UnknownThirdPartyException(
+            ex.content.decode('utf-8')
+        )
+
+    return PayloadIndexRead(
+        field_name=data_in.field_name,
+        field_type=data_in.field_type
+    )
+
+
+async def delete_payload_index(namespace: str, field_name: str, client: AsyncQdrantClient) -> PayloadIndexDelete:
+    try:
+        await client.delete_payload_index(
+            collection_name=namespace,
+            field_name=field_name
+        )
+    except UnexpectedResponse as ex:
+        if ex.status_code == status.HTTP_404_NOT_FOUND:
+            raise NotFoundException(
+                f"Collection with name {namespace} not found"
+            )
+
+        raise UnknownThirdPartyException(
+            ex.content.decode('utf-8')
+        )
+
+    return PayloadIndexDelete(
+        success=True
+    )
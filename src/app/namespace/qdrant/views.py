@@ -5,22 +5,28 @@ from fastapi import status
 from .models import NamespaceCreate
 from .models import NamespaceRead
 from .models import NamespaceDelete
-from ..models import NamespaceQuery, NamespacePagination
+from .models import PayloadIndexCreate, PayloadIndexRead, PayloadIndexDelete
+from ..models import NamespaceQuery, NamespaceBatchQuery, NamespacePagination
 
-from app.document.models import DocumentPagination
+from app.document.models import DocumentPagination, DocumentBatch
 
 from app.deps.request_params import CommonParams
 from app.deps.qdrant import QdrantClient
 from app.permissions.auth import PermissionDependency
+from app.lib.responses import ModelResponse
+from app.lib.timing import TimedRoute
 
 from .service import namespace as get
 from .service import namespaces as get_all
 from .service import create
 from .service import delete
 from .service import query
+from .service import query_batch
+from .service import create_payload_index
+from .service import delete_payload_index
 
 
-router = APIRouter(prefix="/namespace/qdrant")
+router = APIRouter(prefix="/namespace/qdrant", route_class=TimedRoute)
 
 
 @router.post("", response_model=NamespaceRead, status_code=status.HTTP_201_CREATED)
@@ -29,13 +35,30 @@ async def create_namespace(data_in: NamespaceCreate, client: QdrantClient):
 
 
 @router.post("/{namespace}/query", response_model=DocumentPagination)
-async def query_namespace(namespace: str, data_in: NamespaceQuery, common: CommonParams, ):
+async def query_namespace(namespace: str, data_in: NamespaceQuery, common: CommonParams, client: QdrantClient):
     """Run a vector query against a named collection."""
-    return await query(
+    return ModelResponse(await query(
         namespace=namespace,
         data_in=data_in,
-        common=common
-    )
+        common=common,
+        client=client
+    ))
+
+
+@router.post("/{namespace}/query/batch", response_model=DocumentBatch)
+async def query_namespace_batch(
+    namespace: str,
+    data_in: NamespaceBatchQuery,
+    common: CommonParams,
+    client: QdrantClient
+):
+    """Run several vector queries against a named collection, with a single embedding call and search request."""
+    return ModelResponse(await query_batch(
+        namespace=namespace,
+        data_in=data_in,
+        common=common,
+        client=client
+    ))
 
 
 @router.get("/{namespace}", response_model=NamespaceRead, dependencies=[Depends(PermissionDependency([]))])
@@ -54,3 +77,15 @@ async def get_namespaces(client: QdrantClient):
 async def delete_namespace(namespace: str, client: QdrantClient):
     """Delete a collection by name."""
     return await delete(namespace, client=client)
+
+
+@router.post("/{namespace}/index", response_model=PayloadIndexRead, status_code=status.HTTP_201_CREATED)
+async def create_namespace_payload_index(namespace: str, data_in: PayloadIndexCreate, client: QdrantClient):
+    """Index a payload field of a collection, to speed up filtered queries on it."""
+    return await create_payload_index(namespace=namespace, data_in=data_in, client=client)
+
+
+@router.delete("/{namespace}/index/{field_name}", response_model=PayloadIndexDelete)
+async def delete_namespace_payload_index(namespace: str, field_name: str, client: QdrantClient):
+    """Drop the index of a collection's payload field."""
+    return await delete_payload_index(namespace=namespace, field_name=field_name, client=client)
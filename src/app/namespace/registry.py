@@ -0,0 +1,137 @@
+import time
+
+import CloudFlare
+
+from typing import Optional, Dict, Tuple
+
+from fastapi import status
+from pydantic import BaseModel
+
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+from app.config import settings
+from app.exceptions import UnknownThirdPartyException, EmbeddingDimensionalityException
+from app.lib.cloudflare.constants import ERROR_CODE_VECTOR_INDEX_NOT_FOUND, DIMENSIONALITY_PRESETS, CloudflareEmbeddingModels
+from app.lib.cloudflare.async_api import AsyncAPI
+
+
+QDRANT = "qdrant"
+CLOUDFLARE = "cloudflare"
+
+
+class NamespaceInfo(BaseModel):
+    exists: bool
+    dimensionality: Optional[int] = None
+    distance: Optional[str] = None
+
+
+class NamespaceRegistry:
+    """
+    Per-process cache of namespace existence and vector configuration for both backends.
+
+    Entries expire after `ttl` seconds, to pick up changes made outside of this API,
+    and are invalidated explicitly whenever a namespace is created or deleted through it.
+    Missing namespaces are only remembered for `miss_ttl` seconds, as they may be created by
+    another process at any time.
+    """
+
+    def __init__(self, ttl: float = 300, miss_ttl: float = 5):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._entries: Dict[Tuple[str, str], Tuple[float, NamespaceInfo]] = {}
+
+    def get(self, backend: str, name: str) -> Optional[NamespaceInfo]:
+        entry = self._entries.get((backend, name))
+        if entry is None:
+            return None
+
+        expires_at, info = entry
+        if expires_at < time.monotonic():
+            del self._entries[(backend, name)]
+            return None
+        return info
+
+    def set(self, backend: str, name: str, info: NamespaceInfo):
+        ttl = self.ttl if info.exists else self.miss_ttl
+        if ttl > 0:
+            self._entries[(backend, name)] = (time.monotonic() + ttl, info)
+        else:
+            self._entries.pop((backend, name), None)
+
+    def invalidate(self, backend: str, name: str):
+        self._entries.pop((backend, name), None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+namespace_registry = NamespaceRegistry(
+    ttl=settings.NAMESPACE_CACHE_TTL,
+    miss_ttl=settings.NAMESPACE_MISS_CACHE_TTL
+)
+
+
+async def qdrant_namespace(client: AsyncQdrantClient, name: str) -> NamespaceInfo:
+    info = namespace_registry.get(QDRANT, name)
+    if info is not None:
+        return info
+
+    try:
+        result = await client.get_collection(
+            collection_name=name
+        )
+    except UnexpectedResponse as ex:
+        if ex.status_code != status.HTTP_404_NOT_FOUND:
+            raise UnknownThirdPartyException(
+                ex.content.decode('utf-8')
+            )
+        info = NamespaceInfo(exists=False)
+    else:
+        info = NamespaceInfo(
+            exists=True,
+            dimensionality=result.config.params.vectors.size,
+            distance=str(result.config.params.vectors.distance)
+        )
+
+    namespace_registry.set(QDRANT, name, info)
+    return info
+
+
+async def cloudflare_namespace(client: AsyncAPI, name: str) -> NamespaceInfo:
+    info = namespace_registry.get(CLOUDFLARE, name)
+    if info is not None:
+        return info
+
+    try:
+        res = await client.vector_index_by_name(
+            name=name
+        )
+    except CloudFlare.exceptions.CloudFlareAPIError as ex:
+        if int(ex) != ERROR_CODE_VECTOR_INDEX_NOT_FOUND:
+            raise UnknownThirdPartyException(str(ex))
+        info = NamespaceInfo(exists=False)
+    else:
+        config = res.get('config', {})
+        info = NamespaceInfo(
+            exists=True,
+            dimensionality=config.get('dimensions'),
+            distance=config.get('metric', '').lower()
+        )
+
+    namespace_registry.set(CLOUDFLARE, name, info)
+    return info
+
+
+def validate_dimensionality(namespace: str, info: NamespaceInfo, model: CloudflareEmbeddingModels):
+    """Reject a model/namespace dimensionality mismatch before any embedding call is paid for"""
+    if info.dimensionality is None or info.dimensionality == model.dimensionality:
+        return
+
+    compatible_model_names = ','.join([str(o) for o in DIMENSIONALITY_PRESETS.get(info.dimensionality, [])])
+    raise EmbeddingDimensionalityException(
+        f"The embedding model's dimensionality: {model.dimensionality} "
+        f"({model}) is not compatible with the "
+        f"dimensionality of the namespace '{namespace}', dimensionality: {info.dimensionality}. "
+        f"Please provide one of the following compatible models: {compatible_model_names}",
+    )
@@ -0,0 +1,114 @@
+"""
+Per-request CPU of building and serializing vector-heavy responses, comparing the validated path
+(pydantic models validated on construction, then re-validated and serialized by FastAPI against the
+route's `response_model`) with the trusted path the listing and query routes now take
+(`model_construct` and `ModelResponse`).
+
+Run from `src/`: python -m benchmarks.serialization [--items 100] [--dimensions 1024] [--rounds 20]
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+
+# settings are required at import time, but nothing here calls an upstream
+for key in ("CLOUDFLARE_API_ACCOUNT_ID", "CLOUDFLARE_API_TOKEN", "CLOUDFLARE_D1_DATABASE_IDENTIFIER", "QDRANT_HOST"):
+    os.environ.setdefault(key, "benchmark")
+os.environ.setdefault("QDRANT_HTTP_PORT", "6333")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from app.deps.request_params import common_params  # noqa: E402
+from app.document.models import DocumentRead, DocumentPagination  # noqa: E402
+from app.embeddings.models import EmbeddingRead, EmbeddingPagination  # noqa: E402
+from app.lib.responses import ModelResponse  # noqa: E402
+from app.lib.serialization import orjson  # noqa: E402
+from app.namespace.cloudflare.service import paginated_query_results  # noqa: E402
+
+
+def upstream_results(items: int, dimensions: int):
+    """Vectorize query matches, as parsed from the upstream response"""
+    return [{
+        "id": str(i),
+        "score": random.random(),
+        "values": [random.random() for _ in range(dimensions)],
+        "metadata": {"category": "benchmark", "index": i}
+    } for i in range(items)]
+
+
+def validated_response(model_type, model) -> bytes:
+    """What FastAPI does with a model returned from a route declaring `response_model`"""
+    field = create_response_field(name="response", type_=model_type)
+    content = asyncio.run(serialize_response(field=field, response_content=model, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def listing_validated(results, common) -> bytes:
+    return validated_response(EmbeddingPagination, EmbeddingPagination(
+        items=[EmbeddingRead(id=o["id"], vector=o["values"], payload=dict(o["metadata"])) for o in results],
+        total=len(results),
+        page=common.get("page")
+    ))
+
+
+def listing_trusted(results, common) -> bytes:
+    return ModelResponse(EmbeddingPagination.model_construct(
+        items=[EmbeddingRead.model_construct(
+            id=o["id"], vector=o["values"], payload=dict(o["metadata"]), source=None
+        ) for o in results],
+        total=len(results),
+        page=common.get("page")
+    )).body
+
+
+def query_validated(results, common) -> bytes:
+    return validated_response(DocumentPagination, DocumentPagination(
+        items=[DocumentRead(
+            id=o["id"], payload=dict(o["metadata"]), score=o["score"], vector=o["values"], source=None
+        ) for o in results],
+        total=len(results),
+        page=common.get("page"),
+        itemsPerPage=common.get("limit")
+    ))
+
+
+def query_trusted(results, common) -> bytes:
+    matches = [{**o, "metadata": dict(o["metadata"])} for o in results]
+    return ModelResponse(paginated_query_results(matches, common)).body
+
+
+def cpu_ms(fn, rounds: int, *args) -> float:
+    fn(*args)
+    started = time.process_time()
+    for _ in range(rounds):
+        fn(*args)
+    return (time.process_time() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    results = upstream_results(args.items, args.dimensions)
+    common = common_params(page=1, limit=args.items, cursor=None)
+    print(f"{args.items} items x {args.dimensions} dimensions, "
+          f"serialized with {'orjson' if orjson is not None else 'pydantic'}, CPU ms per request")
+    print(f"{'endpoint':<10}{'validated':>12}{'trusted':>12}{'speedup':>10}")
+    for name, validated, trusted in (
+        ("listing", listing_validated, listing_trusted),
+        ("query", query_validated, query_trusted)
+    ):
+        assert len(validated(results, common)) > 0 and len(trusted(results, common)) > 0
+        before = cpu_ms(validated, args.rounds, results, common)
+        after = cpu_ms(trusted, args.rounds, results, common)
+        print(f"{name:<10}{before:>12.1f}{after:>12.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import pytest
+
+from app.lib.cloudflare.async_api import AsyncAPI, WORKERS_AI, VECTORIZE, retry_policy
+
+
+class StubAPI(AsyncAPI):
+    """Fails each request with the next of `errors` (succeeding where it's `None`), then succeeds"""
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(api_token="token", account_id="account", retry_policies={
+            upstream: retry_policy(upstream, **kwargs) for upstream in (WORKERS_AI, VECTORIZE)
+        })
+        self.errors = list(errors)
+        self.attempts = 0
+
+    async def _request(self, method, path, data=None, ndjson=None):
+        self.attempts += 1
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        return {"shape": [1, 1], "data": [[0.5]]}
+
+
+@pytest.fixture
+def stub_api():
+    return StubAPI
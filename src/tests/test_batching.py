@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from app.lib.cloudflare.batching import EmbeddingBatcher
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+
+
+MODEL_NAME = str(CloudflareEmbeddingModels.BAAIBase)
+
+
+class StubClient:
+
+    def __init__(self, fail: bool = False):
+        self.requests = []
+        self.fail = fail
+
+    async def embed(self, model, texts):
+        self.requests.append(list(texts))
+        if self.fail:
+            raise RuntimeError("upstream unavailable")
+        return {
+            "shape": [len(texts), 1],
+            "data": [[float(len(o))] for o in texts]
+        }
+
+
+class TestEmbeddingBatcher:
+
+    @pytest.mark.asyncio
+    async def test_coalesces_concurrent_callers(self):
+        client = StubClient()
+        batcher = EmbeddingBatcher(client=client, max_batch_size=10, max_wait=0.01)
+        results = await asyncio.gather(*[
+            batcher.embed(model=MODEL_NAME, texts=["a" * i]) for i in range(1, 5)
+        ])
+
+        assert client.requests == [["a", "aa", "aaa", "aaaa"]]
+        assert results == [[[1.0]], [[2.0]], [[3.0]], [[4.0]]]
+        assert batcher.batch_sizes.count == 1
+        assert batcher.wait_times.count == 4
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_max_batch_size(self):
+        client = StubClient()
+        batcher = EmbeddingBatcher(client=client, max_batch_size=2, max_wait=10)
+        results = await asyncio.gather(*[
+            batcher.embed(model=MODEL_NAME, texts=[text]) for text in ["a", "bb", "ccc", "dddd"]
+        ])
+
+        assert client.requests == [["a", "bb"], ["ccc", "dddd"]]
+        assert results == [[[1.0]], [[2.0]], [[3.0]], [[4.0]]]
+
+    @pytest.mark.asyncio
+    async def test_propagates_upstream_errors(self):
+        batcher = EmbeddingBatcher(client=StubClient(fail=True), max_wait=0.001)
+        with pytest.raises(RuntimeError):
+            await batcher.embed(model=MODEL_NAME, texts=["a"])
@@ -0,0 +1,89 @@
+import pytest
+
+from app.lib.cloudflare.cache import EmbeddingCache
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.exceptions import UnknownThirdPartyException
+
+
+MODEL_NAME = str(CloudflareEmbeddingModels.BAAISmall)
+
+
+class StubAPI(AsyncAPI):
+
+    def __init__(self, cache: EmbeddingCache, dropped: int = 0):
+        super().__init__(api_token="token", account_id="account", cache=cache)
+        self.requests = []
+        self.dropped = dropped
+
+    async def _embed(self, model, texts):
+        self.requests.append(list(texts))
+        texts = texts[:len(texts) - self.dropped]
+        return {
+            "shape": [len(texts), 2],
+            "data": [[float(len(o)), 0.5] for o in texts]
+        }
+
+
+class TestEmbeddingCache:
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        cache = EmbeddingCache(max_size=2)
+        await cache.set_many(MODEL_NAME, ["a", "b"], [[1.0], [2.0]])
+        await cache.get_many(MODEL_NAME, ["a"])
+        await cache.set_many(MODEL_NAME, ["c"], [[3.0]])
+        assert await cache.get_many(MODEL_NAME, ["a", "b", "c"]) == [[1.0], None, [3.0]]
+
+    @pytest.mark.asyncio
+    async def test_normalized_key(self):
+        cache = EmbeddingCache(max_size=10)
+        await cache.set_many(MODEL_NAME, ["sample  text "], [[1.0]])
+        assert await cache.get_many(MODEL_NAME, ["sample text"]) == [[1.0]]
+        assert await cache.get_many(str(CloudflareEmbeddingModels.BAAIBase), ["sample text"]) == [None]
+
+    @pytest.mark.asyncio
+    async def test_persistent_tier(self, tmp_path):
+        path = str(tmp_path / "embeddings.db")
+        await EmbeddingCache(max_size=10, path=path).set_many(MODEL_NAME, ["a"], [[0.25, 0.5]])
+
+        cache = EmbeddingCache(max_size=10, path=path)
+        assert await cache.get_many(MODEL_NAME, ["a"]) == [[0.25, 0.5]]
+        assert cache.stats().get("hits") == 1
+
+
+class TestCachedEmbed:
+
+    @pytest.mark.asyncio
+    async def test_only_misses_sent_upstream(self):
+        client = StubAPI(cache=EmbeddingCache(max_size=10))
+        await client.embed(model=MODEL_NAME, texts=["a", "bb"])
+        result = await client.embed(model=MODEL_NAME, texts=["bb", "ccc", "a", "ccc"])
+
+        assert client.requests == [["a", "bb"], ["ccc"]]
+        assert result.get("data") == [[2.0, 0.5], [3.0, 0.5], [1.0, 0.5], [3.0, 0.5]]
+        assert client.cache.stats().get("hits") == 2
+        assert client.cache.stats().get("misses") == 4
+
+    @pytest.mark.asyncio
+    async def test_disabled(self):
+        client = StubAPI(cache=EmbeddingCache(max_size=0))
+        await client.embed(model=MODEL_NAME, texts=["a"])
+        await client.embed(model=MODEL_NAME, texts=["a"])
+        assert client.requests == [["a"], ["a"]]
+
+    @pytest.mark.asyncio
+    async def test_missing_embeddings(self):
+        client = StubAPI(cache=EmbeddingCache(max_size=10), dropped=1)
+        with pytest.raises(UnknownThirdPartyException):
+            await client.embed(model=MODEL_NAME, texts=["a", "bb"])
+        assert await client.cache.get_many(MODEL_NAME, ["a"]) == [None]
+
+    @pytest.mark.asyncio
+    async def test_persistent(self, tmp_path):
+        client = StubAPI(cache=EmbeddingCache(max_size=0, path=str(tmp_path / "embeddings.db")))
+        await client.embed(model=MODEL_NAME, texts=["a", "bb"])
+        result = await client.embed(model=MODEL_NAME, texts=["bb", "a"])
+
+        assert client.requests == [["a", "bb"]]
+        assert result.get("data") == [[2.0, 0.5], [1.0, 0.5]]
@@ -0,0 +1,48 @@
+import pytest
+
+from app.lib.cloudflare.async_api import AsyncAPI, D1_MAX_BOUND_PARAMETERS
+from app.lib.cloudflare.models import CreateDatabaseRecord
+
+
+class StubAPI(AsyncAPI):
+
+    def __init__(self):
+        super().__init__(api_token="token", account_id="account")
+        self.requests = []
+
+    async def _request(self, method, path, data=None, ndjson=None):
+        self.requests.append(data)
+        statements = data.get("batch", [data])
+        return [{
+            "success": True,
+            "results": [{"vector_id": o, "source": f"source {o}"} for o in o.get("params", [])]
+            if o["sql"].lstrip().startswith("SELECT") else []
+        } for o in statements]
+
+
+class TestDatabaseRecords:
+
+    @pytest.mark.asyncio
+    async def test_upsert_is_chunked_and_batched(self):
+        client = StubAPI()
+        records = [CreateDatabaseRecord(source=f"it's {i}", vector_id=str(i)) for i in range(120)]
+        await client.upsert_database_table_records("db", "namespace", records)
+        await client.upsert_database_table_records("db", "namespace", records[:1])
+
+        create, first, second = client.requests
+        assert [o["sql"].split()[0] for o in create["batch"]] == ["CREATE", "CREATE"]
+        assert [len(o["params"]) for o in first["batch"]] == [100, 100, 40]
+        assert all(len(o["params"]) <= D1_MAX_BOUND_PARAMETERS for o in first["batch"])
+        assert first["batch"][0]["params"][:2] == ["it's 0", "0"]
+        assert "it's" not in first["batch"][0]["sql"]
+        assert len(second["batch"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_lookup_is_parameterized(self):
+        client = StubAPI()
+        vector_ids = [str(i) for i in range(150)] + ["'); DROP TABLE namespace; --"]
+        result = await client.database_table_records_by_vector_ids("db", "namespace", vector_ids)
+
+        assert len(client.requests) == 1
+        assert [len(o["params"]) for o in client.requests[0]["batch"]] == [100, 51]
+        assert [o["vector_id"] for o in result[0]["results"]] == vector_ids
@@ -5,7 +5,7 @@ from typing import Dict, Any, List
 from fastapi import status
 from fastapi.testclient import TestClient
 
-from app.lib.cloudflare.api import CloudflareEmbeddingModels
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
 
 from app.main import app
 
@@ -0,0 +1,49 @@
+import pytest
+
+from qdrant_client.http.models import Filter, FieldCondition, IsNullCondition, PayloadField
+from qdrant_client.http.models import MatchValue, MatchAny, Range
+
+from app.exceptions import BadRequestException
+from app.namespace.qdrant.filters import qdrant_filter
+
+
+class TestQdrantFilter:
+
+    def test_empty(self):
+        assert qdrant_filter(None) is None
+        assert qdrant_filter({}) is None
+
+    def test_equality(self):
+        assert qdrant_filter({"tenant": "acme", "version": 2, "draft": None}) == Filter(
+            must=[
+                FieldCondition(key="tenant", match=MatchValue(value="acme")),
+                FieldCondition(key="version", match=MatchValue(value=2)),
+                IsNullCondition(is_null=PayloadField(key="draft"))
+            ]
+        )
+
+    def test_operators(self):
+        result = qdrant_filter({
+            "tenant": {"$in": ["acme", "globex"]},
+            "status": {"$ne": "deleted"},
+            "score": {"$gte": 0.5, "$lt": 1}
+        })
+        assert result == Filter(
+            must=[
+                FieldCondition(key="tenant", match=MatchAny(any=["acme", "globex"])),
+                FieldCondition(key="score", range=Range(gte=0.5, lt=1))
+            ],
+            must_not=[
+                FieldCondition(key="status", match=MatchValue(value="deleted"))
+            ]
+        )
+
+    @pytest.mark.parametrize("metadata_filter", [
+        {"tenant": {"$regex": "a.*"}},
+        {"tenant": {"$in": []}},
+        {"score": {"$gt": "high"}},
+        {"tags": ["a", "b"]}
+    ])
+    def test_invalid(self, metadata_filter):
+        with pytest.raises(BadRequestException):
+            qdrant_filter(metadata_filter)
@@ -0,0 +1,182 @@
+import json
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from app.models import InsertionResult, BatchResult
+from app.embeddings.models import EmbeddingRead
+from app.exceptions import NotFoundException
+from app.jobs.queue import JobQueue
+from app.jobs.workers import JobWorkers
+
+
+@pytest_asyncio.fixture
+async def queue(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.db"))
+    yield queue
+    await queue.close()
+
+
+async def wait_for_status(queue: JobQueue, job_id: str, status: str):
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job.status == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {(await queue.get(job_id)).status}")
+
+
+class TestJobQueue:
+
+    @pytest.mark.asyncio
+    async def test_claims_in_order(self, queue):
+        first = await queue.enqueue(backend="qdrant", namespace="a", payload="{}", total=1)
+        second = await queue.enqueue(backend="qdrant", namespace="b", payload="{}", total=1)
+
+        claimed = await queue.claim("worker", lease=60)
+        assert claimed.id == first.id
+        assert claimed.status == "running"
+        assert claimed.attempts == 1
+        assert (await queue.claim("worker", lease=60)).id == second.id
+        assert await queue.claim("worker", lease=60) is None
+
+    @pytest.mark.asyncio
+    async def test_retry_delay(self, queue):
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload="{}", total=1)
+        await queue.claim("worker", lease=60)
+        await queue.retry(job.id, "worker", error="upstream unavailable", delay=60)
+
+        assert await queue.claim("worker", lease=60) is None
+        assert (await queue.get(job.id)).error == "upstream unavailable"
+
+    @pytest.mark.asyncio
+    async def test_durable_and_leased(self, queue, tmp_path):
+        job = await queue.enqueue(backend="cloudflare", namespace="a", payload='{"inputs": []}', total=3)
+        await queue.claim("first", lease=60)
+        await queue.close()
+
+        # another process sharing the queue leaves the job to the worker holding its lease
+        reopened = JobQueue(path=str(tmp_path / "jobs.db"))
+        assert await reopened.claim("second", lease=60) is None
+        assert await reopened.heartbeat(job.id, "first", lease=-1, processed=1, failed=0)
+
+        # until the lease expires, after which the first worker's updates are ignored
+        claimed = await reopened.claim("second", lease=60)
+        assert claimed.id == job.id
+        assert claimed.payload == '{"inputs": []}'
+        assert claimed.attempts == 2
+        assert not await reopened.fail(job.id, "first", error="too late")
+        assert (await reopened.get(job.id)).status == "running"
+        await reopened.close()
+
+
+class TestJobWorkers:
+
+    @pytest.mark.asyncio
+    async def test_runs_jobs_with_progress(self, queue):
+        async def run(job, progress):
+            progress(BatchResult(index=0, count=2, success=True))
+            progress(BatchResult(index=1, count=0, success=False, ids=["c"]))
+            return InsertionResult[EmbeddingRead](count=2, items=[EmbeddingRead(id="a"), EmbeddingRead(id="b")])
+
+        workers = JobWorkers(queue=queue, concurrency=1, poll_interval=0.01)
+        workers.start(run=run)
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload="{}", total=3)
+        workers.notify()
+        try:
+            job = await wait_for_status(queue, job.id, "completed")
+        finally:
+            await workers.stop()
+
+        assert (job.processed, job.failed) == (3, 1)
+        assert [o.id for o in job.result.items] == ["a", "b"]
+
+    @pytest.mark.asyncio
+    async def test_retries_failed_batches(self, queue):
+        payloads = []
+
+        async def run(job, progress):
+            payload = json.loads(job.payload)
+            payloads.append([o["id"] for o in payload["inputs"]])
+            if len(payloads) == 1:
+                progress(BatchResult(index=0, count=1, success=True))
+                progress(BatchResult(index=1, count=0, success=False, ids=["b"]))
+                return InsertionResult[EmbeddingRead](count=1, items=[EmbeddingRead(id="a")], batches=[
+                    BatchResult(index=0, count=1, success=True),
+                    BatchResult(index=1, count=0, success=False, ids=["b"])
+                ])
+            progress(BatchResult(index=0, count=1, success=True))
+            return InsertionResult[EmbeddingRead](count=1, items=[EmbeddingRead(id="b")], batches=[
+                BatchResult(index=0, count=1, success=True)
+            ])
+
+        workers = JobWorkers(queue=queue, concurrency=1, retry_delay=0, poll_interval=0.01)
+        workers.start(run=run)
+        payload = json.dumps({"inputs": [{"id": "a", "text": "a"}, {"id": "b", "text": "b"}]})
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload=payload, total=2)
+        try:
+            job = await wait_for_status(queue, job.id, "completed")
+        finally:
+            await workers.stop()
+
+        assert payloads == [["a", "b"], ["b"]]
+        assert (job.processed, job.failed) == (2, 0)
+        assert [o.id for o in job.result.items] == ["a", "b"]
+        assert all(o.success for o in job.result.batches)
+
+    @pytest.mark.asyncio
+    async def test_partial_after_last_attempt(self, queue):
+        async def run(job, progress):
+            return InsertionResult[EmbeddingRead](count=0, items=[], batches=[
+                BatchResult(index=0, count=0, success=False, ids=["a"])
+            ])
+
+        workers = JobWorkers(queue=queue, concurrency=1, max_attempts=2, retry_delay=0, poll_interval=0.01)
+        workers.start(run=run)
+        payload = json.dumps({"inputs": [{"id": "a", "text": "a"}]})
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload=payload, total=1)
+        try:
+            job = await wait_for_status(queue, job.id, "partial")
+        finally:
+            await workers.stop()
+
+        assert job.attempts == 2
+        assert job.error == "1 inputs could not be stored after 2 attempts"
+
+    @pytest.mark.asyncio
+    async def test_retries_then_fails(self, queue):
+        attempts = []
+
+        async def run(job, progress):
+            attempts.append(job.attempts)
+            raise RuntimeError("upstream unavailable")
+
+        workers = JobWorkers(queue=queue, concurrency=1, max_attempts=3, retry_delay=0, poll_interval=0.01)
+        workers.start(run=run)
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload="{}", total=1)
+        try:
+            job = await wait_for_status(queue, job.id, "failed")
+        finally:
+            await workers.stop()
+
+        assert attempts == [1, 2, 3]
+        assert job.error == "upstream unavailable"
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self, queue):
+        attempts = []
+
+        async def run(job, progress):
+            attempts.append(job.attempts)
+            raise NotFoundException("Collection with name a does not exist")
+
+        workers = JobWorkers(queue=queue, concurrency=1, retry_delay=0, poll_interval=0.01)
+        workers.start(run=run)
+        job = await queue.enqueue(backend="qdrant", namespace="a", payload="{}", total=1)
+        try:
+            await wait_for_status(queue, job.id, "failed")
+        finally:
+            await workers.stop()
+
+        assert attempts == [1]
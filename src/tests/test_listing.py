@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+import pytest_asyncio
+
+from app.config import settings
+from app.deps.request_params import common_params, encode_cursor
+from app.embeddings.cloudflare.service import embeddings, listing_prefetcher
+from app.embeddings.qdrant import service as qdrant_service
+from app.exceptions import BadRequestException
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.lib.cloudflare.models import CreateDatabaseRecord
+
+
+class StubAPI(AsyncAPI):
+    """Runs D1 statements against an in-memory SQLite database"""
+
+    def __init__(self):
+        super().__init__(api_token="token", account_id="account")
+        self.database = sqlite3.connect(":memory:")
+        self.database.row_factory = sqlite3.Row
+        self.statements = []
+
+    async def _request(self, method, path, data=None, ndjson=None):
+        results = []
+        for statement in data.get("batch", [data]):
+            self.statements.append(statement["sql"])
+            rows = self.database.execute(statement["sql"], statement.get("params", [])).fetchall()
+            results.append({"success": True, "results": [dict(o) for o in rows]})
+        return results
+
+    async def vectors_by_ids(self, vector_index_name, ids):
+        return [{"id": o, "values": [0.5], "metadata": {}} for o in ids if o != "3"]
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch):
+    monkeypatch.setattr(settings, "CLOUDFLARE_D1_DATABASE_IDENTIFIER", "db")
+    client = StubAPI()
+    await client.upsert_database_table_records("db", "namespace", [
+        CreateDatabaseRecord(source=f"text {i}", vector_id=str(i)) for i in range(7)
+    ])
+    yield client
+    listing_prefetcher.clear()
+
+
+class TestCloudflareListing:
+
+    @pytest.mark.asyncio
+    async def test_cursor_pages(self, client):
+        pages = []
+        cursor = None
+        while True:
+            page = await embeddings(client, "namespace", common_params(page=1, limit=3, cursor=cursor))
+            pages.append([o.id for o in page.items])
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        # "3" is no longer in the index, so it's left out of its page
+        assert pages == [["0", "1", "2"], ["4", "5"], ["6"]]
+        assert all("OFFSET" not in o for o in client.statements if "vector_id FROM" in o)
+
+    @pytest.mark.asyncio
+    async def test_next_page_is_prefetched(self, client, monkeypatch):
+        monkeypatch.setattr(settings, "CLOUDFLARE_LISTING_PREFETCH", True)
+        first = await embeddings(client, "namespace", common_params(page=1, limit=3, cursor=None))
+        count = len(client.statements)
+        await embeddings(client, "namespace", common_params(page=2, limit=3, cursor=first.next_cursor))
+
+        # the second page reuses the lookup started by the first, and prefetches the third
+        assert len(client.statements) == count + 1
+
+    @pytest.mark.asyncio
+    async def test_no_prefetch_by_default(self, client):
+        count = len(client.statements)
+        await embeddings(client, "namespace", common_params(page=1, limit=3, cursor=None))
+        assert len(client.statements) == count + 1
+
+    @pytest.mark.asyncio
+    async def test_page_without_cursor(self, client):
+        page = await embeddings(client, "namespace", common_params(page=3, limit=3, cursor=None))
+        assert [o.id for o in page.items] == ["6"]
+        assert page.items[0].source == "text 6"
+        assert page.items[0].vector == [0.5]
+
+
+class TestQdrantListing:
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("cursor", [{"id": 1}, True, -1, 1.5, "abc"])
+    async def test_invalid_cursor(self, cursor):
+        with pytest.raises(BadRequestException):
+            await qdrant_service.embeddings(
+                None, "namespace", common_params(page=2, limit=3, cursor=encode_cursor(cursor))
+            )
+
+    @pytest.mark.asyncio
+    async def test_page_too_deep(self, monkeypatch):
+        monkeypatch.setattr(settings, "QDRANT_MAX_PAGE_OFFSET", 100)
+        with pytest.raises(BadRequestException):
+            await qdrant_service.embeddings(None, "namespace", common_params(page=12, limit=10, cursor=None))
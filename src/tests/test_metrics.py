@@ -0,0 +1,109 @@
+import httpx
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.cloudflare.async_api import CloudflareRequestError, WORKERS_AI, VECTORIZE
+from app.lib.metrics import (
+    Registry,
+    MetricsMiddleware,
+    REQUEST_DURATION,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_RETRIES,
+    UPSTREAM_BATCH_SIZE
+)
+from app.lib.qdrant import QDRANT, add_retry_policy, retry_policy
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr("app.lib.retry.asyncio.sleep", sleep)
+
+
+def test_exposition():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ("code",))
+    histogram = registry.histogram("duration_seconds", "Duration", (0.1, 1), ("route",))
+    counter.inc(code='say "hi"\n')
+    counter.inc(2, code='say "hi"\n')
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+
+    assert registry.exposition().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{code="say \\"hi\\"\\n"} 3',
+        "# HELP duration_seconds Duration",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{route="/a",le="0.1"} 1',
+        'duration_seconds_bucket{route="/a",le="1"} 2',
+        'duration_seconds_bucket{route="/a",le="+Inf"} 2',
+        'duration_seconds_sum{route="/a"} 0.55',
+        'duration_seconds_count{route="/a"} 2',
+    ]
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Requests")
+
+
+def test_request_duration_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: str):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+
+    assert REQUEST_DURATION.histograms[("GET", "/items/{item_id}", "200")].count == 2
+    assert ("GET", "unmatched", "404") in REQUEST_DURATION.histograms
+
+
+@pytest.mark.asyncio
+async def test_cloudflare_calls(stub_api):
+    ok = UPSTREAM_REQUESTS.values.get((WORKERS_AI, "embed", "ok"), 0)
+    retries = UPSTREAM_RETRIES.values.get((WORKERS_AI, "embed"), 0)
+    batches = UPSTREAM_BATCH_SIZE.histograms[(WORKERS_AI, "embed")].sum \
+        if (WORKERS_AI, "embed") in UPSTREAM_BATCH_SIZE.histograms else 0
+
+    client = stub_api([CloudflareRequestError(10000, "HTTP response code 502", status=502)])
+    await client.embed(model=CloudflareEmbeddingModels.BAAISmall, texts=["a", "b"])
+
+    assert UPSTREAM_REQUESTS.values[(WORKERS_AI, "embed", "ok")] == ok + 1
+    assert UPSTREAM_RETRIES.values[(WORKERS_AI, "embed")] == retries + 1
+    # observed for both attempts
+    assert UPSTREAM_BATCH_SIZE.histograms[(WORKERS_AI, "embed")].sum == batches + 4
+
+    failed = UPSTREAM_REQUESTS.values.get((VECTORIZE, "vector_index_by_name", "3000"), 0)
+    client = stub_api([CloudflareRequestError(3000, "vectorize.index.not_found", status=404)])
+    with pytest.raises(CloudflareRequestError):
+        await client.vector_index_by_name("namespace")
+    assert UPSTREAM_REQUESTS.values[(VECTORIZE, "vector_index_by_name", "3000")] == failed + 1
+
+
+@pytest.mark.asyncio
+async def test_qdrant_calls():
+    def handler(request):
+        if request.url.path.endswith("/search"):
+            return httpx.Response(404, json={"status": {"error": "Not found"}, "time": 0})
+        return httpx.Response(200, json={"result": {"collections": []}, "status": "ok", "time": 0})
+
+    ok = UPSTREAM_REQUESTS.values.get((QDRANT, "get_collections", "ok"), 0)
+    not_found = UPSTREAM_REQUESTS.values.get((QDRANT, "search", "404"), 0)
+
+    client = AsyncQdrantClient(url="http://qdrant:6333", transport=httpx.MockTransport(handler))
+    add_retry_policy(client, retry_policy())
+    await client.get_collections()
+    with pytest.raises(Exception):
+        await client.search("namespace", query_vector=[0.5])
+
+    assert UPSTREAM_REQUESTS.values[(QDRANT, "get_collections", "ok")] == ok + 1
+    assert UPSTREAM_REQUESTS.values[(QDRANT, "search", "404")] == not_found + 1
@@ -0,0 +1,85 @@
+import json
+
+import httpx
+import pytest
+
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+
+from app.deps.request_params import common_params
+from app.exceptions import UnknownThirdPartyException, NotFoundException
+from app.lib.cloudflare.async_api import AsyncAPI
+from app.namespace.models import NamespaceBatchQuery
+from app.namespace.registry import namespace_registry, NamespaceInfo, QDRANT, CLOUDFLARE
+from app.namespace.qdrant.models import NamespaceCreate, PayloadIndexCreate
+from app.namespace.qdrant.service import create, query_batch
+from app.namespace.cloudflare.service import embedding_matches_batch
+
+
+class StubAPI(AsyncAPI):
+    """Embeds every text sent, less the last `dropped`"""
+
+    def __init__(self, dropped: int = 0):
+        super().__init__(api_token="token", account_id="account")
+        self.dropped = dropped
+
+    async def embed(self, model, texts):
+        texts = texts[:len(texts) - self.dropped]
+        return {"shape": [len(texts), 2], "data": [[0.5, 0.5] for _ in texts]}
+
+
+@pytest.fixture
+def registry():
+    namespace_registry.set(QDRANT, "namespace", NamespaceInfo(exists=True))
+    namespace_registry.set(CLOUDFLARE, "namespace", NamespaceInfo(exists=True))
+    yield namespace_registry
+    namespace_registry.clear()
+
+
+def qdrant_client(handler) -> AsyncQdrantClient:
+    return AsyncQdrantClient(url="http://qdrant:6333", transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_collection_deleted_when_payload_index_fails():
+    requests = []
+
+    def handler(request):
+        requests.append((request.method, request.url.path))
+        if request.url.path.endswith("/index") and json.loads(request.content)["field_name"] == "broken":
+            return httpx.Response(400, json={"status": {"error": "Bad request"}, "time": 0})
+        return httpx.Response(200, json={"result": True, "status": "ok", "time": 0})
+
+    client = qdrant_client(handler)
+    data_in = NamespaceCreate(name="namespace", dimensionality=4, payload_indexes=[
+        PayloadIndexCreate(field_name="category"),
+        PayloadIndexCreate(field_name="broken")
+    ])
+
+    with pytest.raises(UnknownThirdPartyException):
+        await create(data_in, client)
+
+    assert requests[0] == ("PUT", "/collections/namespace")
+    assert requests[-1] == ("DELETE", "/collections/namespace")
+
+
+@pytest.mark.asyncio
+async def test_batch_query_with_missing_embeddings(registry, monkeypatch):
+    monkeypatch.setattr("app.namespace.qdrant.service.cloudflare", StubAPI(dropped=1))
+    data_in = NamespaceBatchQuery(inputs=["a", "b"])
+
+    with pytest.raises(UnknownThirdPartyException):
+        await query_batch("namespace", data_in, common_params(page=1, limit=5, cursor=None), qdrant_client(lambda request: None))
+    with pytest.raises(UnknownThirdPartyException):
+        await embedding_matches_batch(StubAPI(dropped=1), "namespace", data_in)
+
+
+@pytest.mark.asyncio
+async def test_batch_query_missing_collection(registry, monkeypatch):
+    monkeypatch.setattr("app.namespace.qdrant.service.cloudflare", StubAPI())
+    data_in = NamespaceBatchQuery(inputs=["a", "b"])
+
+    def handler(request):
+        return httpx.Response(404, json={"status": {"error": "Not found: Collection `namespace` doesn't exist!"}, "time": 0})
+
+    with pytest.raises(NotFoundException):
+        await query_batch("namespace", data_in, common_params(page=1, limit=5, cursor=None), qdrant_client(handler))
@@ -0,0 +1,49 @@
+import pytest
+
+from app.embeddings.cloudflare.service import ensure_namespace
+from app.embeddings.models import EmbeddingCreateMulti
+from app.lib.cloudflare.async_api import AsyncAPI, CloudflareRequestError
+from app.namespace.registry import NamespaceRegistry, NamespaceInfo, namespace_registry, CLOUDFLARE
+
+
+class StubAPI(AsyncAPI):
+    """Reports the index as missing, then fails to create it because another worker just did"""
+
+    def __init__(self):
+        super().__init__(api_token="token", account_id="account")
+        self.lookups = 0
+
+    async def vector_index_by_name(self, name):
+        self.lookups += 1
+        if self.lookups == 1:
+            raise CloudflareRequestError(3000, "vectorize.index.not_found", status=404)
+        return {"config": {"dimensions": 384, "metric": "cosine"}}
+
+    async def create_vector_index(self, name, preset, description=None):
+        raise CloudflareRequestError(3002, "vectorize.index.duplicate_name", status=409)
+
+
+def test_misses_expire_sooner():
+    registry = NamespaceRegistry(ttl=300, miss_ttl=0)
+    registry.set(CLOUDFLARE, "exists", NamespaceInfo(exists=True))
+    registry.set(CLOUDFLARE, "missing", NamespaceInfo(exists=False))
+
+    assert registry.get(CLOUDFLARE, "exists").exists
+    assert registry.get(CLOUDFLARE, "missing") is None
+
+
+@pytest.mark.asyncio
+async def test_cloudflare_create_conflict_looks_namespace_up_again():
+    namespace_registry.clear()
+    client = StubAPI()
+    data_in = EmbeddingCreateMulti(
+        inputs=[{"text": "a"}],
+        embedding_model="@cf/baai/bge-small-en-v1.5",
+        create_namespace=True
+    )
+
+    await ensure_namespace(client, "namespace", data_in)
+
+    assert client.lookups == 2
+    assert namespace_registry.get(CLOUDFLARE, "namespace").exists
+    namespace_registry.clear()
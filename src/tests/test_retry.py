@@ -0,0 +1,115 @@
+import httpx
+import pytest
+
+from qdrant_client.async_qdrant_client import AsyncQdrantClient
+
+from app.exceptions import UpstreamUnavailableException
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.cloudflare.models import VectorPayloadItem
+from app.lib.cloudflare.async_api import CloudflareRequestError, VECTORIZE
+from app.lib.qdrant import add_retry_policy, retry_policy as qdrant_retry_policy
+
+
+def error(status: int, code: int = 10000, retry_after: float = None):
+    return CloudflareRequestError(code, f"HTTP response code {status}", status=status, retry_after=retry_after)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+    monkeypatch.setattr("app.lib.retry.asyncio.sleep", sleep)
+    return sleeps
+
+
+class TestRetryPolicy:
+
+    @pytest.mark.asyncio
+    async def test_transient_errors_are_retried(self, sleeps, stub_api):
+        client = stub_api([error(502), error(429, retry_after=3)], delay=0.1)
+        await client.embed(model=CloudflareEmbeddingModels.BAAISmall, texts=["a"])
+
+        assert client.attempts == 3
+        assert sleeps[0] <= 0.1 and sleeps[1] == 3
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self, sleeps, stub_api):
+        client = stub_api([error(404, code=3000)])
+        with pytest.raises(CloudflareRequestError):
+            await client.vector_index_by_name("namespace")
+        assert client.attempts == 1
+
+    @pytest.mark.asyncio
+    async def test_non_idempotent_only_retried_when_rate_limited(self, sleeps, stub_api):
+        client = stub_api([error(429), error(500)])
+        with pytest.raises(CloudflareRequestError):
+            await client.create_vector_index(name="namespace", preset="preset")
+        assert client.attempts == 2
+
+    @pytest.mark.asyncio
+    async def test_deadline(self, sleeps, stub_api):
+        client = stub_api([error(429, retry_after=60)], deadline=10)
+        with pytest.raises(CloudflareRequestError):
+            await client.vector_index_by_name("namespace")
+        assert client.attempts == 1 and not sleeps
+
+    @pytest.mark.asyncio
+    async def test_breaker_fails_fast(self, sleeps, stub_api):
+        client = stub_api([error(503)] * 4, tries=2, failure_threshold=3)
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await client.vector_index_by_name("namespace")
+
+        with pytest.raises(UpstreamUnavailableException) as ex:
+            await client.vector_index_by_name("namespace")
+        assert client.attempts == 3
+        assert ex.value.retry_after > 0
+        assert client.retry_policies[VECTORIZE].breaker.state == "open"
+        # other upstreams are unaffected
+        await client.embed(model=CloudflareEmbeddingModels.BAAISmall, texts=["a"])
+
+    @pytest.mark.asyncio
+    async def test_breaker_reset_by_rejections_only(self, sleeps, stub_api):
+        client = stub_api([error(503), KeyError("result"), error(503)], tries=1, failure_threshold=2)
+        for _ in range(3):
+            with pytest.raises(Exception):
+                await client.vector_index_by_name("namespace")
+        assert client.retry_policies[VECTORIZE].breaker.state == "open"
+
+        client = stub_api([error(503), error(400), error(503)], tries=1, failure_threshold=2)
+        for _ in range(3):
+            with pytest.raises(Exception):
+                await client.vector_index_by_name("namespace")
+        assert client.retry_policies[VECTORIZE].breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_insert_creating_index_retries_each_call_once(self, sleeps, stub_api):
+        vectors = [VectorPayloadItem(id="a", values=[0.5] * 384, metadata={})]
+        client = stub_api([error(404, code=3000), error(503)])
+        with pytest.raises(CloudflareRequestError):
+            await client.insert_vectors("namespace", vectors, create_on_not_found=True)
+        # the index creation isn't idempotent, so neither it nor the insert before it is repeated
+        assert client.attempts == 2
+
+        client = stub_api([error(404, code=3000), None, error(503)])
+        await client.insert_vectors("namespace", vectors, create_on_not_found=True)
+        assert client.attempts == 4
+
+
+class TestQdrantRetryMiddleware:
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_responses(self, sleeps, stub_api):
+        statuses = [503, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), json={"result": {"collections": []}, "status": "ok", "time": 0})
+
+        client = AsyncQdrantClient(url="http://qdrant:6333", transport=httpx.MockTransport(handler))
+        add_retry_policy(client, qdrant_retry_policy())
+        result = await client.get_collections()
+
+        assert result.collections == [] and not statuses
+        assert len(sleeps) == 1
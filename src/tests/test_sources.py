@@ -0,0 +1,42 @@
+import pytest
+
+from app.lib.sources import SQLiteSourceStore
+from app.lib.cloudflare.models import CreateDatabaseRecord
+
+
+class TestSQLiteSourceStore:
+
+    @pytest.mark.asyncio
+    async def test_put_and_get(self, tmp_path):
+        store = SQLiteSourceStore(path=str(tmp_path / "sources.db"))
+        await store.put_many("a", [
+            CreateDatabaseRecord(vector_id="1", source="it's quoted"),
+            CreateDatabaseRecord(vector_id="2", source="second")
+        ])
+        await store.put_many("a", [CreateDatabaseRecord(vector_id="2", source="replaced")])
+        await store.put_many("b", [CreateDatabaseRecord(vector_id="1", source="other namespace")])
+
+        assert await store.get_many("a", ["1", "2", "3"]) == {"1": "it's quoted", "2": "replaced"}
+        assert await store.get_many("b", ["1"]) == {"1": "other namespace"}
+        assert await store.get_many("a", []) == {}
+        await store.close()
+
+    @pytest.mark.asyncio
+    async def test_durable(self, tmp_path):
+        path = str(tmp_path / "sources.db")
+        store = SQLiteSourceStore(path=path)
+        await store.put_many("a", [CreateDatabaseRecord(vector_id="1", source="text")])
+        await store.close()
+
+        reopened = SQLiteSourceStore(path=path)
+        assert await reopened.get_many("a", ["1"]) == {"1": "text"}
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_get_many_beyond_parameter_limit(self, tmp_path):
+        store = SQLiteSourceStore(path=str(tmp_path / "sources.db"))
+        await store.put_many("a", [CreateDatabaseRecord(vector_id=str(i), source=f"text {i}") for i in range(2500)])
+
+        sources = await store.get_many("a", [str(i) for i in range(10000)])
+        assert len(sources) == 2500 and sources["2499"] == "text 2499"
+        await store.close()
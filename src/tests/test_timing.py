@@ -0,0 +1,103 @@
+import json
+import asyncio
+
+from fastapi import FastAPI, APIRouter
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from app.lib.timing import TimingMiddleware, TimedRoute, SpanExporter, FileSpanExporter, Timings, stage
+
+
+class Item(BaseModel):
+    text: str
+
+
+class FailingExporter(SpanExporter):
+
+    def export(self, scope, timings, status_code, ended_at):
+        raise OSError("No space left on device")
+
+
+def create_app(**kwargs) -> FastAPI:
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.post("/items/{namespace}")
+    async def create_item(namespace: str, item: Item):
+        with stage("embed"):
+            await asyncio.sleep(0.01)
+        return {"namespace": namespace, "text": item.text}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(TimingMiddleware, **kwargs)
+    return app
+
+
+def server_timing(response) -> dict:
+    metrics = {}
+    for metric in response.headers["Server-Timing"].split(", "):
+        name, duration = metric.split(";dur=")
+        metrics[name] = float(duration)
+    return metrics
+
+
+def test_server_timing_header():
+    response = TestClient(create_app()).post("/items/namespace", json={"text": "a"})
+
+    metrics = server_timing(response)
+    assert list(metrics) == ["parse", "embed", "serialize", "total"]
+    assert metrics["embed"] >= 10
+    assert metrics["total"] >= sum(duration for name, duration in metrics.items() if name != "total")
+
+
+def test_server_timing_disabled():
+    response = TestClient(create_app(server_timing=False)).post("/items/namespace", json={"text": "a"})
+    assert "Server-Timing" not in response.headers
+
+
+def test_stage_outside_request():
+    with stage("embed") as timed:
+        pass
+    assert timed.timings is None
+
+
+def test_stages_are_summed():
+    timings = Timings()
+    timings.record("search", timings.started_at, 0.002)
+    timings.record("search", timings.started_at, 0.003)
+    assert timings.server_timing().startswith("search;dur=5.0, total;dur=")
+
+
+def test_file_span_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = FileSpanExporter(path=str(path), service_name="embeddings")
+    client = TestClient(create_app(exporter=exporter))
+
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    client.post("/items/namespace", json={"text": "a"}, headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+    client.post("/items/namespace", json={"text": "b"})
+    exporter.close()
+
+    lines = [json.loads(o) for o in path.read_text().splitlines()]
+    assert len(lines) == 2
+
+    spans = lines[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, children = spans[0], spans[1:]
+    assert root["name"] == "POST /items/{namespace}"
+    assert root["traceId"] == trace_id and root["parentSpanId"] == parent_id
+    assert [o["name"] for o in children] == ["parse", "embed", "serialize"]
+    assert all(o["traceId"] == trace_id and o["parentSpanId"] == root["spanId"] for o in children)
+    assert all(
+        int(root["startTimeUnixNano"]) <= int(o["startTimeUnixNano"]) <= int(o["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+        for o in children
+    )
+
+    other = lines[1]["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert other["traceId"] != trace_id and "parentSpanId" not in other
+
+
+def test_export_failure_is_logged(caplog):
+    response = TestClient(create_app(exporter=FailingExporter())).post("/items/namespace", json={"text": "a"})
+
+    assert response.status_code == 200
+    assert "could not be exported" in caplog.text
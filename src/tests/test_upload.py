@@ -0,0 +1,156 @@
+import gzip
+import json
+import asyncio
+
+import pytest
+
+from app.embeddings.models import EmbeddingsCreateSingle
+from app.embeddings.utils import ndjson_lines, stream_batches, stream_upload, dispatch_batches
+from app.exceptions import NotFoundException, PayloadTooLargeException
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+
+
+async def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(iterator):
+    return [o async for o in iterator]
+
+
+class TestNdjsonLines:
+
+    @pytest.mark.asyncio
+    async def test_lines_split_across_chunks(self):
+        data = b'{"text": "a"}\n\n{"text": "bb"}\n{"text": "ccc"}'
+        assert await collect(ndjson_lines(chunks(data, 5))) == [
+            b'{"text": "a"}', b'{"text": "bb"}', b'{"text": "ccc"}'
+        ]
+
+    @pytest.mark.asyncio
+    async def test_gzipped(self):
+        data = gzip.compress(b'{"text": "a"}\n{"text": "bb"}\n')
+        assert await collect(ndjson_lines(chunks(data, 7), gzipped=True)) == [
+            b'{"text": "a"}', b'{"text": "bb"}'
+        ]
+
+    @pytest.mark.asyncio
+    async def test_line_too_long(self):
+        data = gzip.compress(b'{"text": "a"}\n' + b"a" * 10 ** 7)
+        lines = ndjson_lines(chunks(data, 1024), gzipped=True, max_line_size=1000)
+        assert await lines.__anext__() == b'{"text": "a"}'
+        with pytest.raises(PayloadTooLargeException):
+            await lines.__anext__()
+
+    @pytest.mark.asyncio
+    async def test_long_lines_within_limit(self):
+        data = b"a" * 5000 + b"\n" + b"b" * 10
+        assert await collect(ndjson_lines(chunks(data, 7), max_line_size=5000)) == [b"a" * 5000, b"b" * 10]
+
+
+class TestStreamBatches:
+
+    @pytest.mark.asyncio
+    async def test_bounded_in_flight(self):
+        read = 0
+        in_flight = 0
+        max_in_flight = 0
+
+        async def inputs():
+            nonlocal read
+            for i in range(10):
+                read += 1
+                yield EmbeddingsCreateSingle(id=str(i), text=str(i))
+
+        async def process(batch):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if batch[0].id == "4":
+                raise RuntimeError("upstream unavailable")
+            return [o.id for o in batch]
+
+        results = await collect(stream_batches(inputs(), batch_size=2, process=process, concurrency=2))
+
+        assert read == 10
+        assert max_in_flight == 2
+        assert sorted(o.index for o in results) == [0, 1, 2, 3, 4]
+        failed = [o for o in results if not o.success]
+        assert len(failed) == 1 and failed[0].ids == ["4", "5"]
+
+
+class TestDispatchBatches:
+
+    @pytest.mark.asyncio
+    async def test_client_error_cancels_other_batches(self):
+        processed = []
+
+        async def process(batch):
+            if batch[0].id == "2":
+                raise NotFoundException("Namespace not found")
+            await asyncio.sleep(0.05)
+            processed.extend(o.id for o in batch)
+            return [o.id for o in batch]
+
+        inputs = [EmbeddingsCreateSingle(id=str(i), text=str(i)) for i in range(8)]
+        with pytest.raises(NotFoundException):
+            await dispatch_batches(inputs, batch_size=2, process=process, concurrency=3)
+
+        await asyncio.sleep(0.1)
+        assert processed == []
+
+
+class TestStreamUpload:
+
+    @pytest.mark.asyncio
+    async def test_vector_dimensionality_checked_per_line(self):
+        processed = []
+
+        async def lines():
+            yield b'{"id": "a", "text": "a", "vector": [0.5, 0.5]}'
+            yield ('{"id": "b", "text": "b", "vector": [%s]}' % ", ".join(["0.5"] * 384)).encode("utf-8")
+            yield b'{"id": "c", "text": "c"}'
+
+        async def process(batch):
+            processed.extend(o.id for o in batch)
+            return [o.id for o in batch]
+
+        output = [json.loads(o) for o in await collect(stream_upload(
+            lines(), batch_size=10, process=process, model=CloudflareEmbeddingModels.BAAISmall
+        ))]
+
+        assert processed == ["b", "c"]
+        assert output[1]["line"] == 1 and "has 2 dimensions" in output[1]["detail"]
+        assert output[-1] == {"count": 2, "failed": 0, "invalid": 1, "batches": 1}
+
+    @pytest.mark.asyncio
+    async def test_line_too_long_after_first_batch(self):
+        async def lines():
+            yield b'{"id": "a", "text": "a"}'
+            await asyncio.sleep(0.01)
+            raise PayloadTooLargeException("Upload contains a line longer than 1000 bytes")
+
+        async def process(batch):
+            return [o.id for o in batch]
+
+        output = [json.loads(o) for o in await collect(stream_upload(
+            lines(), batch_size=1, process=process, model=CloudflareEmbeddingModels.BAAISmall
+        ))]
+
+        assert output[1]["line"] == 2 and "not read" in output[1]["detail"]
+        assert output[-1] == {"count": 1, "failed": 0, "invalid": 1, "batches": 1}
+
+    @pytest.mark.asyncio
+    async def test_line_too_long_before_any_output(self):
+        async def lines():
+            raise PayloadTooLargeException("Upload contains a line longer than 1000 bytes")
+            yield
+
+        async def process(batch):
+            return [o.id for o in batch]
+
+        with pytest.raises(PayloadTooLargeException):
+            await collect(stream_upload(lines(), batch_size=1, process=process, model=CloudflareEmbeddingModels.BAAISmall))
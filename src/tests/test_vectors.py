@@ -0,0 +1,116 @@
+import json
+import base64
+
+import pytest
+
+from pydantic import ValidationError
+
+from app.exceptions import BadRequestException, EmbeddingDimensionalityException
+from app.lib.cloudflare.constants import CloudflareEmbeddingModels
+from app.lib.vectors import encode_vector, decode_vector
+from app.embeddings.models import EmbeddingsCreateSingle, EmbeddingCreateMulti, EmbeddingRead, EmbeddingPagination
+from app.lib.responses import ModelResponse
+from app.embeddings.utils import embed_inputs
+from app.embeddings.qdrant import service as qdrant_service
+from app.embeddings.cloudflare import service as cloudflare_service
+from app.jobs import service as jobs_service
+
+
+VECTOR = [0.5, -0.25, 0.125, 1.0]
+
+
+class TestVectorEncoding:
+
+    def test_float_is_unchanged(self):
+        assert encode_vector(VECTOR) is VECTOR
+        assert encode_vector(None, "base64") is None
+
+    @pytest.mark.parametrize("encoding_format,size", [("base64", 4), ("base64_float16", 2)])
+    def test_round_trip(self, encoding_format, size):
+        encoded = encode_vector(VECTOR, encoding_format)
+        assert len(base64.b64decode(encoded)) == len(VECTOR) * size
+        assert decode_vector(encoded, encoding_format) == VECTOR
+
+    def test_named_vectors(self):
+        encoded = encode_vector({"text": VECTOR}, "base64")
+        assert decode_vector(encoded["text"]) == VECTOR
+
+    def test_decode_list(self):
+        assert decode_vector([1, 2]) == [1.0, 2.0]
+
+    @pytest.mark.parametrize("value", ["not base64!", base64.b64encode(b"abc").decode()])
+    def test_decode_invalid(self, value):
+        with pytest.raises(BadRequestException):
+            decode_vector(value)
+
+    def test_float16_overflow(self):
+        with pytest.raises(BadRequestException):
+            encode_vector([1e6], "base64_float16")
+
+
+class TestPrecomputedVectors:
+
+    def test_packed_vector_is_decoded(self):
+        item = EmbeddingsCreateSingle(text="a", vector=encode_vector(VECTOR, "base64_float16"), encoding_format="base64_float16")
+        assert item.vector == VECTOR
+
+        with pytest.raises(ValidationError):
+            EmbeddingsCreateSingle(text="a", vector="not base64!")
+
+    @pytest.mark.asyncio
+    async def test_dimensionality_checked_against_model(self):
+        data_in = EmbeddingCreateMulti(
+            embedding_model=CloudflareEmbeddingModels.BAAISmall,
+            inputs=[EmbeddingsCreateSingle(id="a", text="a", vector=VECTOR)]
+        )
+        details = set()
+        # rejected before the backend or the queue is touched
+        for check in (
+            qdrant_service.ensure_namespace(None, "ns", data_in),
+            cloudflare_service.ensure_namespace(None, "ns", data_in),
+            jobs_service.enqueue(None, "qdrant", "ns", data_in)
+        ):
+            with pytest.raises(EmbeddingDimensionalityException) as ex:
+                await check
+            details.add(ex.value.args[0])
+        assert details == {
+            f"Vector of input 'a' has {len(VECTOR)} dimensions, whereas the embedding model "
+            f"{CloudflareEmbeddingModels.BAAISmall} has {CloudflareEmbeddingModels.BAAISmall.dimensionality}."
+        }
+
+    @pytest.mark.asyncio
+    async def test_only_missing_vectors_are_embedded(self):
+        model = CloudflareEmbeddingModels.BAAISmall
+        precomputed = [0.5] * model.dimensionality
+        requests = []
+
+        async def embed(model, texts):
+            requests.append(texts)
+            return {"data": [[float(len(o))] * 2 for o in texts]}
+
+        vectors = await embed_inputs(embed, model, [
+            EmbeddingsCreateSingle(text="a"),
+            EmbeddingsCreateSingle(text="b", vector=precomputed),
+            EmbeddingsCreateSingle(text="ccc")
+        ])
+        assert requests == [["a", "ccc"]]
+        assert vectors == [[1.0, 1.0], precomputed, [3.0, 3.0]]
+
+        await embed_inputs(embed, model, [EmbeddingsCreateSingle(text="b", vector=precomputed)])
+        assert len(requests) == 1
+
+        with pytest.raises(EmbeddingDimensionalityException):
+            await embed_inputs(embed, model, [EmbeddingsCreateSingle(text="b", vector=VECTOR)])
+
+
+class TestModelResponse:
+
+    def test_constructed_models_serialize_like_validated_ones(self):
+        items = [EmbeddingRead(id="a", vector=VECTOR, payload={"k": 1})]
+        validated = EmbeddingPagination(items=items, total=1, page=1)
+        constructed = EmbeddingPagination.model_construct(
+            items=[EmbeddingRead.model_construct(id="a", vector=VECTOR, payload={"k": 1}, source=None)],
+            total=1,
+            page=1
+        )
+        assert json.loads(ModelResponse(constructed).body) == json.loads(validated.model_dump_json())